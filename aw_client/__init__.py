@@ -1,3 +1,31 @@
-from .client import ActivityWatchClient
+from typing import TYPE_CHECKING
 
-__all__ = ["ActivityWatchClient"]
+if TYPE_CHECKING:
+    from .client import ActivityWatchClient
+    from .eventframe import EventFrame
+    from .querycache import QueryCache
+    from .transport import HTTPTransport
+
+__all__ = ["ActivityWatchClient", "EventFrame", "HTTPTransport", "QueryCache"]
+
+# Submodules are imported on first access, so that importing the package (as the CLI does) is fast
+_lazy = {
+    "ActivityWatchClient": "client",
+    "EventFrame": "eventframe",
+    "HTTPTransport": "transport",
+    "QueryCache": "querycache",
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy:
+        from importlib import import_module
+
+        value = getattr(import_module(f".{_lazy[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
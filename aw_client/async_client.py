@@ -0,0 +1,616 @@
+"""
+An asyncio version of ActivityWatchClient, built on aiohttp.
+
+Requires the `async` extra: `pip install aw-client[async]`
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import aiohttp
+from aw_core.models import Event
+
+from .client import (
+    Bucket,
+    _compact_queue,
+    _events_params,
+    _query_request,
+    coalesce_heartbeats,
+)
+from .config import load_config
+from .jsoncodec import dumps, loads
+from .premerge import HeartbeatPremerger
+from .queuebackend import QueuedRequest, QueueBackend, open_queue_backend
+from .reconnect import Backoff, CircuitBreaker
+from .singleinstance import SingleInstance
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncActivityWatchClient:
+    def __init__(
+        self,
+        client_name: str = "unknown",
+        testing=False,
+        host=None,
+        port=None,
+        protocol="http",
+        pool_size: int = 20,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """
+        An asyncio wrapper around the aw-server REST API, with the same methods as ActivityWatchClient.
+
+        All requests share one aiohttp connection pool of at most `pool_size` connections,
+        so fanning out requests with `asyncio.gather` is cheap.
+
+        Can be used with an `async with`-statement as an alternative to manually awaiting connect and disconnect.
+
+        :Example:
+
+            async with AsyncActivityWatchClient("my-client") as client:
+                buckets = await client.get_buckets()
+                events = await asyncio.gather(*(client.get_events(b) for b in buckets))
+        """
+        self.testing = testing
+
+        self.client_name = client_name
+        self.client_hostname = socket.gethostname()
+
+        _config = load_config()
+        server_config = _config["server" if not testing else "server-testing"]
+        client_config = _config["client" if not testing else "client-testing"]
+
+        server_host = host or server_config["hostname"]
+        server_port = port or server_config["port"]
+        self.server_address = f"{protocol}://{server_host}:{server_port}"
+
+        # Taken once requests are queued, see `instance`
+        self._instance_name = f"{self.client_name}-at-{server_host}-on-{server_port}"
+        self._instance: Optional[SingleInstance] = None
+
+        self.commit_interval = client_config["commit_interval"]
+        # Limits of the request queue, applied when it's compacted
+        self.queue_max_size = int(client_config["queue_max_size_mb"] * 1024 * 1024)
+        self.queue_max_age = timedelta(days=client_config["queue_max_age_days"])
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Created on first use, like ActivityWatchClient.request_queue
+        self._request_queue: Optional[AsyncRequestQueue] = None
+        # Guards the request queue, which the flush timer thread of the premerger also uses
+        self._request_queue_lock = threading.Lock()
+        # The event loop the client was connected on, set by connect()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Merges queued heartbeats before they are queued, as ActivityWatchClient does
+        self.premerge = HeartbeatPremerger(self._queue_heartbeat)
+
+    @property
+    def instance(self) -> SingleInstance:
+        """Lock held while the client is queueing requests, so only one instance of a client runs at a time."""
+        with self._request_queue_lock:
+            if self._instance is None:
+                self._instance = SingleInstance(self._instance_name)
+            return self._instance
+
+    @property
+    def request_queue(self) -> "AsyncRequestQueue":
+        """The queue of requests sent in the background, created on first use."""
+        with self._request_queue_lock:
+            if self._request_queue is None:
+                # Only one instance of a client may queue requests to the same queue file
+                if self._instance is None:
+                    self._instance = SingleInstance(self._instance_name)
+                self._request_queue = AsyncRequestQueue(
+                    self, max_size=self.queue_max_size, max_age=self.queue_max_age
+                )
+            return self._request_queue
+
+    def _start_request_queue(self) -> None:
+        """Starts the request queue if the client is connected, once it's been used."""
+        loop, request_queue = self._loop, self._request_queue
+        if loop is None or request_queue is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            request_queue.start()
+        else:
+            # Such as from the flush timer thread of the premerger
+            loop.call_soon_threadsafe(self._start_request_queue)
+
+    #
+    #   Get/Post base requests
+    #
+
+    def _url(self, endpoint: str):
+        return f"{self.server_address}/api/0/{endpoint}"
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily, since a ClientSession has to be created from within a running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                raise_for_status=True,
+            )
+        return self._session
+
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Any = None,
+        params: Optional[dict] = None,
+    ) -> bytes:
+        headers = {"Content-type": "application/json", "charset": "utf-8"}
+        body = dumps(data) if data is not None else None
+        try:
+            async with self.session.request(
+                method, self._url(endpoint), data=body, headers=headers, params=params
+            ) as response:
+                return await response.read()
+        except aiohttp.ClientResponseError as e:
+            logger.warning(str(e))
+            raise
+
+    async def _get(self, endpoint: str, params: Optional[dict] = None) -> Any:
+        return loads(await self._request("GET", endpoint, params=params) or "null")
+
+    async def _post(
+        self,
+        endpoint: str,
+        data: Any,
+        params: Optional[dict] = None,
+    ) -> Any:
+        return loads(
+            await self._request("POST", endpoint, data, params=params) or "null"
+        )
+
+    async def _delete(self, endpoint: str, data: Any = None) -> None:
+        await self._request("DELETE", endpoint, data if data is not None else {})
+
+    async def get_info(self):
+        """Returns a dict currently containing the keys 'hostname' and 'testing'."""
+        return await self._get("info")
+
+    #
+    #   Event get/post requests
+    #
+
+    async def get_event(
+        self,
+        bucket_id: str,
+        event_id: int,
+    ) -> Optional[Event]:
+        endpoint = f"buckets/{bucket_id}/events/{event_id}"
+        try:
+            return Event(**await self._get(endpoint))
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def get_events(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Event]:
+        endpoint = f"buckets/{bucket_id}/events"
+        params = _events_params(limit, start, end)
+        events = await self._get(endpoint, params=params)
+        return [Event(**event) for event in events]
+
+    async def insert_event(self, bucket_id: str, event: Event) -> None:
+        endpoint = f"buckets/{bucket_id}/events"
+        await self._post(endpoint, [event])
+
+    async def insert_events(self, bucket_id: str, events: List[Event]) -> None:
+        endpoint = f"buckets/{bucket_id}/events"
+        await self._post(endpoint, list(events))
+
+    async def delete_event(self, bucket_id: str, event_id: int) -> None:
+        await self._delete(f"buckets/{bucket_id}/events/{event_id}")
+
+    async def get_eventcount(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> int:
+        endpoint = f"buckets/{bucket_id}/events/count"
+        params = _events_params(None, start, end)
+        return int(await self._get(endpoint, params=params))
+
+    async def heartbeat(
+        self,
+        bucket_id: str,
+        event: Event,
+        pulsetime: float,
+        queued: bool = False,
+        commit_interval: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            bucket_id: The bucket_id of the bucket to send the heartbeat to
+            event: The actual heartbeat event
+            pulsetime: The maximum amount of time in seconds since the last heartbeat to be merged with the previous heartbeat in aw-server
+            queued: Use the aw-client queue feature to queue events if client loses connection with the server
+            commit_interval: Override default pre-merge commit interval
+
+        NOTE: Queued heartbeats are sent by the queue dispatcher task started by `connect()`,
+              so the call returns as soon as the heartbeat has been pre-merged.
+        """
+
+        endpoint = f"buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}"
+
+        if queued:
+            # Pre-merge heartbeats, merged events are queued by the premerger
+            self.premerge.add(
+                bucket_id,
+                endpoint,
+                event.timestamp,
+                event.duration,
+                event.data,
+                pulsetime,
+                commit_interval or self.commit_interval,
+            )
+        else:
+            await self._post(endpoint, event)
+
+    def _queue_heartbeat(self, endpoint: str, data: dict) -> None:
+        # Called from the event loop, or from the flush timer thread of the premerger
+        self.request_queue.add_request_threadsafe(endpoint, data)
+        self._start_request_queue()
+
+    @property
+    def last_heartbeat(self) -> Dict[str, Event]:
+        """The pre-merged, possibly not yet queued, heartbeat of each bucket."""
+        return {
+            bucket_id: Event(**event)
+            for bucket_id, event in self.premerge.pending.items()
+        }
+
+    #
+    #   Bucket get/post requests
+    #
+
+    async def get_buckets(self) -> dict:
+        return await self._get("buckets/")
+
+    async def create_bucket(self, bucket_id: str, event_type: str, queued=False):
+        if queued:
+            self.request_queue.register_bucket(bucket_id, event_type)
+            self._start_request_queue()
+        else:
+            endpoint = f"buckets/{bucket_id}"
+            data = {
+                "client": self.client_name,
+                "hostname": self.client_hostname,
+                "type": event_type,
+            }
+            await self._post(endpoint, data)
+
+    async def delete_bucket(self, bucket_id: str, force: bool = False):
+        await self._delete(f"buckets/{bucket_id}" + ("?force=1" if force else ""))
+
+    # Import & export
+
+    async def export_all(self) -> dict:
+        return await self._get("export")
+
+    async def export_bucket(self, bucket_id) -> dict:
+        return await self._get(f"buckets/{bucket_id}/export")
+
+    async def import_bucket(self, bucket: dict) -> None:
+        await self._post("import", {"buckets": {bucket["id"]: bucket}})
+
+    #
+    #   Query (server-side transformation)
+    #
+
+    async def query(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        name: Optional[str] = None,
+        cache: bool = False,
+    ) -> List[Any]:
+        data, params = _query_request(query, timeperiods, name, cache)
+        return await self._post("query/", data, params=params)
+
+    #
+    # Settings
+    #
+
+    async def get_setting(self, key: Optional[str] = None) -> dict:
+        if key:
+            return await self._get(f"settings/{key}")
+        else:
+            return await self._get("settings")
+
+    async def set_setting(self, key: str, value: str) -> None:
+        await self._post(f"settings/{key}", value)
+
+    #
+    #   Connect and disconnect
+    #
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        self._start_request_queue()
+
+    async def disconnect(self):
+        # Queue pre-merged heartbeats, so that they are sent once the queue runs again
+        await asyncio.get_running_loop().run_in_executor(None, self.premerge.close)
+        self._loop = None
+        with self._request_queue_lock:
+            # Throw away the old queue, so that a window read but not yet sent is re-read on connect
+            request_queue, self._request_queue = self._request_queue, None
+        if request_queue is not None:
+            await request_queue.stop()
+            await request_queue.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def wait_for_start(self, timeout: int = 10) -> None:
+        """Wait for the server to start by trying to get the server info."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        sleep_time = 0.1
+        while loop.time() < deadline:
+            try:
+                await self.get_info()
+                break
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(sleep_time)
+                sleep_time *= 2
+        else:
+            raise Exception(f"Server at {self.server_address} did not start in time")
+
+
+class AsyncRequestQueue:
+    """Used to send queued heartbeats from an asyncio task.
+
+    Works like RequestQueue and uses the same file-backed queue, but runs as a task on the
+    event loop instead of in a thread. Queue storage is opened on first use, and all its
+    operations run in a single I/O thread, in the order they were submitted, so that they
+    never block the event loop.
+    """
+
+    VERSION = 2  # update this whenever the queue-file format changes
+
+    def __init__(
+        self,
+        client: AsyncActivityWatchClient,
+        batch_size: int = 100,
+        backend: Optional[QueueBackend] = None,
+        max_size: Optional[int] = None,
+        max_age: Optional[timedelta] = None,
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+        # Set by add_request, created by start() since it has to belong to the running event loop
+        self._new_requests: Optional[asyncio.Event] = None
+
+        # Buckets that will have events queued to them, will be created if they don't exist
+        self._registered_buckets: List[Bucket] = []
+
+        self._attempt_reconnect_interval = 10
+        # Delays between reconnect attempts and retries, see aw_client.reconnect
+        self.backoff = Backoff(maximum=self._attempt_reconnect_interval)
+        self.breaker = CircuitBreaker()
+
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compact_interval = 600
+        self._last_compaction: Optional[float] = None
+
+        # Opened by the first storage operation, in the I/O thread, see `_storage`
+        self._backend = backend
+        self._io = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="aw-client-async-queue"
+        )
+        # Coalesced, not-yet-sent requests from the window last read from the queue
+        self._window: List[QueuedRequest] = []
+
+    def _storage(self) -> QueueBackend:
+        """The queue storage, only to be used from the I/O thread."""
+        if self._backend is None:
+            self._backend = open_queue_backend(
+                self.client.client_name, self.client.testing, self.VERSION
+            )
+        return self._backend
+
+    def _read_window(self) -> List[QueuedRequest]:
+        window = self._storage().read(self.batch_size)
+        return coalesce_heartbeats(window) if len(window) > 1 else window
+
+    def _ack(self) -> None:
+        self._storage().ack()
+
+    def _qsize(self) -> int:
+        return self._storage().qsize()
+
+    def _put(self, request: QueuedRequest) -> None:
+        self._storage().put(request)
+        task, new_requests = self._task, self._new_requests
+        if task is not None and not task.done() and new_requests is not None:
+            task.get_loop().call_soon_threadsafe(new_requests.set)
+
+    def _put_logged(self, request: QueuedRequest) -> None:
+        try:
+            self._put(request)
+        except Exception:
+            logger.exception(f"Failed to queue request: {request.data}")
+
+    def _close(self) -> None:
+        if self._backend is not None:
+            self._backend.close()
+
+    async def _in_executor(self, f, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, f, *args)
+
+    async def _create_buckets(self) -> None:
+        for bucket in self._registered_buckets:
+            await self.client.create_bucket(bucket.id, bucket.type)
+
+    async def _try_connect(self) -> bool:
+        try:
+            # A cheap liveness probe, before creating all registered buckets
+            await self.client.get_info()
+            await self._create_buckets()
+            self.connected = True
+            self.breaker.half_open()
+            logger.info(
+                f"Connection to aw-server established by {self.client.client_name}"
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.connected = False
+        return self.connected
+
+    async def _dispatch_request(self) -> None:
+        assert self._new_requests is not None
+        if not self._window:
+            # Cleared before reading, so that a request added in between isn't missed
+            self._new_requests.clear()
+            self._window = await self._in_executor(self._read_window)
+            if not self._window:
+                await self._new_requests.wait()
+                return
+
+        request = self._window[0]
+        try:
+            await self.client._post(request.endpoint, request.data)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            logger.warning(
+                "Connection refused or timeout, will queue requests until connection is available."
+            )
+            self.breaker.open()
+            self.connected = False
+            return
+        except aiohttp.ClientResponseError as e:
+            if e.status == 500:
+                logger.error(f"Internal server error, retrying: {request.data}")
+                self.breaker.failure()
+                if self.breaker.is_open:
+                    self.connected = False
+                else:
+                    await asyncio.sleep(self.backoff.next())
+                return
+            logger.error(
+                f"Request failed with {e.status}, not retrying: {request.data}"
+            )
+        except Exception:
+            # Such as an invalid response, dropped so that the queue doesn't stop on it
+            logger.exception(f"Unknown error, not retrying: {request.data}")
+
+        self.breaker.success()
+        self.backoff.reset()
+        self._window.pop(0)
+        if not self._window:
+            # Acknowledge the whole window read from the queue at once
+            await self._in_executor(self._ack)
+
+    def _maybe_compact(self) -> None:
+        """Compacts the queue if it's due, or over its size limit, like RequestQueue does."""
+        if (
+            self._last_compaction is None
+            or time.monotonic() - self._last_compaction >= self.compact_interval
+            or (self.max_size is not None and self._storage().size() > self.max_size)
+        ):
+            self._last_compaction = time.monotonic()
+            try:
+                _compact_queue(self._storage(), self.max_size, self.max_age)
+            except Exception:
+                logger.exception("Failed to compact the request queue")
+
+    async def run(self) -> None:
+        await self._in_executor(self._maybe_compact)
+        while True:
+            if self.breaker.is_open:
+                await asyncio.sleep(self.backoff.next())
+            while not await self._try_connect():
+                delay = self.backoff.next()
+                qsize = await self._in_executor(self._qsize)
+                logger.warning(
+                    f"Not connected to server, {qsize} requests in queue,"
+                    f" retrying in {delay:.1f}s"
+                )
+                await self._in_executor(self._maybe_compact)
+                await asyncio.sleep(delay)
+
+            while self.connected:
+                await self._dispatch_request()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._new_requests = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def close(self) -> None:
+        """Closes the queue storage, once stopped."""
+        await self._in_executor(self._close)
+        self._io.shutdown()
+
+    async def add_request(self, endpoint: str, data: dict) -> None:
+        """
+        Add a request to the queue.
+        NOTE: Only supports heartbeats
+        """
+        assert "/heartbeat" in endpoint
+        assert isinstance(data, dict)
+        await self._in_executor(self._put, QueuedRequest(endpoint, data))
+
+    def add_request_threadsafe(self, endpoint: str, data: dict) -> None:
+        """
+        Same as `add_request`, but can be called from any thread, including the event loop.
+
+        Doesn't wait for the write, which is done in the I/O thread; failures are logged.
+        """
+        assert "/heartbeat" in endpoint
+        assert isinstance(data, dict)
+        self._io.submit(self._put_logged, QueuedRequest(endpoint, data))
+
+    def register_bucket(self, bucket_id: str, event_type: str) -> None:
+        self._registered_buckets.append(Bucket(bucket_id, event_type))
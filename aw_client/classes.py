@@ -6,10 +6,12 @@ Taken from default classes in aw-webui
 
 import logging
 import random
+import threading
 from typing import (
     Any,
     Dict,
     List,
+    Optional,
     Tuple,
 )
 
@@ -65,16 +67,41 @@ default_classes: List[Tuple[CategoryId, CategorySpec]] = [
 ]
 
 
-def get_classes() -> List[Tuple[List[str], dict]]:
+# Client used by get_classes when none is given, created on first use
+_default_client: Optional["aw_client.ActivityWatchClient"] = None
+_default_client_lock = threading.Lock()
+
+
+# The classes setting last read by get_classes, and the classes mapped from it
+_last_classes: Optional[Tuple[Any, List[Tuple[CategoryId, CategorySpec]]]] = None
+
+
+def _get_default_client() -> "aw_client.ActivityWatchClient":
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            # NOTE: Always tries to fetch from prod server,
+            #       which is potentially wrong if testing server is being used.
+            _default_client = aw_client.ActivityWatchClient(
+                f"get-setting-{random.randint(0, 10000)}"
+            )
+        return _default_client
+
+
+def get_classes(
+    client: Optional["aw_client.ActivityWatchClient"] = None,
+) -> List[Tuple[List[str], dict]]:
     """
     Get classes from server-side settings.
     Might throw a 404 if not set yet, in which case we use the default classes as a fallback.
+
+    The classes are read through the settings cache of `client`, or of a client shared by
+    all calls in the process if not given, so that they are only fetched once per TTL.
     """
-    # NOTE: Always tries to fetch from prod server,
-    #       which is potentially wrong if testing server is being used.
-    awc = aw_client.ActivityWatchClient(f"get-setting-{random.randint(0, 10000)}")
+    if client is None:
+        client = _get_default_client()
     try:
-        classes = awc.get_setting("classes")
+        classes = client.settings.get("classes")
     except Exception:
         logger.warning(
             "Failed to get classes from server, using default classes as fallback"
@@ -85,5 +112,11 @@ def get_classes() -> List[Tuple[List[str], dict]]:
             "Classes setting is empty/unset, using default classes as fallback"
         )
         return default_classes
-    # map into list of tuples
-    return [(v["name"], v["rule"]) for v in classes]
+    global _last_classes
+    last = _last_classes
+    # The same setting value is returned until refreshed, so map it only once, which also
+    # lets the queries module reuse the classes it froze from the list last returned
+    if last is None or last[0] is not classes:
+        # map into list of tuples
+        last = _last_classes = (classes, [(v["name"], v["rule"]) for v in classes])
+    return last[1]
@@ -5,17 +5,16 @@ import logging
 import textwrap
 import time
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
-from zoneinfo import ZoneInfo
+from typing import TYPE_CHECKING, List, Optional, Sequence
 
 import click
-from aw_core import Event
-from tabulate import tabulate
 
-import aw_client
+# Imports other than click are deferred to the commands that need them,
+# so that the CLI starts quickly (such as for --help)
+if TYPE_CHECKING:
+    from aw_core import Event
 
-from . import queries
-from .classes import default_classes, get_classes
+    from .client import ActivityWatchClient
 
 now = datetime.now(timezone.utc)
 td1day = timedelta(days=1)
@@ -25,7 +24,7 @@ logger = logging.getLogger(__name__)
 
 
 class _Context:
-    client: aw_client.ActivityWatchClient
+    client: "ActivityWatchClient"
 
 
 @click.group(
@@ -48,13 +47,22 @@ class _Context:
     help="Verbosity",
 )
 @click.option("--testing", is_flag=True, help="Set to use testing ports by default")
+@click.option(
+    "--local-cache",
+    is_flag=True,
+    help="Cache query results on disk, so that repeated queries are not re-run by the server",
+)
 @click.pass_context
-def main(ctx, testing: bool, verbose: bool, host: str, port: int):
+def main(ctx, testing: bool, verbose: bool, host: str, port: int, local_cache: bool):
+    from .client import ActivityWatchClient
+    from .querycache import QueryCache
+
     ctx.obj = _Context()
-    ctx.obj.client = aw_client.ActivityWatchClient(
+    ctx.obj.client = ActivityWatchClient(
         host=host,
         port=port if port != 5600 else (5666 if testing else 5600),
         testing=testing,
+        query_cache=QueryCache() if local_cache else None,
     )
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
 
@@ -65,6 +73,8 @@ def main(ctx, testing: bool, verbose: bool, host: str, port: int):
 @click.option("--pulsetime", default=60, help="pulsetime to use for merging heartbeats")
 @click.pass_obj
 def heartbeat(obj: _Context, bucket_id: str, data: str, pulsetime: int):
+    from aw_core import Event
+
     now = datetime.now(timezone.utc)
     e = Event(duration=0, data=json.loads(data), timestamp=now)
     print(e)
@@ -84,9 +94,8 @@ def buckets(obj: _Context):
 @click.argument("bucket_id")
 @click.pass_obj
 def events(obj: _Context, bucket_id: str):
-    events = obj.client.get_events(bucket_id)
     print("events:")
-    for e in events:
+    for e in obj.client.iter_events(bucket_id):
         print(
             " - {} ({}) {}".format(
                 e.timestamp.replace(tzinfo=None, microsecond=0),
@@ -96,6 +105,22 @@ def events(obj: _Context, bucket_id: str):
         )
 
 
+@main.command(help="Export buckets to an NDJSON, Parquet or Arrow file at `path`")
+@click.argument("path")
+@click.option("--bucket", "bucket_id", help="Only export this bucket")
+@click.option(
+    "--format",
+    type=click.Choice(["ndjson", "parquet", "arrow"]),
+    help="File format, by default from the extension of `path`",
+)
+@click.pass_obj
+def export(obj: _Context, path: str, bucket_id: Optional[str], format: Optional[str]):
+    counts = obj.client.export_to_file(path, bucket_id=bucket_id, format=format)
+    for bid, count in counts.items():
+        print(f" - {bid}: {count} events")
+    print(f"Exported {sum(counts.values())} events to {path}")
+
+
 @main.command(help="Run a query in file at `path` on the server")
 @click.argument("path")
 @click.option("--name")
@@ -123,28 +148,32 @@ def query(
         query = f.read()
 
     if timezone:
+        from zoneinfo import ZoneInfo
+
         zone_info = ZoneInfo(timezone)
         start = start.replace(tzinfo=zone_info)
         stop = stop.replace(tzinfo=zone_info)
 
-    result = obj.client.query(query, [(start, stop)], cache=cache, name=name)
+    # The JSON output is printed as returned by the server
+    result = obj.client.query(
+        query, [(start, stop)], cache=cache, name=name, as_frame=not _json
+    )
     if _json:
         print(json.dumps(result))
     else:
         for period in result:
             print(f"Showing 10 out of {len(period)} events:")
+            # Events of frames, which hold durations as timedeltas
             for event in period[:10]:
-                event.pop("id")
-                event.pop("timestamp")
                 print(
                     " - Duration: {} \tData: {}".format(
-                        str(timedelta(seconds=event["duration"])).split(".")[0],
-                        event["data"],
+                        str(event.duration).split(".")[0],
+                        event.data,
                     )
                 )
             print(
                 "Total duration:\t",
-                timedelta(seconds=sum(e["duration"] for e in period)),
+                sum((e.duration for e in period), timedelta()),
             )
 
 
@@ -164,6 +193,9 @@ def report(
     name: Optional[str] = None,
     limit: int = 10,
 ):
+    from . import queries
+    from .classes import get_classes
+
     logger.info(f"Querying between {start} and {stop}")
     bid_window = f"aw-watcher-window_{hostname}"
     bid_afk = f"aw-watcher-afk_{hostname}"
@@ -175,7 +207,7 @@ def report(
 
     bid_browsers: List[str] = []
 
-    classes = get_classes()
+    classes = get_classes(obj.client)
     params = queries.DesktopQueryParams(
         bid_browsers=bid_browsers,
         classes=classes,
@@ -188,14 +220,16 @@ def report(
     query = queries.fullDesktopQuery(params)
     logger.debug("Query: \n" + queries.pretty_query(query))
 
-    result = obj.client.query(query, [(start, stop)], cache=cache, name=name)
+    result = obj.client.query(
+        query, [(start, stop)], cache=cache, name=name, as_frame=True
+    )
 
     # TODO: Print titles, apps, categories, with most time
     for period in result:
         print()
         # print(period["window"]["cat_events"])
 
-        cat_events = _parse_events(period["window"]["cat_events"])
+        cat_events = period["window"]["cat_events"]
         print_top(
             cat_events,
             lambda e: " > ".join(e.data["$category"]),
@@ -203,21 +237,15 @@ def report(
             n=limit,
         )
 
-        title_events = _parse_events(period["window"]["title_events"])
+        title_events = period["window"]["title_events"]
         print_top(title_events, lambda e: e.data["title"], title="Titles", n=limit)
 
-        active_events = _parse_events(period["window"]["title_events"])
-        print(
-            "Total duration:\t",
-            sum((e.duration for e in active_events), timedelta()),
-        )
-
+        print("Total duration:\t", title_events.total_duration)
 
-def _parse_events(events: List[dict]) -> List[Event]:
-    return [Event(**event) for event in events]
 
+def print_top(events: Sequence["Event"], key=lambda e: e.data, title="Events", n=10):
+    from tabulate import tabulate
 
-def print_top(events: List[Event], key=lambda e: e.data, title="Events", n=10):
     print(f"Top {n} {title}" + (f" (out of {len(events)})" if len(events) > 10 else ""))
     print(
         tabulate(
@@ -245,6 +273,11 @@ def canonical(
     stop: datetime,
     name: Optional[str] = None,
 ):
+    from tabulate import tabulate
+
+    from . import queries
+    from .classes import default_classes
+
     logger.info(f"Querying between {start} and {stop}")
     bid_window = f"aw-watcher-window_{hostname}"
     bid_afk = f"aw-watcher-afk_{hostname}"
@@ -266,12 +299,14 @@ def canonical(
     query = f"""{query}\n RETURN = events;"""
     logger.debug("Query: \n" + queries.pretty_query(query))
 
-    result = obj.client.query(query, [(start, stop)], cache=cache, name=name)
+    result = obj.client.query(
+        query, [(start, stop)], cache=cache, name=name, as_frame=True
+    )
 
     # TODO: Print titles, apps, categories, with most time
     for period in result:
         print()
-        events = _parse_events(period)
+        events = period
         print(f"Showing last 10 out of {len(events)} events:")
 
         print(
@@ -289,10 +324,7 @@ def canonical(
         )
 
         print()
-        print(
-            "Total duration:\t",
-            timedelta(seconds=sum(e["duration"] for e in period)),
-        )
+        print("Total duration:\t", events.total_duration)
 
 
 if __name__ == "__main__":
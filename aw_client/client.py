@@ -1,40 +1,115 @@
 import functools
+import itertools
 import json
 import logging
-import os
 import socket
 import threading
 from collections import namedtuple
-from datetime import datetime
-from time import sleep
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+from urllib.parse import parse_qs
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Dict,
+    Iterable,
+    Iterator,
     List,
+    Literal,
     Optional,
+    Sequence,
+    Set,
     Tuple,
     Union,
+    cast,
+    overload,
 )
 
-import persistqueue
 import requests as req
-from aw_core.dirs import get_data_dir
 from aw_core.models import Event
-from aw_transform.heartbeats import heartbeat_merge
 
 from .config import load_config
+from .eventframe import (
+    EventFrame,
+    frames_from_query_items,
+    frames_from_query_result,
+)
+from .jsoncodec import dumps, loads
+from .jsonstream import ANY, Path, PathItem, iterparse
+from .premerge import HeartbeatPremerger
+from .querycache import MISS, QueryCache
+from .queuebackend import QueuedRequest, QueueBackend, open_queue_backend
+from .reconnect import Backoff, CircuitBreaker
+from .settings import SettingsCache
 from .singleinstance import SingleInstance
+from .transport import HTTPTransport
+
+# Only needed for queued requests and concurrent queries, so imported when first used
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
 
 # FIXME: This line is probably badly placed
 logging.getLogger("requests").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Size of the chunks in which streamed responses are read and decoded
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# A field of a bucket, or one of its events, as yielded by `stream_export`
+ExportItem = Tuple[str, str, Any]
+
+
+@dataclass(frozen=True)
+class ChunkResult:
+    """The outcome of inserting a chunk of events, as returned by `insert_events_chunked`."""
+
+    #: Position of the chunk among all chunks
+    index: int
+    #: Position of the first event of the chunk among all events
+    first: int
+    #: Number of events in the chunk
+    count: int
+    #: Number of requests made, including retries
+    attempts: int
+    #: The error of the last attempt, if the chunk couldn't be inserted
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# Client errors that are retried, as the request may succeed later
+_RETRIED_STATUSES = (408, 429)
+
+
+def _retry_after(response: Optional[req.Response]) -> Optional[float]:
+    """The delay in seconds asked for by a `Retry-After` header, if any."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        # An HTTP date, such as "Wed, 21 Oct 2015 07:28:00 GMT"
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+
 
 def _log_request_exception(e: req.RequestException):
     logger.warning(str(e))
     try:
-        d = e.response.json() if e.response else None
+        # Not `if e.response`, a Response is falsy for error statuses
+        d = e.response.json() if e.response is not None else None
         logger.warning(f"Error message received: {d}")
     except json.JSONDecodeError:
         pass
@@ -44,6 +119,102 @@ def _dt_is_tzaware(dt: datetime) -> bool:
     return dt.tzinfo is not None and dt.tzinfo.utcoffset(dt) is not None
 
 
+def _events_params(
+    limit: Optional[int], start: Optional[datetime], end: Optional[datetime]
+) -> Dict[str, str]:
+    params = dict()  # type: Dict[str, str]
+    if limit is not None:
+        params["limit"] = str(limit)
+    if start is not None:
+        params["start"] = start.isoformat()
+    if end is not None:
+        params["end"] = end.isoformat()
+    return params
+
+
+def _query_request(
+    query: str,
+    timeperiods: List[Tuple[datetime, datetime]],
+    name: Optional[str],
+    cache: bool,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Returns the body and params of a request to the query endpoint."""
+    params = {}  # type: Dict[str, Any]
+    if cache:
+        if not name:
+            raise Exception("You are not allowed to do caching without a query name")
+        params["name"] = name
+        params["cache"] = int(cache)
+
+    # Check that datetimes have timezone information
+    for start, stop in timeperiods:
+        try:
+            assert _dt_is_tzaware(start)
+            assert _dt_is_tzaware(stop)
+        except AssertionError:
+            raise ValueError("start/stop needs to have a timezone set") from None
+
+    data = {
+        "timeperiods": [
+            "/".join([start.isoformat(), end.isoformat()]) for start, end in timeperiods
+        ],
+        "query": query.split("\n"),
+    }
+    return data, params
+
+
+def split_timeperiods(
+    timeperiods: List[Tuple[datetime, datetime]], chunk: Optional[timedelta]
+) -> List[List[Tuple[datetime, datetime]]]:
+    """Splits each timeperiod into consecutive chunks no longer than `chunk`."""
+    if chunk is None:
+        return [[tp] for tp in timeperiods]
+    if chunk <= timedelta(0):
+        raise ValueError("chunk must be a positive duration")
+    result = []
+    for start, end in timeperiods:
+        chunks = []
+        while start + chunk < end:
+            chunks.append((start, start + chunk))
+            start += chunk
+        chunks.append((start, end))
+        result.append(chunks)
+    return result
+
+
+def day_period(
+    day: date, day_offset: timedelta = timedelta(0), tz: Optional[tzinfo] = None
+) -> Tuple[datetime, datetime]:
+    """Returns the timeperiod of a day, starting at midnight plus `day_offset` in `tz` (local time by default)."""
+
+    def start_of(d: date) -> datetime:
+        dt = datetime.combine(d, time()) + day_offset
+        return dt.astimezone() if tz is None else dt.replace(tzinfo=tz)
+
+    return start_of(day), start_of(day + timedelta(days=1))
+
+
+def merge_query_results(results: List[Any]) -> Any:
+    """
+    Merges the results of a query over consecutive chunks of a timeperiod, for use as a
+    reducer with `query_chunked`.
+
+    Lists of events (and EventFrames) are concatenated, numbers are summed, and dicts are
+    merged key by key. Only correct for queries where that holds, such as `RETURN = events`
+    or `sum_durations`. Results of transforms like `merge_events_by_keys` need their own reducer.
+    """
+    first = results[0]
+    if isinstance(first, EventFrame):
+        return EventFrame.concat(results)
+    if isinstance(first, list):
+        return [item for result in results for item in result]
+    if isinstance(first, dict):
+        return {k: merge_query_results([r[k] for r in results]) for k in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return sum(results)
+    raise TypeError(f"Don't know how to merge query results of type {type(first)}")
+
+
 def always_raise_for_request_errors(f: Callable[..., req.Response]):
     @functools.wraps(f)
     def g(*args, **kwargs):
@@ -66,12 +237,19 @@ class ActivityWatchClient:
         host=None,
         port=None,
         protocol="http",
+        transport: Optional[HTTPTransport] = None,
+        query_cache: Optional[QueryCache] = None,
     ) -> None:
         """
         A handy wrapper around the aw-server REST API. The recommended way of interacting with the server.
 
         Can be used with a `with`-statement as an alternative to manually calling connect and disconnect in a try-finally clause.
 
+        Requests are sent over a pooled keep-alive `HTTPTransport`, pass `transport` to configure
+        pool size and timeouts. The transport is closed by `disconnect()`.
+
+        Pass a `QueryCache` as `query_cache` to cache the results of `query` on disk.
+
         :Example:
 
         .. literalinclude:: examples/client.py
@@ -89,16 +267,75 @@ class ActivityWatchClient:
         server_host = host or server_config["hostname"]
         server_port = port or server_config["port"]
         self.server_address = f"{protocol}://{server_host}:{server_port}"
+        self.transport = transport or HTTPTransport()
 
-        self.instance = SingleInstance(
-            f"{self.client_name}-at-{server_host}-on-{server_port}"
-        )
+        self._instance_name = f"{self.client_name}-at-{server_host}-on-{server_port}"
+        self._instance: Optional[SingleInstance] = None
 
         self.commit_interval = client_config["commit_interval"]
-
-        self.request_queue = RequestQueue(self)
-        # Dict of each last heartbeat in each bucket
-        self.last_heartbeat = {}  # type: Dict[str, Event]
+        # Limits of the request queue, applied when it's compacted
+        self.queue_max_size = int(client_config["queue_max_size_mb"] * 1024 * 1024)
+        self.queue_max_age = timedelta(days=client_config["queue_max_age_days"])
+
+        # The request queue, and with it the instance lock and the queue file, are only
+        # created once queued requests are used, see the request_queue property
+        self._request_queue: Optional[RequestQueue] = None
+        self._request_queue_lock = threading.Lock()
+        self._connected = False
+        # Merges queued heartbeats before they are queued, see `premerge`
+        self.premerge = HeartbeatPremerger(self._queue_heartbeat)
+
+        self.query_cache = query_cache
+        self._settings: Optional[SettingsCache] = None
+
+        # Used by query_by_day if no query_cache is given, created on first use
+        self._default_query_cache: Optional[QueryCache] = None
+        # Identifies the server in query cache keys, fetched on first use
+        self._server_id: Optional[str] = None
+
+        # Worker threads for queries and chunked inserts, one pool per kind and max_workers,
+        # created on first use
+        self._pools: Dict[Tuple[str, int], ThreadPoolExecutor] = {}
+        self._pool_lock = threading.Lock()
+
+    @property
+    def instance(self) -> SingleInstance:
+        """Lock held while the client is queueing requests, so only one instance of a client runs at a time."""
+        if self._instance is None:
+            self._instance = SingleInstance(self._instance_name)
+        return self._instance
+
+    @property
+    def request_queue(self) -> "RequestQueue":
+        """The queue of requests sent in the background, created on first use."""
+        with self._request_queue_lock:
+            if self._request_queue is None:
+                # Only one instance of a client may queue requests to the same queue file
+                if self._instance is None:
+                    self._instance = SingleInstance(self._instance_name)
+                self._request_queue = RequestQueue(
+                    self, max_size=self.queue_max_size, max_age=self.queue_max_age
+                )
+            return self._request_queue
+
+    @request_queue.setter
+    def request_queue(self, request_queue: "RequestQueue") -> None:
+        with self._request_queue_lock:
+            old, self._request_queue = self._request_queue, request_queue
+        if old is not None and old is not request_queue and not old.is_alive():
+            # Releases the queue files, for the new queue to open them
+            old.close()
+
+    def _start_request_queue(self) -> None:
+        """Starts the request queue if the client is connected, once it's been used."""
+        with self._request_queue_lock:
+            request_queue = self._request_queue
+            if (
+                self._connected
+                and request_queue is not None
+                and not request_queue.is_alive()
+            ):
+                request_queue.start()
 
     #
     #   Get/Post base requests
@@ -108,8 +345,10 @@ class ActivityWatchClient:
         return f"{self.server_address}/api/0/{endpoint}"
 
     @always_raise_for_request_errors
-    def _get(self, endpoint: str, params: Optional[dict] = None) -> req.Response:
-        return req.get(self._url(endpoint), params=params)
+    def _get(
+        self, endpoint: str, params: Optional[dict] = None, stream: bool = False
+    ) -> req.Response:
+        return self.transport.get(self._url(endpoint), params=params, stream=stream)
 
     @always_raise_for_request_errors
     def _post(
@@ -117,13 +356,15 @@ class ActivityWatchClient:
         endpoint: str,
         data: Union[List[Any], Dict[str, Any]],
         params: Optional[dict] = None,
+        stream: bool = False,
     ) -> req.Response:
         headers = {"Content-type": "application/json", "charset": "utf-8"}
-        return req.post(
+        return self.transport.post(
             self._url(endpoint),
-            data=bytes(json.dumps(data), "utf8"),
+            data=dumps(data),
             headers=headers,
             params=params,
+            stream=stream,
         )
 
     @always_raise_for_request_errors
@@ -131,12 +372,23 @@ class ActivityWatchClient:
         if data is None:
             data = {}
         headers = {"Content-type": "application/json"}
-        return req.delete(self._url(endpoint), data=json.dumps(data), headers=headers)
+        return self.transport.delete(
+            self._url(endpoint), data=dumps(data), headers=headers
+        )
+
+    def _iterparse(
+        self, response: req.Response, *paths: Sequence[PathItem], empty: bool = False
+    ) -> Iterator[Tuple[Path, Any]]:
+        """Incrementally decodes a streamed response, see `jsonstream.iterparse`."""
+        with response:
+            yield from iterparse(
+                response.iter_content(chunk_size=STREAM_CHUNK_SIZE), *paths, empty=empty
+            )
 
     def get_info(self):
         """Returns a dict currently containing the keys 'hostname' and 'testing'."""
         endpoint = "info"
-        return self._get(endpoint).json()
+        return loads(self._get(endpoint).content)
 
     #
     #   Event get/post requests
@@ -149,43 +401,257 @@ class ActivityWatchClient:
     ) -> Optional[Event]:
         endpoint = f"buckets/{bucket_id}/events/{event_id}"
         try:
-            event = self._get(endpoint).json()
+            event = loads(self._get(endpoint).content)
             return Event(**event)
         except req.exceptions.HTTPError as e:
-            if e.response and e.response.status_code == 404:
+            if e.response is not None and e.response.status_code == 404:
                 return None
             else:
                 raise
 
+    @overload
+    def get_events(
+        self,
+        bucket_id: str,
+        limit: int = ...,
+        start: Optional[datetime] = ...,
+        end: Optional[datetime] = ...,
+        as_frame: Literal[False] = ...,
+    ) -> List[Event]: ...
+
+    @overload
+    def get_events(
+        self,
+        bucket_id: str,
+        limit: int = ...,
+        start: Optional[datetime] = ...,
+        end: Optional[datetime] = ...,
+        *,
+        as_frame: Literal[True],
+    ) -> EventFrame: ...
+
     def get_events(
         self,
         bucket_id: str,
         limit: int = -1,
         start: Optional[datetime] = None,
         end: Optional[datetime] = None,
-    ) -> List[Event]:
+        as_frame: bool = False,
+    ) -> Union[List[Event], EventFrame]:
+        """
+        Returns events in a bucket, newest first.
+
+        With `as_frame=True` the events are returned as a columnar `EventFrame`, which uses
+        far less memory than a list of `Event` for large numbers of events. The response is
+        then decoded incrementally, each event added to the frame as it is received.
+        """
         endpoint = f"buckets/{bucket_id}/events"
+        params = _events_params(limit, start, end)
+        if as_frame:
+            response = self._get(endpoint, params=params, stream=True)
+            return EventFrame.from_json(
+                event for _, event in self._iterparse(response, [ANY])
+            )
+        events = loads(self._get(endpoint, params=params).content)
+        return [Event(**event) for event in events]
 
-        params = dict()  # type: Dict[str, str]
-        if limit is not None:
-            params["limit"] = str(limit)
-        if start is not None:
-            params["start"] = start.isoformat()
-        if end is not None:
-            params["end"] = end.isoformat()
+    def stream_events(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Iterator[Event]:
+        """
+        Same as `get_events`, but decodes the response incrementally and yields events as they
+        are received, so the whole response is never held in memory.
+        """
+        endpoint = f"buckets/{bucket_id}/events"
+        params = _events_params(limit, start, end)
+        response = self._get(endpoint, params=params, stream=True)
+        for _, event in self._iterparse(response, [ANY]):
+            yield Event(**event)
 
-        events = self._get(endpoint, params=params).json()
-        return [Event(**event) for event in events]
+    def iter_events(
+        self,
+        bucket_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        page_size: int = 1000,
+    ) -> Iterator[Event]:
+        """
+        Iterates over the events in a bucket, newest first like `get_events`, while only fetching
+        `page_size` events at a time. Useful for walking through large buckets without holding them in memory.
+
+        Pages are fetched by walking backwards from `end`, using the timestamp of the oldest event
+        in each page as the end of the next one.
+        """
+        endpoint = f"buckets/{bucket_id}/events"
+        cursor = end
+        # IDs of yielded events with timestamp equal to the cursor, since the next page includes them again
+        seen_at_cursor: Set[Any] = set()
+        limit = page_size
+        while True:
+            params = _events_params(limit, start, cursor)
+            page = [
+                Event(**e) for e in loads(self._get(endpoint, params=params).content)
+            ]
+            new = [e for e in page if e.id not in seen_at_cursor]
+            for e in new:
+                if cursor not in (None, end) and e.timestamp + e.duration == cursor:
+                    # The server might have cropped the event to the page end
+                    e = self._uncropped_event(bucket_id, e, start, end)
+                yield e
+
+            if len(page) < limit:
+                break
+            if not new:
+                # More than a page worth of events share the same timestamp, fetch more of them
+                limit *= 2
+                continue
+            limit = page_size
+
+            oldest = page[-1].timestamp
+            if oldest != cursor:
+                seen_at_cursor = set()
+            seen_at_cursor |= {e.id for e in page if e.timestamp == oldest}
+            cursor = oldest
+
+    def _uncropped_event(
+        self,
+        bucket_id: str,
+        event: Event,
+        start: Optional[datetime],
+        end: Optional[datetime],
+    ) -> Event:
+        """
+        Re-fetches an event that may have been cropped to the end of a page.
+        Some servers crop events to the requested range, in which case the event is instead cropped to `start` and `end`.
+        """
+        full = self.get_event(bucket_id, cast(int, event.id))
+        if full is None or full.duration == event.duration:
+            return event
+        if start is not None and full.timestamp < start:
+            full.duration -= start - full.timestamp
+            full.timestamp = start
+        if end is not None and full.timestamp + full.duration > end:
+            full.duration = end - full.timestamp
+        return full
 
     def insert_event(self, bucket_id: str, event: Event) -> None:
         endpoint = f"buckets/{bucket_id}/events"
-        data = [event.to_json_dict()]
-        self._post(endpoint, data)
+        self._post(endpoint, [event])
 
     def insert_events(self, bucket_id: str, events: List[Event]) -> None:
         endpoint = f"buckets/{bucket_id}/events"
-        data = [event.to_json_dict() for event in events]
-        self._post(endpoint, data)
+        self._post(endpoint, list(events))
+
+    def insert_events_chunked(
+        self,
+        bucket_id: str,
+        events: Iterable[Event],
+        chunk_size: int = 1000,
+        max_workers: int = 4,
+        retries: int = 3,
+        retry_delay: float = 1.0,
+        progress: Optional[Callable[[ChunkResult], None]] = None,
+    ) -> List[ChunkResult]:
+        """
+        Inserts events in chunks of `chunk_size` events, each sent as its own request, with up to `max_workers` in flight at a time.
+
+        `events` (such as a generator or an `EventFrame`) is consumed as chunks are sent, so
+        no more than `max_workers + 1` chunks are held in memory at a time, however many events
+        there are.
+
+        A chunk that fails is retried up to `retries` times, waiting `retry_delay` seconds
+        before the first retry and twice as long before each one after that, or as long as
+        the server asks for with a `Retry-After` header. Chunks rejected by the server with a
+        4xx status aren't retried, except for 408 (Request Timeout) and 429 (Too Many
+        Requests). Since a request may have reached the server even though it failed, a
+        retried chunk may be inserted twice.
+
+        Returns the result of each chunk, in order. A chunk that failed has its `error` set,
+        and doesn't stop the other chunks from being sent. If given, `progress` is called
+        with the result of each chunk as soon as it is done.
+
+        :Example:
+
+            results = client.insert_events_chunked(bucket_id, frame, progress=print)
+            failed = [r for r in results if not r.ok]
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        endpoint = f"buckets/{bucket_id}/events"
+        results: List[ChunkResult] = []
+
+        def finished(futures: Iterable["Future[ChunkResult]"]) -> None:
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+
+        events_iter = iter(events)
+        in_flight: Set[Future[ChunkResult]] = set()
+        first = 0
+        pool = self._get_pool("insert", max_workers)
+        for index in itertools.count():
+            data = list(itertools.islice(events_iter, chunk_size))
+            if not data:
+                break
+            # Wait for a chunk to finish before sending another one
+            if len(in_flight) >= max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                finished(done)
+            in_flight.add(
+                pool.submit(
+                    self._insert_chunk,
+                    endpoint,
+                    data,
+                    index,
+                    first,
+                    retries,
+                    retry_delay,
+                )
+            )
+            first += len(data)
+        finished(wait(in_flight).done)
+        results.sort(key=lambda r: r.index)
+        return results
+
+    def _insert_chunk(
+        self,
+        endpoint: str,
+        data: List[Event],
+        index: int,
+        first: int,
+        retries: int,
+        retry_delay: float,
+    ) -> ChunkResult:
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                self._post(endpoint, data)
+                return ChunkResult(index, first, len(data), attempts)
+            except req.RequestException as e:
+                response = e.response
+                rejected = (
+                    response is not None
+                    and 400 <= response.status_code < 500
+                    and response.status_code not in _RETRIED_STATUSES
+                )
+                if rejected or attempts > retries:
+                    return ChunkResult(index, first, len(data), attempts, e)
+                delay = _retry_after(response)
+                if delay is None:
+                    delay = retry_delay * 2 ** (attempts - 1)
+                logger.warning(
+                    f"Failed to insert chunk {index}, retrying in {delay:.1f}s: {e}"
+                )
+                sleep(delay)
 
     def delete_event(self, bucket_id: str, event_id: int) -> None:
         endpoint = f"buckets/{bucket_id}/events/{event_id}"
@@ -231,45 +697,69 @@ class ActivityWatchClient:
         """
 
         endpoint = f"buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}"
-        _commit_interval = commit_interval or self.commit_interval
 
         if queued:
-            # Pre-merge heartbeats
-            if bucket_id not in self.last_heartbeat:
-                self.last_heartbeat[bucket_id] = event
-                return None
+            # Pre-merge heartbeats, merged events are queued by the premerger
+            self.premerge.add(
+                bucket_id,
+                endpoint,
+                event.timestamp,
+                event.duration,
+                event.data,
+                pulsetime,
+                commit_interval or self.commit_interval,
+            )
+        else:
+            self._post(endpoint, event)
+
+    def heartbeat_raw(
+        self,
+        bucket_id: str,
+        data: dict,
+        pulsetime: float,
+        timestamp: Optional[datetime] = None,
+        duration: float = 0,
+        commit_interval: Optional[float] = None,
+    ) -> None:
+        """
+        Same as `heartbeat` with `queued=True`, without creating an `Event` for each heartbeat.
 
-            last_heartbeat = self.last_heartbeat[bucket_id]
+        `timestamp` defaults to now, and must be timezone-aware. `data` is kept as is until
+        the heartbeat is queued, so it must not be modified after the call.
+        """
+        self.premerge.add(
+            bucket_id,
+            f"buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}",
+            timestamp or datetime.now(timezone.utc),
+            timedelta(seconds=duration),
+            data,
+            pulsetime,
+            commit_interval or self.commit_interval,
+        )
 
-            merge = heartbeat_merge(last_heartbeat, event, pulsetime)
+    def _queue_heartbeat(self, endpoint: str, data: dict) -> None:
+        self.request_queue.add_request(endpoint, data)
+        self._start_request_queue()
 
-            if merge:
-                # If last_heartbeat becomes longer than commit_interval
-                # then commit, else cache merged.
-                diff = (last_heartbeat.duration).total_seconds()
-                if diff >= _commit_interval:
-                    data = merge.to_json_dict()
-                    self.request_queue.add_request(endpoint, data)
-                    self.last_heartbeat[bucket_id] = event
-                else:
-                    self.last_heartbeat[bucket_id] = merge
-            else:
-                data = last_heartbeat.to_json_dict()
-                self.request_queue.add_request(endpoint, data)
-                self.last_heartbeat[bucket_id] = event
-        else:
-            self._post(endpoint, event.to_json_dict())
+    @property
+    def last_heartbeat(self) -> Dict[str, Event]:
+        """The pre-merged, possibly not yet queued, heartbeat of each bucket."""
+        return {
+            bucket_id: Event(**event)
+            for bucket_id, event in self.premerge.pending.items()
+        }
 
     #
     #   Bucket get/post requests
     #
 
     def get_buckets(self) -> dict:
-        return self._get("buckets/").json()
+        return loads(self._get("buckets/").content)
 
     def create_bucket(self, bucket_id: str, event_type: str, queued=False):
         if queued:
             self.request_queue.register_bucket(bucket_id, event_type)
+            self._start_request_queue()
         else:
             endpoint = f"buckets/{bucket_id}"
             data = {
@@ -289,10 +779,42 @@ class ActivityWatchClient:
     # Import & export
 
     def export_all(self) -> dict:
-        return self._get("export").json()
+        return loads(self._get("export").content)
 
     def export_bucket(self, bucket_id) -> dict:
-        return self._get(f"buckets/{bucket_id}/export").json()
+        return loads(self._get(f"buckets/{bucket_id}/export").content)
+
+    def stream_export(self, bucket_id: Optional[str] = None) -> Iterator[ExportItem]:
+        """
+        Same as `export_all`, or `export_bucket` if `bucket_id` is given, but decodes the
+        response incrementally so that only one event at a time is held in memory.
+
+        Yields `(bucket_id, key, value)` for each field of each bucket, in the order they are received.
+        The events of a bucket are yielded one at a time, as `(bucket_id, "events", event_dict)`.
+        """
+        endpoint = f"buckets/{bucket_id}/export" if bucket_id else "export"
+        response = self._get(endpoint, stream=True)
+        paths = [["buckets", ANY, ANY], ["buckets", ANY, "events", ANY]]
+        for path, value in self._iterparse(response, *paths):
+            yield cast(str, path[1]), cast(str, path[2]), value
+
+    def export_to_file(
+        self,
+        path: str,
+        bucket_id: Optional[str] = None,
+        format: Optional[str] = None,
+        batch_size: int = 10_000,
+    ) -> Dict[str, int]:
+        """
+        Writes an export (of all buckets, or only `bucket_id`) to an NDJSON, Parquet or Arrow
+        file as it is received, without holding the whole export in memory.
+
+        See `aw_client.exportfile` for the formats, and `load_export` for loading the file.
+        Returns the number of events written for each bucket.
+        """
+        from .exportfile import write_export
+
+        return write_export(self.stream_export(bucket_id), path, format, batch_size)
 
     def import_bucket(self, bucket: dict) -> None:
         endpoint = "import"
@@ -308,34 +830,196 @@ class ActivityWatchClient:
         timeperiods: List[Tuple[datetime, datetime]],
         name: Optional[str] = None,
         cache: bool = False,
+        as_frame: bool = False,
+    ) -> List[Any]:
+        """
+        Runs a query on the server and returns the result of each timeperiod.
+
+        With `as_frame=True`, lists of events in the result (either as the result of a
+        timeperiod, or as values of a dict result) are returned as `EventFrame`. Unless a
+        query cache is used, the response is then decoded incrementally, see
+        `frames_from_query_items`.
+        """
+        if self.query_cache is not None:
+            result = self._cached_query(
+                self.query_cache, query, timeperiods, name, cache
+            )
+        elif as_frame:
+            data, params = _query_request(query, timeperiods, name, cache)
+            response = self._post("query/", data, params=params, stream=True)
+            return frames_from_query_items(
+                self._iterparse(response, [ANY], [ANY, ANY], empty=True)
+            )
+        else:
+            result = self._post_query(query, timeperiods, name, cache)
+        if as_frame:
+            return frames_from_query_result(result)
+        return result
+
+    def _post_query(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        name: Optional[str],
+        cache: bool,
     ) -> List[Any]:
         endpoint = "query/"
-        params = {}  # type: Dict[str, Any]
-        if cache:
-            if not name:
-                raise Exception(
-                    "You are not allowed to do caching without a query name"
+        data, params = _query_request(query, timeperiods, name, cache)
+        return loads(self._post(endpoint, data, params=params).content)
+
+    def _server_identity(self) -> str:
+        if self._server_id is None:
+            info = self.get_info()
+            self._server_id = json.dumps(
+                [
+                    info.get("device_id") or self.server_address,
+                    info.get("hostname"),
+                    info.get("testing"),
+                ]
+            )
+        return self._server_id
+
+    def _cached_query(
+        self,
+        query_cache: QueryCache,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        name: Optional[str],
+        cache: bool,
+        max_workers: int = 1,
+    ) -> List[Any]:
+        """
+        Runs a query through a query cache, only sending the timeperiods that aren't cached.
+
+        If `max_workers` is more than one, each of those is sent as its own request.
+        """
+        # Validates the timeperiods, even if all of them are cached
+        _query_request(query, timeperiods, name, cache)
+        server = self._server_identity()
+        results = [query_cache.get(server, query, tp) for tp in timeperiods]
+        missing = [i for i, result in enumerate(results) if result is MISS]
+        fetched: List[Any] = []
+        if len(missing) > 1 and max_workers > 1:
+            pool = self._get_pool("query", max_workers)
+            futures = [
+                pool.submit(self._post_query, query, [timeperiods[i]], name, cache)
+                for i in missing
+            ]
+            fetched = [f.result()[0] for f in futures]
+        elif missing:
+            fetched = self._post_query(
+                query, [timeperiods[i] for i in missing], name, cache
+            )
+        for i, result in zip(missing, fetched):
+            query_cache.put(server, query, timeperiods[i], result)
+            results[i] = result
+        return results
+
+    def query_by_day(
+        self,
+        query: str,
+        start: date,
+        end: date,
+        day_offset: timedelta = timedelta(0),
+        tz: Optional[tzinfo] = None,
+        as_frame: bool = False,
+        max_workers: int = 4,
+        refresh: Iterable[date] = (),
+    ) -> Dict[date, Any]:
+        """
+        Runs a query for each day from `start` to `end` (inclusive), returning the result of each day.
+
+        Days start at midnight plus `day_offset`, in the timezone `tz` (local time by default).
+
+        Results of days that have ended are kept in the query cache (`query_cache` if set,
+        otherwise a default `QueryCache`), so that later calls only send the current day, and
+        days that aren't cached, to the server. Those are sent as one request per day, up to
+        `max_workers` at a time. Days in `refresh` are queried again even if they are cached,
+        such as days that had events imported since.
+        """
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        timeperiods = [day_period(day, day_offset, tz) for day in days]
+        if self.query_cache is None and self._default_query_cache is None:
+            self._default_query_cache = QueryCache()
+        query_cache = self.query_cache or self._default_query_cache
+        assert query_cache is not None
+        for day in refresh:
+            query_cache.invalidate(query, day_period(day, day_offset, tz))
+        results = self._cached_query(
+            query_cache, query, timeperiods, None, False, max_workers
+        )
+        if as_frame:
+            results = frames_from_query_result(results)
+        return dict(zip(days, results))
+
+    def _get_pool(self, kind: str, max_workers: int) -> "ThreadPoolExecutor":
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Pools are kept between calls, so that the worker threads keep their pooled
+        # connections, and never replaced, as other threads may still be submitting to them
+        with self._pool_lock:
+            pool = self._pools.get((kind, max_workers))
+            if pool is None:
+                pool = self._pools[kind, max_workers] = ThreadPoolExecutor(
+                    max_workers, thread_name_prefix=f"aw-client-{kind}"
                 )
-            params["name"] = name
-            params["cache"] = int(cache)
+            return pool
 
-        # Check that datetimes have timezone information
-        for start, stop in timeperiods:
-            try:
-                assert _dt_is_tzaware(start)
-                assert _dt_is_tzaware(stop)
-            except AssertionError:
-                raise ValueError("start/stop needs to have a timezone set") from None
-
-        data = {
-            "timeperiods": [
-                "/".join([start.isoformat(), end.isoformat()])
-                for start, end in timeperiods
-            ],
-            "query": query.split("\n"),
-        }
-        response = self._post(endpoint, data, params=params)
-        return response.json()
+    def query_chunked(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        name: Optional[str] = None,
+        cache: bool = False,
+        as_frame: bool = False,
+        chunk: Optional[timedelta] = None,
+        max_workers: int = 4,
+        reducer: Optional[Callable[[List[Any]], Any]] = None,
+    ) -> List[Any]:
+        """
+        Same as `query`, but runs each timeperiod as its own request, with up to `max_workers` at a time.
+
+        If `chunk` is given, each timeperiod is also split into chunks no longer than `chunk`,
+        each sent as its own request. Results are returned in order, one per chunk. If `reducer`
+        is given, it is called with the list of chunk results of each timeperiod, and its
+        return value is used as the result of that timeperiod instead.
+
+        :Example:
+
+            # Total active time over the last 90 days, evaluated a week at a time
+            client.query_chunked(query, [(now - timedelta(days=90), now)],
+                                 chunk=timedelta(days=7), reducer=merge_query_results)
+        """
+        chunked = split_timeperiods(timeperiods, chunk)
+        pool = self._get_pool("query", max_workers)
+        futures = [
+            [
+                pool.submit(self.query, query, [tp], name, cache, as_frame)
+                for tp in chunks
+            ]
+            for chunks in chunked
+        ]
+        results = [[f.result()[0] for f in fs] for fs in futures]
+        if reducer is not None:
+            return [reducer(chunk_results) for chunk_results in results]
+        return [r for chunk_results in results for r in chunk_results]
+
+    def stream_query(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        name: Optional[str] = None,
+        cache: bool = False,
+    ) -> Iterator[Any]:
+        """
+        Same as `query`, but decodes the response incrementally and yields the result of each
+        timeperiod as soon as it has been received.
+        """
+        endpoint = "query/"
+        data, params = _query_request(query, timeperiods, name, cache)
+        response = self._post(endpoint, data, params=params, stream=True)
+        for _, period in self._iterparse(response, [ANY]):
+            yield period
 
     #
     # Settings
@@ -343,12 +1027,21 @@ class ActivityWatchClient:
 
     def get_setting(self, key: Optional[str] = None) -> dict:
         if key:
-            return self._get(f"settings/{key}").json()
+            return loads(self._get(f"settings/{key}").content)
         else:
-            return self._get("settings").json()
+            return loads(self._get("settings").content)
 
     def set_setting(self, key: str, value: str) -> None:
         self._post(f"settings/{key}", value)
+        if self._settings is not None:
+            self._settings.invalidate(key)
+
+    @property
+    def settings(self) -> SettingsCache:
+        """A cache of the server's settings, for settings that are read often."""
+        if self._settings is None:
+            self._settings = SettingsCache(self)
+        return self._settings
 
     #
     #   Connect and disconnect
@@ -362,15 +1055,28 @@ class ActivityWatchClient:
         self.disconnect()
 
     def connect(self):
-        if not self.request_queue.is_alive():
-            self.request_queue.start()
+        # If the request queue hasn't been used yet, it's started once it is
+        with self._request_queue_lock:
+            self._connected = True
+        self._start_request_queue()
 
     def disconnect(self):
-        self.request_queue.stop()
-        self.request_queue.join()
-
-        # Throw away old thread object, create new one since same thread cannot be started twice
-        self.request_queue = RequestQueue(self)
+        # Queue pre-merged heartbeats, so that they are sent once the queue runs again
+        self.premerge.close()
+        with self._request_queue_lock:
+            self._connected = False
+            # Throw away old thread object, a new one is created on next use since same thread cannot be started twice
+            request_queue, self._request_queue = self._request_queue, None
+        if request_queue is not None:
+            if request_queue.is_alive():
+                request_queue.stop()
+                request_queue.join()
+            request_queue.close()
+        with self._pool_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown()
+        self.transport.close()
 
     def wait_for_start(self, timeout: int = 10) -> None:
         """Wait for the server to start by trying to get the server info."""
@@ -387,77 +1093,173 @@ class ActivityWatchClient:
             raise Exception(f"Server at {self.server_address} did not start in time")
 
 
-QueuedRequest = namedtuple("QueuedRequest", ["endpoint", "data"])
 Bucket = namedtuple("Bucket", ["id", "type"])
 
 
+def coalesce_heartbeats(requests: List[QueuedRequest]) -> List[QueuedRequest]:
+    """
+    Merges queued heartbeats the same way the server would, so that fewer requests have to be sent.
+
+    Heartbeats are only merged with the previous heartbeat to the same bucket, and only if it
+    was sent with the same pulsetime. The merged request keeps the position of the first
+    heartbeat that went into it, which keeps the order of heartbeats within each bucket.
+    """
+    from aw_transform.heartbeats import heartbeat_merge
+
+    coalesced = []  # type: List[QueuedRequest]
+    # Index in `coalesced` and event of the last heartbeat to each bucket
+    last = {}  # type: Dict[str, Tuple[int, Event]]
+    for request in requests:
+        bucket_path, _, query = request.endpoint.partition("?")
+        heartbeat = Event(**request.data)
+        if bucket_path in last:
+            i, last_event = last[bucket_path]
+            if coalesced[i].endpoint == request.endpoint:
+                pulsetime = float(parse_qs(query)["pulsetime"][0])
+                merged = heartbeat_merge(last_event, heartbeat, pulsetime)
+                if merged is not None:
+                    coalesced[i] = QueuedRequest(
+                        request.endpoint, merged.to_json_dict()
+                    )
+                    last[bucket_path] = (i, merged)
+                    continue
+        last[bucket_path] = (len(coalesced), heartbeat)
+        coalesced.append(request)
+    return coalesced
+
+
+def _expire_heartbeats(
+    requests: List[QueuedRequest], max_age: timedelta
+) -> List[QueuedRequest]:
+    """Drops heartbeats of events that ended more than `max_age` ago."""
+    cutoff = datetime.now(timezone.utc) - max_age
+    kept = []
+    for request in requests:
+        try:
+            # Much faster than creating an Event, for timestamps from Event.to_json_dict
+            timestamp = datetime.fromisoformat(request.data["timestamp"])
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            end = timestamp + timedelta(seconds=request.data.get("duration", 0))
+        except (KeyError, TypeError, ValueError):
+            event = Event(**request.data)
+            end = event.timestamp + event.duration
+        if end >= cutoff:
+            kept.append(request)
+    return kept
+
+
+def _compact_queue(
+    backend: QueueBackend, max_size: Optional[int], max_age: Optional[timedelta]
+) -> Optional[Dict[str, int]]:
+    """
+    Compacts the requests of a queue that haven't been read yet: heartbeats older than
+    `max_age` are dropped and the rest are merged (see `coalesce_heartbeats`), then the
+    oldest are dropped if the queue is still larger than `max_size` bytes.
+    """
+
+    def transform(requests: List[QueuedRequest]) -> List[QueuedRequest]:
+        if max_age is not None:
+            requests = _expire_heartbeats(requests, max_age)
+        return coalesce_heartbeats(requests) if len(requests) > 1 else requests
+
+    result = backend.compact(transform, max_size)
+    if result is not None and result["requests_before"]:
+        logger.info(
+            "Compacted queue from {requests_before} requests ({bytes_before} bytes)"
+            " to {requests_after} ({bytes_after} bytes)".format(**result)
+        )
+    return result
+
+
 class RequestQueue(threading.Thread):
     """Used to asynchronously send heartbeats.
 
     Handles:
         - Cases where the server is temporarily unavailable
         - Saves all queued requests to file in case of a server crash
+        - Keeps the queue within `max_size` bytes and `max_age`, by compacting it on
+          start, and every `compact_interval` seconds while not connected
+        - Reconnects with backoff and a circuit breaker, see aw_client.reconnect
     """
 
-    VERSION = 1  # update this whenever the queue-file format changes
+    VERSION = 2  # update this whenever the queue-file format changes
 
-    def __init__(self, client: ActivityWatchClient) -> None:
+    def __init__(
+        self,
+        client: ActivityWatchClient,
+        batch_size: int = 100,
+        backend: Optional[QueueBackend] = None,
+        max_size: Optional[int] = None,
+        max_age: Optional[timedelta] = None,
+    ) -> None:
         threading.Thread.__init__(self, daemon=True)
 
         self.client = client
+        # Max number of queued requests to read (and coalesce) at a time
+        self.batch_size = batch_size
 
         self.connected = False
         self._stop_event = threading.Event()
+        # Notified by add_request and stop, so that an idle queue thread can block without polling
+        self._wakeup = threading.Condition()
+        self._new_requests = False
 
         # Buckets that will have events queued to them, will be created if they don't exist
         self._registered_buckets = []  # type: List[Bucket]
 
-        self._attempt_reconnect_interval = 10
-
-        # Setup failed queues file
-        data_dir = get_data_dir("aw-client")
-        queued_dir = os.path.join(data_dir, "queued")
-        if not os.path.exists(queued_dir):
-            os.makedirs(queued_dir)
-
-        persistqueue_path = os.path.join(
-            queued_dir,
-            "{}{}.v{}.persistqueue".format(
-                self.client.client_name,
-                "-testing" if client.testing else "",
-                self.VERSION,
-            ),
-        )
+        self._attempt_reconnect_interval: float = 10
+        # Delays between reconnect attempts and retries, up to _attempt_reconnect_interval
+        self.backoff = Backoff(maximum=self._attempt_reconnect_interval)
+        self.breaker = CircuitBreaker()
 
-        logger.debug(f"queue path '{persistqueue_path}'")
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compact_interval = 600
+        # Monotonic time of the last compaction
+        self._last_compaction: Optional[float] = None
 
-        self._persistqueue = persistqueue.FIFOSQLiteQueue(
-            persistqueue_path, multithreading=True, auto_commit=False
+        # Where requests are stored until sent, see aw_client.queuebackend
+        self._backend = backend or open_queue_backend(
+            self.client.client_name, client.testing, self.VERSION
         )
-        self._current = None  # type: Optional[QueuedRequest]
+        # Coalesced, not-yet-sent requests from the window last read from the queue
+        self._window = []  # type: List[QueuedRequest]
+
+    def _read_window(self) -> List[QueuedRequest]:
+        window = self._backend.read(self.batch_size)
+        if len(window) > 1:
+            coalesced = coalesce_heartbeats(window)
+            logger.debug(
+                f"Coalesced {len(window)} queued heartbeats into {len(coalesced)}"
+            )
+            return coalesced
+        return window
 
     def _get_next(self) -> Optional[QueuedRequest]:
-        # self._current will always hold the next not-yet-sent event,
-        # until self._task_done() is called.
-        if not self._current:
-            try:
-                self._current = self._persistqueue.get(block=False)
-            except persistqueue.exceptions.Empty:
-                return None
-        return self._current
+        # self._window will always hold the next not-yet-sent requests,
+        # each one is removed from it when self._task_done() is called.
+        if not self._window:
+            self._window = self._read_window()
+        return self._window[0] if self._window else None
 
     def _task_done(self) -> None:
-        self._current = None
-        self._persistqueue.task_done()
+        self._window.pop(0)
+        if not self._window:
+            # Acknowledge the whole window read from the queue at once
+            self._backend.ack()
 
     def _create_buckets(self) -> None:
         for bucket in self._registered_buckets:
             self.client.create_bucket(bucket.id, bucket.type)
 
     def _try_connect(self) -> bool:
-        try:  # Try to connect
+        try:
+            # A cheap liveness probe, before creating all registered buckets
+            self.client.get_info()
             self._create_buckets()
             self.connected = True
+            self.breaker.half_open()
             logger.info(
                 f"Connection to aw-server established by {self.client.client_name}"
             )
@@ -472,60 +1274,108 @@ class RequestQueue(threading.Thread):
     def should_stop(self) -> bool:
         return self._stop_event.is_set()
 
+    def _wait_for_requests(self) -> None:
+        """Blocks until a new request has been added, or the thread should stop."""
+        with self._wakeup:
+            while not self._new_requests and not self.should_stop():
+                self._wakeup.wait()
+            self._new_requests = False
+
     def _dispatch_request(self) -> None:
         request = self._get_next()
         if not request:
-            self.wait(0.2)  # seconds to wait before re-polling the empty queue
+            self._wait_for_requests()
             return
 
         try:
             self.client._post(request.endpoint, request.data)
-        except req.exceptions.ConnectTimeout:
+        except (req.exceptions.ConnectionError, req.exceptions.Timeout):
             # Triggered by:
             #   - server not running (connection refused)
             #   - server not responding (timeout)
-            # Safe to retry according to requests docs:
-            #   https://requests.readthedocs.io/en/latest/api/#requests.ConnectTimeout
-
-            self.connected = False
+            # Heartbeats are safe to send again, even if the server got them.
             logger.warning(
                 "Connection refused or timeout, will queue requests until connection is available."
             )
-            # wait a bit before retrying, so we don't spam the server (or logs), see:
+            # Wait for the server to respond to a probe before retrying, with backoff so we
+            # don't spam the server (or logs), see:
             #  - https://github.com/ActivityWatch/activitywatch/issues/815
             #  - https://github.com/ActivityWatch/activitywatch/issues/756#issuecomment-1266662861
-            sleep(0.5)
+            self.breaker.open()
+            self.connected = False
             return
         except req.RequestException as e:
-            if e.response and e.response.status_code == 400:
+            # Not `if e.response`, a Response is falsy for error statuses
+            status = e.response.status_code if e.response is not None else None
+            if status == 400:
                 # HTTP 400 - Bad request
                 # Example case: https://github.com/ActivityWatch/activitywatch/issues/815
                 # We don't want to retry, because a bad payload is likely to fail forever.
                 logger.error(f"Bad request, not retrying: {request.data}")
-            elif e.response and e.response.status_code == 500:
+            elif status == 500:
                 # HTTP 500 - Internal server error
                 # It is possible that the server is in a bad state (and will recover on restart),
                 # in which case we want to retry. I hope this can never caused by a bad payload.
                 logger.error(f"Internal server error, retrying: {request.data}")
-                sleep(0.5)
+                self.breaker.failure()
+                if self.breaker.is_open:
+                    self.connected = False
+                else:
+                    self.wait(self.backoff.next())
                 return
             else:
                 logger.exception(f"Unknown error, not retrying: {request.data}")
         except Exception:
             logger.exception(f"Unknown error, not retrying: {request.data}")
 
+        # The server responded, so the breaker closes, and backoff starts over
+        self.breaker.success()
+        self.backoff.reset()
         # Mark the request as done
         self._task_done()
 
+    def compact(self) -> Optional[Dict[str, int]]:
+        """Compacts the requests that haven't been read yet, see `_compact_queue`."""
+        self._last_compaction = monotonic()
+        return _compact_queue(self._backend, self.max_size, self.max_age)
+
+    def _maybe_compact(self) -> None:
+        """Compacts the queue if it's due, or over its size limit."""
+        if (
+            self._last_compaction is None
+            or monotonic() - self._last_compaction >= self.compact_interval
+            or (self.max_size is not None and self._backend.size() > self.max_size)
+        ):
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact the request queue")
+
     def run(self) -> None:
         self._stop_event.clear()
+        self._maybe_compact()
+        last_warning = 0.0
         while not self.should_stop():
-            # Connect
+            # Connect, after a delay if requests failed
+            if self.breaker.is_open and self.wait(self.backoff.next()):
+                break
             while not self._try_connect():
-                logger.warning(
-                    f"Not connected to server, {self._persistqueue.qsize()} requests in queue"
+                delay = self.backoff.next()
+                # Logged on the first attempt, and then at most every _attempt_reconnect_interval
+                log = logger.debug
+                now = monotonic()
+                if (
+                    self.backoff.attempts == 1
+                    or now - last_warning >= self._attempt_reconnect_interval
+                ):
+                    log = logger.warning
+                    last_warning = now
+                log(
+                    f"Not connected to server, {self._backend.qsize()} requests in queue,"
+                    f" retrying in {delay:.1f}s"
                 )
-                if self.wait(self._attempt_reconnect_interval):
+                self._maybe_compact()
+                if self.wait(delay):
                     break
 
             # Dispatch requests until connection is lost or thread should stop
@@ -534,6 +1384,12 @@ class RequestQueue(threading.Thread):
 
     def stop(self) -> None:
         self._stop_event.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def close(self) -> None:
+        """Closes the queue storage, once the thread has stopped (or was never started)."""
+        self._backend.close()
 
     def add_request(self, endpoint: str, data: dict) -> None:
         """
@@ -542,7 +1398,10 @@ class RequestQueue(threading.Thread):
         """
         assert "/heartbeat" in endpoint
         assert isinstance(data, dict)
-        self._persistqueue.put(QueuedRequest(endpoint, data))
+        self._backend.put(QueuedRequest(endpoint, data))
+        with self._wakeup:
+            self._new_requests = True
+            self._wakeup.notify()
 
     def register_bucket(self, bucket_id: str, event_type: str) -> None:
         self._registered_buckets.append(Bucket(bucket_id, event_type))
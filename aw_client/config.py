@@ -1,4 +1,13 @@
+import os
+import threading
+from typing import (
+    Any,
+    Optional,
+    Tuple,
+)
+
 from aw_core.config import load_config_toml
+from aw_core.dirs import get_config_dir
 
 default_config = """
 [server]
@@ -7,6 +16,9 @@ port = "5600"
 
 [client]
 commit_interval = 10
+# Limits of the queue of requests waiting for the server, oldest requests are dropped first
+queue_max_size_mb = 100
+queue_max_age_days = 30
 
 [server-testing]
 hostname = "127.0.0.1"
@@ -14,8 +26,35 @@ port = "5666"
 
 [client-testing]
 commit_interval = 5
+queue_max_size_mb = 100
+queue_max_age_days = 30
 """.strip()
 
 
+# (mtime of the config file, parsed config), shared by all clients in the process
+_cached: Optional[Tuple[Optional[int], Any]] = None
+_lock = threading.Lock()
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 def load_config():
-    return load_config_toml("aw-client", default_config)
+    """
+    Returns the parsed config, which is cached until the config file is modified.
+
+    The returned config is shared, and should not be modified.
+    """
+    global _cached
+    path = os.path.join(get_config_dir("aw-client"), "aw-client.toml")
+    with _lock:
+        mtime = _mtime(path)
+        if _cached is None or mtime is None or _cached[0] != mtime:
+            config = load_config_toml("aw-client", default_config)
+            # Stat again, since the file is created if it doesn't exist
+            _cached = (_mtime(path), config)
+        return _cached[1]
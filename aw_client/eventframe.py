@@ -0,0 +1,299 @@
+"""
+Columnar storage for large numbers of events.
+
+An EventFrame stores events as columns instead of one `Event` object per row:
+timestamps as int64 nanoseconds since the epoch, durations as float64 seconds,
+and each data key as its own column. Rows are converted to `Event` only when accessed.
+"""
+
+import itertools
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
+
+import iso8601
+from aw_core.models import Event
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Id used for events without one
+NO_ID = -1
+
+
+class _Missing:
+    """Marks a data key that isn't set on an event, as opposed to being set to None."""
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING: Any = _Missing()
+
+
+def _parse_ns(timestamp: str) -> int:
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except ValueError:
+        # Older Pythons only parse a subset of ISO 8601 with fromisoformat
+        dt = iso8601.parse_date(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt_to_ns(dt)
+
+
+def dt_to_ns(dt: datetime) -> int:
+    td = dt - EPOCH
+    return (td.days * 86400 + td.seconds) * 10**9 + td.microseconds * 1000
+
+
+def ns_to_dt(ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=ns // 1000)
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def data_columns(data: Iterable[dict]) -> Dict[str, List[Any]]:
+    """Builds the data columns of a frame from the data of each event, with `MISSING` for unset keys."""
+    columns: Dict[str, List[Any]] = {}
+    n = 0
+    for d in data:
+        for key, value in d.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[sys.intern(key)] = [MISSING] * n
+            column.append(_intern(value))
+        n += 1
+        for column in columns.values():
+            if len(column) < n:
+                column.append(MISSING)
+    return columns
+
+
+def is_event_list(value: Any) -> bool:
+    """Checks if a (JSON-decoded) value looks like a list of events."""
+    return isinstance(value, list) and all(
+        isinstance(e, dict) and "timestamp" in e and "duration" in e for e in value
+    )
+
+
+class EventFrame(Sequence[Event]):
+    """
+    A columnar, read-only sequence of events.
+
+    Much more compact than a list of `Event` for large numbers of events, since there
+    are no per-row objects and repeated data values (such as app names) are interned strings.
+
+    Indexing or iterating yields `Event` objects, created on demand. The columns can be
+    accessed directly for bulk processing, `timestamps` and `durations` support the buffer
+    protocol, so they can be wrapped with `numpy.frombuffer` without copying.
+    """
+
+    def __init__(
+        self,
+        ids: Optional[Sequence[int]] = None,
+        timestamps: Optional[Sequence[int]] = None,
+        durations: Optional[Sequence[float]] = None,
+        data: Optional[Dict[str, List[Any]]] = None,
+    ) -> None:
+        self.ids = ids if ids is not None else array("q")
+        self.timestamps = timestamps if timestamps is not None else array("q")
+        self.durations = durations if durations is not None else array("d")
+        self.data = data if data is not None else {}
+        assert len(self.ids) == len(self.timestamps) == len(self.durations)
+        assert all(len(col) == len(self.timestamps) for col in self.data.values())
+
+    @classmethod
+    def from_json(cls, events: Iterable[dict]) -> "EventFrame":
+        """Builds a frame from events as decoded from JSON, such as from the events or query endpoints."""
+        ids = array("q")
+        timestamps = array("q")
+        durations = array("d")
+
+        def rows() -> Iterator[dict]:
+            # Consumed as the data columns are built, so that a stream of events (such as
+            # from `jsonstream.iterparse`) is never held in memory as a list
+            for e in events:
+                event_id = e.get("id")
+                ids.append(event_id if event_id is not None else NO_ID)
+                timestamps.append(_parse_ns(e["timestamp"]))
+                durations.append(e["duration"])
+                yield e["data"]
+
+        data = data_columns(rows())
+        return cls(ids, timestamps, durations, data)
+
+    @classmethod
+    def from_events(cls, events: Iterable[Event]) -> "EventFrame":
+        return cls.from_json(e.to_json_dict() for e in events)
+
+    @classmethod
+    def concat(cls, frames: Iterable["EventFrame"]) -> "EventFrame":
+        """Concatenates frames into one, in order."""
+        frames = list(frames)
+        ids, timestamps, durations = array("q"), array("q"), array("d")
+        data: Dict[str, List[Any]] = {}
+        n = 0
+        for frame in frames:
+            ids.extend(frame.ids)
+            timestamps.extend(frame.timestamps)
+            durations.extend(frame.durations)
+            for key, column in frame.data.items():
+                if key not in data:
+                    data[key] = [MISSING] * n
+                data[key].extend(column)
+            n += len(frame)
+            for column in data.values():
+                column.extend([MISSING] * (n - len(column)))
+        return cls(ids, timestamps, durations, data)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def _row(self, i: int) -> Event:
+        event_id = self.ids[i]
+        return Event(
+            id=event_id if event_id != NO_ID else None,
+            timestamp=ns_to_dt(self.timestamps[i]),
+            duration=self.durations[i],
+            data={
+                key: column[i]
+                for key, column in self.data.items()
+                if column[i] is not MISSING
+            },
+        )
+
+    @overload
+    def __getitem__(self, i: int) -> Event: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "EventFrame": ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Event, "EventFrame"]:
+        if isinstance(i, slice):
+            return EventFrame(
+                self.ids[i],
+                self.timestamps[i],
+                self.durations[i],
+                {key: column[i] for key, column in self.data.items()},
+            )
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("EventFrame index out of range")
+        return self._row(i)
+
+    def __iter__(self) -> Iterator[Event]:
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def __repr__(self) -> str:
+        return f"<EventFrame with {len(self)} events and data keys {list(self.data)}>"
+
+    def to_events(self) -> List[Event]:
+        return list(self)
+
+    def take(self, indices: Iterable[int]) -> "EventFrame":
+        """Returns a new frame with the rows at `indices`, in that order."""
+        indices = list(indices)
+        return EventFrame(
+            array("q", map(self.ids.__getitem__, indices)),
+            array("q", map(self.timestamps.__getitem__, indices)),
+            array("d", map(self.durations.__getitem__, indices)),
+            {
+                key: list(map(column.__getitem__, indices))
+                for key, column in self.data.items()
+            },
+        )
+
+    def column(self, key: str) -> List[Any]:
+        """Returns the values of a data key, with None where the key isn't set."""
+        return [None if v is MISSING else v for v in self.data[key]]
+
+    @property
+    def total_duration(self) -> timedelta:
+        return timedelta(seconds=sum(self.durations))
+
+
+def frames_from_query_result(result: List[Any]) -> List[Any]:
+    """
+    Converts the events in a query result to EventFrames.
+
+    Each period that is a list of events is converted, as is each value in a period that is a dict.
+    """
+    return [_convert_query_value(period) for period in result]
+
+
+def _convert_query_value(value: Any) -> Any:
+    if is_event_list(value):
+        return EventFrame.from_json(value)
+    if isinstance(value, dict):
+        return {k: _convert_query_value(v) for k, v in value.items()}
+    return value
+
+
+def _is_event(value: Any) -> bool:
+    return isinstance(value, dict) and "timestamp" in value and "duration" in value
+
+
+def _frame_from_items(values: Iterator[Any]) -> Any:
+    """Builds a frame from a list of events as it is decoded, or a list if it isn't one."""
+    rest: List[Any] = []
+
+    def events() -> Iterator[dict]:
+        for value in values:
+            if not _is_event(value):
+                rest.append(value)
+                return
+            yield value
+
+    frame = EventFrame.from_json(events())
+    rest.extend(values)
+    if rest:
+        # Not only events, so the events read so far are converted back
+        return [e.to_json_dict() for e in frame] + rest
+    return frame
+
+
+def frames_from_query_items(items: Iterable[Tuple[Tuple[Any, ...], Any]]) -> List[Any]:
+    """
+    Same as `frames_from_query_result`, from the items of a streamed query result.
+
+    `items` are `(path, value)` as yielded by `jsonstream.iterparse` with the paths
+    `[ANY]` and `[ANY, ANY]` and `empty=True`: the result of each timeperiod if it isn't
+    a list or dict, or else each of its items. Events of a timeperiod that is a list of
+    events are added to its frame as they are decoded, so the list is never held in memory.
+    The values of a dict result are decoded and converted one at a time.
+    """
+    results: List[Any] = []
+    for index, period_items in itertools.groupby(items, key=lambda item: item[0][0]):
+        # Every timeperiod is in the stream, as empty lists and dicts are yielded too
+        assert index == len(results)
+        first_path, first = next(period_items)
+        if len(first_path) == 1:
+            # Not a list or dict, or an empty one
+            results.append(_convert_query_value(first))
+        elif isinstance(first_path[1], str):
+            period = {first_path[1]: _convert_query_value(first)}
+            for path, value in period_items:
+                period[path[1]] = _convert_query_value(value)
+            results.append(period)
+        elif _is_event(first):
+            values = itertools.chain([first], (value for _, value in period_items))
+            results.append(_frame_from_items(values))
+        else:
+            results.append([first] + [value for _, value in period_items])
+    return results
@@ -0,0 +1,328 @@
+"""
+Writing exports to files as they are received, and loading them back.
+
+Exports can be written as:
+
+ - NDJSON (`.ndjson`, `.jsonl`): one line per event, `{"bucket": bucket_id, **event}`,
+   and one line per bucket, `{"bucket": bucket_id, "metadata": {...}}`, after its events.
+ - Parquet (`.parquet`) or Arrow IPC (`.arrow`, `.feather`, `.ipc`): a table with the
+   columns `bucket`, `id`, `timestamp` (ns, UTC), `duration` (seconds) and `data` (JSON),
+   written in batches of events of a single bucket. The metadata of the buckets is stored
+   as JSON under the `aw-buckets` key, in the file metadata for Parquet, and in the custom
+   metadata of an empty last batch for Arrow.
+
+Parquet and Arrow require pyarrow: `pip install aw-client[arrow]`
+"""
+
+import os
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .eventframe import NO_ID, EventFrame, _parse_ns, data_columns
+from .jsoncodec import dumps, loads
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# Key of the bucket metadata in Parquet and Arrow files
+METADATA_KEY = "aw-buckets"
+
+FORMATS = {
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+
+def format_of(path: str) -> str:
+    """Returns the format of an export file, from its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(
+            f"Unknown export format for {path}, use one of: {', '.join(FORMATS)}"
+        )
+    return FORMATS[ext]
+
+
+def _check_format(format: str) -> str:
+    if format not in FORMATS.values():
+        raise ValueError(f"Unknown export format: {format}")
+    return format
+
+
+class _NDJSONWriter:
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "wb")
+
+    def write_batch(self, bucket_id: str, events: List[dict]) -> None:
+        self._file.writelines(
+            dumps({"bucket": bucket_id, **event}) + b"\n" for event in events
+        )
+
+    def end_bucket(self, bucket_id: str, metadata: dict) -> None:
+        self._file.write(dumps({"bucket": bucket_id, "metadata": metadata}) + b"\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+
+
+def _schema() -> "pa.Schema":
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("bucket", pa.string()),
+            ("id", pa.int64()),
+            ("timestamp", pa.timestamp("ns", tz="UTC")),
+            ("duration", pa.float64()),
+            ("data", pa.string()),
+        ]
+    )
+
+
+def _record_batch(schema: "pa.Schema", bucket_id: str, events: List[dict]):
+    import pyarrow as pa
+
+    ids = [e.get("id") for e in events]
+    return pa.record_batch(
+        [
+            pa.array([bucket_id] * len(events), pa.string()),
+            pa.array([NO_ID if i is None else i for i in ids], pa.int64()),
+            pa.array(
+                [_parse_ns(e["timestamp"]) for e in events], pa.timestamp("ns", "UTC")
+            ),
+            pa.array([e["duration"] for e in events], pa.float64()),
+            pa.array([dumps(e["data"]).decode("utf8") for e in events], pa.string()),
+        ],
+        schema=schema,
+    )
+
+
+class _ArrowWriter:
+    def __init__(self, path: str, format: str) -> None:
+        import pyarrow as pa
+
+        self._format = format
+        self._schema = _schema()
+        self._metadata: Dict[str, dict] = {}
+        self._sink = pa.OSFile(path, "wb")
+        if format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer: Any = pq.ParquetWriter(self._sink, self._schema)
+        else:
+            self._writer = pa.ipc.new_file(self._sink, self._schema)
+
+    def write_batch(self, bucket_id: str, events: List[dict]) -> None:
+        self._writer.write_batch(_record_batch(self._schema, bucket_id, events))
+
+    def end_bucket(self, bucket_id: str, metadata: dict) -> None:
+        self._metadata[bucket_id] = metadata
+
+    def close(self) -> None:
+        metadata = {METADATA_KEY: dumps(self._metadata).decode("utf8")}
+        if self._format == "parquet":
+            self._writer.add_key_value_metadata(metadata)
+        else:
+            empty = _record_batch(self._schema, "", [])
+            self._writer.write_batch(empty, custom_metadata=metadata)
+        self._writer.close()
+        self._sink.close()
+
+    def abort(self) -> None:
+        # The file is deleted, so it doesn't matter if it's finalised
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+        self._sink.close()
+
+
+def write_export(
+    items: Iterable[Tuple[str, str, Any]],
+    path: str,
+    format: Optional[str] = None,
+    batch_size: int = 10_000,
+) -> Dict[str, int]:
+    """
+    Writes an export to a file, as its items are received.
+
+    `items` are `(bucket_id, key, value)` as yielded by `ActivityWatchClient.stream_export`,
+    where the events of a bucket are yielded one at a time with the key "events". Only
+    `batch_size` events are held in memory at a time.
+
+    The format is given by the extension of `path`, unless `format` ("ndjson", "parquet"
+    or "arrow") is given. Returns the number of events written for each bucket.
+
+    The file is written next to `path`, with a `.part` suffix, and renamed to `path` once
+    complete. If writing fails, it's deleted and `path` is left as it was.
+    """
+    format = _check_format(format or format_of(path))
+    part_path = f"{path}.part"
+    writer: Any = (
+        _NDJSONWriter(part_path)
+        if format == "ndjson"
+        else _ArrowWriter(part_path, format)
+    )
+    counts: Dict[str, int] = {}
+    metadata: Dict[str, dict] = {}
+    batch: List[dict] = []
+    current: Optional[str] = None
+    try:
+        for bucket_id, key, value in items:
+            if bucket_id != current:
+                if current is not None:
+                    if batch:
+                        writer.write_batch(current, batch)
+                        batch = []
+                    writer.end_bucket(current, metadata[current])
+                current = bucket_id
+                metadata[bucket_id] = {}
+                counts[bucket_id] = 0
+            if key == "events":
+                batch.append(value)
+                counts[bucket_id] += 1
+                if len(batch) >= batch_size:
+                    writer.write_batch(bucket_id, batch)
+                    batch = []
+            else:
+                metadata[bucket_id][key] = value
+        if current is not None:
+            if batch:
+                writer.write_batch(current, batch)
+            writer.end_bucket(current, metadata[current])
+        writer.close()
+    except BaseException:
+        writer.abort()
+        os.remove(part_path)
+        raise
+    os.replace(part_path, path)
+    return counts
+
+
+def _column_view(array: "pa.Array", format: str) -> memoryview:
+    """The values of a numeric array without nulls, as a view of its buffer (no copy)."""
+    if array.null_count:
+        raise ValueError(f"Unexpected null values in export file column {array.type}")
+    buffer = array.buffers()[1]
+    view = memoryview(buffer).cast(format)  # type: ignore
+    return view[array.offset : array.offset + len(array)]
+
+
+def _frame(batch: "pa.RecordBatch") -> EventFrame:
+    return EventFrame(
+        _column_view(batch.column("id"), "q"),
+        _column_view(batch.column("timestamp"), "q"),
+        _column_view(batch.column("duration"), "d"),
+        data_columns(loads(data) for data in batch.column("data").to_pylist()),
+    )
+
+
+def _split_by_bucket(
+    batch: "pa.RecordBatch",
+) -> Iterator[Tuple[str, "pa.RecordBatch"]]:
+    import pyarrow.compute as pc
+
+    column = batch.column("bucket")
+    buckets = pc.unique(column).to_pylist()
+    if len(buckets) == 1:
+        # As written by write_export
+        yield buckets[0], batch
+        return
+    for bucket_id in buckets:
+        yield bucket_id, batch.filter(pc.equal(column, bucket_id))
+
+
+def _arrow_batches(path: str, format: str) -> Tuple[Iterator[Any], Dict[str, dict]]:
+    import pyarrow as pa
+
+    if format == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        metadata = (parquet_file.metadata.metadata or {}).get(METADATA_KEY.encode())
+        batches: Iterator[Any] = (
+            batch
+            for i in range(parquet_file.num_row_groups)
+            for batch in parquet_file.read_row_group(i).to_batches()
+        )
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        n = reader.num_record_batches
+        metadata = None
+        if n:
+            last = reader.get_batch_with_custom_metadata(n - 1).custom_metadata
+            metadata = (last or {}).get(METADATA_KEY.encode())
+        batches = (reader.get_batch(i) for i in range(n))
+    return batches, loads(metadata) if metadata else {}
+
+
+def _read_ndjson(path: str) -> Tuple[Dict[str, List[dict]], Dict[str, dict]]:
+    events: Dict[str, List[dict]] = {}
+    metadata: Dict[str, dict] = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = loads(line)
+            bucket_id = item.pop("bucket")
+            if "metadata" in item:
+                metadata[bucket_id] = item["metadata"]
+            else:
+                events.setdefault(bucket_id, []).append(item)
+    return events, metadata
+
+
+def load_export(path: str, format: Optional[str] = None) -> dict:
+    """
+    Loads an export file written by `write_export`, with the events of each bucket as an `EventFrame`.
+
+    Returns the same structure as `ActivityWatchClient.export_all`, which can be passed to
+    `LocalQueryEngine.from_export`.
+
+    Arrow files are memory-mapped. The `ids`, `timestamps` and `durations` columns of the
+    frame of a bucket written in a single batch (at most `batch_size` events) are views of
+    the mapped file instead of copies; the batches of larger buckets are copied once, into
+    a single frame. Parquet files are decoded, and NDJSON files parsed, into memory.
+    """
+    format = _check_format(format or format_of(path))
+    frames: Dict[str, List[EventFrame]] = {}
+    if format == "ndjson":
+        events, metadata = _read_ndjson(path)
+        for bucket_id, bucket_events in events.items():
+            frames[bucket_id] = [EventFrame.from_json(bucket_events)]
+    else:
+        batches, metadata = _arrow_batches(path, format)
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            for bucket_id, bucket_batch in _split_by_bucket(batch):
+                frames.setdefault(bucket_id, []).append(_frame(bucket_batch))
+
+    buckets = {}
+    for bucket_id in list(metadata) + [b for b in frames if b not in metadata]:
+        bucket_frames = frames.get(bucket_id, [])
+        if len(bucket_frames) == 1:
+            events_frame = bucket_frames[0]
+        else:
+            events_frame = EventFrame.concat(bucket_frames)
+        buckets[bucket_id] = {
+            "id": bucket_id,
+            **metadata.get(bucket_id, {}),
+            "events": events_frame,
+        }
+    return {"buckets": buckets}
@@ -0,0 +1,284 @@
+"""
+Vectorized interval operations on events, backed by NumPy.
+
+Client-side equivalents of the `aw_transform` functions that work on time periods,
+operating on the columns of an `EventFrame` instead of on lists of `Event`.
+
+The functions taking frames mirror their `aw_transform` counterparts. They are built on
+kernels operating on arrays of start and end times, in nanoseconds since the epoch, which
+can also be used directly.
+
+Requires NumPy: `pip install aw-client[numpy]`
+"""
+
+from array import array
+from datetime import timedelta
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+
+from .eventframe import NO_ID, EventFrame
+
+Intervals = Tuple[np.ndarray, np.ndarray]
+
+# Same as in aw_transform.flood, overlaps smaller than this are treated as gaps
+NEGATIVE_GAP_TRIM_THRES = 100_000_000  # 0.1s in ns
+
+
+def intervals(frame: EventFrame) -> Intervals:
+    """Returns the start and end times of the events in a frame, in ns since the epoch."""
+    starts = np.asarray(frame.timestamps, dtype=np.int64)
+    durations = np.asarray(frame.durations, dtype=np.float64)
+    return starts, starts + np.rint(durations * 1e9).astype(np.int64)
+
+
+def factorize(frame: EventFrame, keys: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Returns an integer code for every event, equal for events with equal data.
+
+    If `keys` is given, only those data keys are compared.
+    """
+    codes: Optional[np.ndarray] = None
+    for key in frame.data if keys is None else keys:
+        if key not in frame.data:
+            continue
+        values = frame.data[key]
+        try:
+            index = {v: i for i, v in enumerate(dict.fromkeys(values))}
+        except TypeError:
+            # Lists, such as categories, aren't hashable
+            values = [tuple(v) if isinstance(v, list) else v for v in values]
+            index = {v: i for i, v in enumerate(dict.fromkeys(values))}
+        column = np.fromiter(
+            map(index.__getitem__, values), dtype=np.int64, count=len(values)
+        )
+        if codes is None:
+            codes = column
+        else:
+            # Combine with the codes so far, and compact to keep the codes small
+            _, codes = np.unique(codes * len(index) + column, return_inverse=True)
+            codes = codes.reshape(-1)
+    if codes is None:
+        return np.zeros(len(frame), dtype=np.int64)
+    return codes
+
+
+def _to_frame(
+    source: Optional[EventFrame],
+    rows: Optional[np.ndarray],
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> EventFrame:
+    """Builds a frame with the given periods, taking ids and data from `rows` of `source`."""
+    ids, timestamps, durations = array("q"), array("q"), array("d")
+    data: Dict[str, List[Any]] = {}
+    if source is None or rows is None:
+        ids = array("q", [NO_ID]) * len(starts)
+    else:
+        ids.frombytes(np.asarray(source.ids, dtype=np.int64)[rows].tobytes())
+        indices = rows.tolist()
+        for key, column in source.data.items():
+            data[key] = list(map(column.__getitem__, indices))
+    timestamps.frombytes(starts.astype(np.int64).tobytes())
+    durations.frombytes(((ends - starts) / 1e9).tobytes())
+    return EventFrame(ids, timestamps, durations, data)
+
+
+def _sort(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Returns the indices that sort intervals by start, then by duration."""
+    return np.lexsort((ends - starts, starts))
+
+
+#
+#   Kernels
+#
+
+
+def union_intervals(
+    starts: np.ndarray, ends: np.ndarray, merge_adjacent: bool = True
+) -> Intervals:
+    """
+    Merges overlapping intervals, returning sorted non-overlapping intervals.
+
+    Adjacent intervals, where one ends as the next starts, are merged unless `merge_adjacent` is False.
+    """
+    if len(starts) == 0:
+        return starts[:0], ends[:0]
+    order = _sort(starts, ends)
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new = np.empty(len(starts), dtype=bool)
+    new[0] = True
+    new[1:] = starts[1:] > reach[:-1] if merge_adjacent else starts[1:] >= reach[:-1]
+    first = np.flatnonzero(new)
+    return starts[first], np.maximum.reduceat(ends, first)
+
+
+def intersect_pairs(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    filter_starts: np.ndarray,
+    filter_ends: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Intersects sorted intervals with sorted, non-overlapping filter intervals.
+
+    Returns the start and end of every non-empty intersection, and the index of the
+    interval it was cut from.
+    """
+    # Filters overlapping interval i are those in [lo[i], hi[i])
+    lo = np.searchsorted(filter_ends, starts, side="right")
+    hi = np.searchsorted(filter_starts, ends, side="left")
+    counts = np.maximum(hi - lo, 0)
+    rows = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.cumsum(counts) - counts
+    filters = lo[rows] + np.arange(len(rows)) - offsets[rows]
+    cut_starts = np.maximum(starts[rows], filter_starts[filters])
+    cut_ends = np.minimum(ends[rows], filter_ends[filters])
+    keep = cut_ends > cut_starts
+    return cut_starts[keep], cut_ends[keep], rows[keep]
+
+
+def flood_intervals(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    codes: np.ndarray,
+    pulsetime: float = 5,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fills gaps of at most `pulsetime` seconds between intervals sorted by start and duration.
+
+    Neighbours with equal codes are merged across the gap, otherwise the gap is split at
+    its midpoint. Where intervals with different codes overlap, the later one wins.
+
+    Returns the start and end of the flooded intervals, and the index of the first interval
+    each was built from. Touching intervals with equal codes are merged into one.
+    """
+    if len(starts) == 0:
+        return starts[:0], ends[:0], np.zeros(0, dtype=np.int64)
+    starts, ends = starts.copy(), ends.copy()
+    reach = np.maximum.accumulate(ends)[:-1]
+    gap = starts[1:] - reach
+    same = codes[1:] == codes[:-1]
+    pulse = int(pulsetime * 1e9)
+
+    split = ~same & (gap != 0) & (gap > -NEGATIVE_GAP_TRIM_THRES) & (gap <= pulse)
+    midpoint = (reach + gap // 2)[split]
+    ends[:-1][split] = midpoint
+    starts[1:][split] = midpoint
+
+    trim = ~same & (gap <= -NEGATIVE_GAP_TRIM_THRES)
+    ends[:-1][trim] = starts[1:][trim]
+
+    # Runs of equal codes that are overlapping, touching, or within pulsetime are merged
+    new = np.empty(len(starts), dtype=bool)
+    new[0] = True
+    new[1:] = ~same | (gap > pulse)
+    first = np.flatnonzero(new)
+    group_starts = np.minimum.reduceat(starts, first)
+    group_ends = np.maximum.reduceat(ends, first)
+    keep = group_ends > group_starts
+    return group_starts[keep], group_ends[keep], first[keep]
+
+
+#
+#   Frame operations, same as in aw_transform
+#
+
+
+def flood(frame: EventFrame, pulsetime: float = 5) -> EventFrame:
+    """
+    Fills short gaps between events, see `aw_transform.flood`.
+
+    Unlike `aw_transform.flood`, touching events with equal data are always returned as
+    one event, so results match after merging those.
+    """
+    starts, ends = intervals(frame)
+    order = _sort(starts, ends)
+    codes = factorize(frame)[order]
+    new_starts, new_ends, first = flood_intervals(
+        starts[order], ends[order], codes, pulsetime
+    )
+    return _to_frame(frame, order[first], new_starts, new_ends)
+
+
+def period_union(frame1: EventFrame, frame2: EventFrame) -> EventFrame:
+    """Returns events without data covering the time covered by either frame, see `aw_transform.period_union`."""
+    starts1, ends1 = intervals(frame1)
+    starts2, ends2 = intervals(frame2)
+    starts, ends = union_intervals(
+        np.concatenate([starts1, starts2]), np.concatenate([ends1, ends2])
+    )
+    return _to_frame(None, None, starts, ends)
+
+
+def period_intersect(frame1: EventFrame, frame2: EventFrame) -> EventFrame:
+    """Returns events without data covering the time covered by both frames."""
+    starts1, ends1 = union_intervals(*intervals(frame1))
+    starts2, ends2 = union_intervals(*intervals(frame2))
+    starts, ends, _ = intersect_pairs(starts1, ends1, starts2, ends2)
+    return _to_frame(None, None, starts, ends)
+
+
+def filter_period_intersect(frame: EventFrame, filter_frame: EventFrame) -> EventFrame:
+    """
+    Cuts events to the time periods covered by `filter_frame`, see `aw_transform.filter_period_intersect`.
+
+    Events without duration are dropped. Overlapping filter events are merged first, so
+    time is never counted twice.
+    """
+    starts, ends = intervals(frame)
+    order = _sort(starts, ends)
+    filter_starts, filter_ends = union_intervals(
+        *intervals(filter_frame), merge_adjacent=False
+    )
+    cut_starts, cut_ends, rows = intersect_pairs(
+        starts[order], ends[order], filter_starts, filter_ends
+    )
+    return _to_frame(frame, order[rows], cut_starts, cut_ends)
+
+
+def merge_events_by_keys(frame: EventFrame, keys: Sequence[str]) -> EventFrame:
+    """
+    Sums the duration of events sharing values for `keys`, see `aw_transform.merge_events_by_keys`.
+
+    Events where a key isn't set are grouped separately from events where it is set.
+    """
+    if not keys:
+        return frame
+    codes = factorize(frame, keys)
+    # Index of the first event with each code, assigning in reverse so the first one is kept
+    n_codes = int(codes.max()) + 1 if len(codes) else 0
+    first = np.empty(n_codes, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    durations = np.bincount(
+        codes,
+        weights=np.asarray(frame.durations, dtype=np.float64),
+        minlength=n_codes,
+    )
+    # Keep groups in order of first appearance, like aw_transform
+    order = np.argsort(first)
+    rows = first[order].tolist()
+    data = {
+        key: [frame.data[key][i] for i in rows] for key in keys if key in frame.data
+    }
+    return EventFrame(
+        array("q", [NO_ID]) * len(rows),
+        array("q", (frame.timestamps[i] for i in rows)),
+        array("d", durations[order].tolist()),
+        data,
+    )
+
+
+def sum_durations(frame: EventFrame) -> timedelta:
+    """Sums the durations of all events, see `aw_transform.sum_durations`."""
+    return timedelta(
+        seconds=float(np.sum(np.asarray(frame.durations, dtype=np.float64)))
+    )
@@ -0,0 +1,68 @@
+"""
+JSON encoding and decoding of request and response bodies.
+
+Uses orjson if it is installed (`pip install aw-client[orjson]`), and the standard
+library otherwise. Both produce equivalent JSON.
+
+Events are encoded directly, without converting them with `Event.to_json_dict` first:
+timestamps are encoded as ISO 8601 strings and durations as seconds, as `to_json_dict`
+does. Other `datetime` and `timedelta` values are encoded the same way.
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# Name of the library in use, either "orjson" or "json"
+backend = "orjson" if orjson is not None else "json"
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, timedelta):
+        return o.total_seconds()
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _dumps_json(obj: Any) -> bytes:
+    return json.dumps(obj, default=_default).encode("utf8")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encodes `obj` as UTF-8 JSON."""
+    if backend == "orjson":
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Such as integers larger than 64 bits, which only the standard library supports
+            pass
+    return _dumps_json(obj)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decodes JSON, given as bytes (UTF-8) or str."""
+    if backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def set_backend(name: Optional[str] = None) -> None:
+    """
+    Selects the JSON library to use, "orjson" or "json".
+
+    If `name` is None, orjson is used if it is installed.
+    """
+    global backend
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson" and orjson is None:
+        raise ValueError("orjson is not installed")
+    if name not in ("orjson", "json"):
+        raise ValueError(f"Unknown JSON backend: {name}")
+    backend = name
@@ -0,0 +1,153 @@
+"""
+Incremental decoding of large JSON responses.
+
+Lets the client yield events, buckets or query periods while the response body is still
+being received, instead of first decoding the whole body into memory.
+Values are decoded with the standard library decoder, one selected value at a time.
+"""
+
+import codecs
+import json
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+# Matches any key in an object, or any item in an array, when used in a path
+ANY = object()
+
+PathItem = Union[str, int, object]
+Path = Tuple[PathItem, ...]
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Reads JSON values from an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, min_size: int = 1) -> bool:
+        """Reads until at least `min_size` unread characters are buffered, returns False if at EOF."""
+        buf = [self._buf[self._pos :]]
+        size = len(buf[0])
+        while size < min_size and not self._eof:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._eof = True
+                chunk = b""
+            text = self._utf8.decode(chunk, final=self._eof)
+            buf.append(text)
+            size += len(text)
+        self._buf = "".join(buf)
+        self._pos = 0
+        return size > 0
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or an empty string at EOF."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        c = self.peek()
+        if c != char:
+            raise json.JSONDecodeError(f"Expected {char!r}", self._buf, self._pos)
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Decodes the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+                # A value ending at the end of the buffer might be a truncated number
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Double the buffer before retrying, to not re-decode large values too many times
+            self._fill(2 * (len(self._buf) - self._pos) + 1)
+
+
+def _walk(
+    reader: _Reader, prefix: Path, paths: List[Path], empty: bool
+) -> Iterator[Tuple[Path, Any]]:
+    c = reader.peek()
+    descend = c != "" and c in "{[" and any(paths)
+    if not descend:
+        value = reader.value()
+        if () in paths:
+            yield prefix, value
+        return
+
+    reader.expect(c)
+    close = "}" if c == "{" else "]"
+    index = 0
+    if reader.peek() == close:
+        reader.expect(close)
+        if empty and () in paths:
+            yield prefix, {} if c == "{" else []
+        return
+    while True:
+        if c == "{":
+            key: Union[str, int] = reader.value()
+            reader.expect(":")
+        else:
+            key = index
+            index += 1
+        child_paths = [p[1:] for p in paths if p and (p[0] is ANY or p[0] == key)]
+        if child_paths == [()]:
+            # Fast path for the common case of yielding every item
+            yield prefix + (key,), reader.value()
+        elif child_paths:
+            yield from _walk(reader, prefix + (key,), child_paths, empty)
+        else:
+            reader.value()
+        if reader.peek() == ",":
+            reader.expect(",")
+        else:
+            reader.expect(close)
+            return
+
+
+def iterparse(
+    chunks: Iterable[bytes], *paths: Sequence[PathItem], empty: bool = False
+) -> Iterator[Tuple[Path, Any]]:
+    """
+    Incrementally parses a JSON document, yielding `(path, value)` for every value at one of `paths`.
+
+    A path is a sequence of object keys and array indices, where `ANY` matches every key or index.
+    Only one matched value is decoded and held in memory at a time. Values that are not on any of
+    the paths are decoded and thrown away. If a value matches one path and is the parent of
+    another, it is descended into rather than yielded. If `empty` is true, such a value is
+    yielded if it is an empty object or array, so that it isn't skipped.
+
+    :Example:
+
+        # Yield every event of every bucket in an export
+        for (_, bucket_id, _, _), event in iterparse(chunks, ["buckets", ANY, "events", ANY]):
+            ...
+    """
+    reader = _Reader(chunks)
+    yield from _walk(reader, (), [tuple(p) for p in paths], empty)
+    if reader.peek():
+        raise json.JSONDecodeError("Extra data", reader._buf, reader._pos)
@@ -0,0 +1,815 @@
+"""
+Local evaluation of query programs, without an aw-server.
+
+Evaluates the same query language as `ActivityWatchClient.query` (such as the queries
+built by `aw_client.queries`) against events held in memory, typically loaded from an
+export. The query functions are the ones of `aw_transform`, which the server uses too.
+
+With `vectorized=True`, events are kept as `EventFrame` between query functions, and
+interval operations use the kernels in `aw_client.intervals` (requires NumPy).
+"""
+
+import functools
+import inspect
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from aw_core.models import Event
+
+from .eventframe import EPOCH, MISSING, EventFrame, dt_to_ns
+
+#
+#   Parsing
+#
+
+_TOKENS = re.compile(
+    r"""
+    \s*(?:
+        (?P<string>"(?:\\"|[^"])*"|'(?:\\'|[^'])*')
+        |(?P<number>\d+(?:\.\d+)?)
+        |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+        |(?P<punct>[=;()\[\]{},:])
+    )
+    """,
+    re.VERBOSE,
+)
+
+# Nodes of a parsed query, as (kind, value) tuples
+Node = Tuple[str, Any]
+
+
+def _tokenize(query: str) -> List[Tuple[str, Any]]:
+    tokens: List[Tuple[str, Any]] = []
+    pos = 0
+    while pos < len(query):
+        match = _TOKENS.match(query, pos)
+        if match is None:
+            if query[pos:].isspace():
+                break
+            raise ValueError(f"Syntax error in query: {query[pos : pos + 40]!r}")
+        kind = match.lastgroup
+        text = match.group(kind)  # type: ignore
+        if kind == "string":
+            # Like aw-server, only the quote character itself can be escaped
+            quote = text[0]
+            tokens.append(("string", text[1:-1].replace("\\" + quote, quote)))
+        elif kind == "number":
+            tokens.append(("number", float(text) if "." in text else int(text)))
+        else:
+            tokens.append((kind, text))  # type: ignore
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, query: str) -> None:
+        self.tokens = _tokenize(query)
+        self.pos = 0
+
+    def _peek(self) -> Tuple[str, Any]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ("end", None)
+
+    def _next(self) -> Tuple[str, Any]:
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _expect(self, punct: str) -> None:
+        token = self._next()
+        if token != ("punct", punct):
+            raise ValueError(f"Expected {punct!r} in query, got {token[1]!r}")
+
+    def statements(self) -> List[Tuple[str, Node]]:
+        statements = []
+        while self._peek()[0] != "end":
+            if self._peek() == ("punct", ";"):
+                self._next()
+                continue
+            kind, name = self._next()
+            if kind != "name":
+                raise ValueError(f"Can only assign to a variable, not {name!r}")
+            self._expect("=")
+            statements.append((name, self._expr()))
+            if self._peek()[0] != "end":
+                self._expect(";")
+        return statements
+
+    def _items(self, end: str) -> Iterable[None]:
+        """Yields once per comma-separated item, until `end`."""
+        while self._peek() != ("punct", end):
+            yield
+            if self._peek() != ("punct", end):
+                self._expect(",")
+        self._next()
+
+    def _expr(self) -> Node:
+        kind, value = self._next()
+        if kind in ("string", "number"):
+            return ("const", value)
+        if kind == "name":
+            if self._peek() == ("punct", "("):
+                self._next()
+                return ("call", (value, [self._expr() for _ in self._items(")")]))
+            return ("var", value)
+        if (kind, value) == ("punct", "["):
+            return ("list", [self._expr() for _ in self._items("]")])
+        if (kind, value) == ("punct", "{"):
+            entries = []
+            for _ in self._items("}"):
+                key_kind, key = self._next()
+                if key_kind != "string":
+                    raise ValueError(f"Dict keys must be strings, not {key!r}")
+                self._expect(":")
+                entries.append((key, self._expr()))
+            return ("dict", entries)
+        raise ValueError(f"Unexpected {value!r} in query")
+
+
+@functools.lru_cache(maxsize=64)
+def parse(query: str) -> List[Tuple[str, Node]]:
+    """Parses a query into a list of (variable, expression) assignments."""
+    return _Parser(query).statements()
+
+
+#
+#   Query functions
+#
+
+_functions: Dict[str, Callable[..., Any]] = {}
+# Versions of functions operating on EventFrames, used when vectorized
+_frame_functions: Dict[str, Callable[..., Any]] = {}
+
+
+def _function(name: str, frames: bool = False):
+    def register(f):
+        (_frame_functions if frames else _functions)[name] = f
+        _signatures[f] = inspect.signature(f)
+        return f
+
+    return register
+
+
+_signatures: Dict[Callable[..., Any], inspect.Signature] = {}
+
+
+class _Context:
+    def __init__(
+        self,
+        engine: "LocalQueryEngine",
+        namespace: Dict[str, Any],
+        start: datetime,
+        end: datetime,
+    ) -> None:
+        self.engine = engine
+        self.namespace = namespace
+        self.start = start
+        self.end = end
+
+
+def _check(value: Any, t: type, name: str) -> None:
+    if not isinstance(value, t):
+        raise TypeError(
+            f"Argument of {name} is of invalid type, expected {t.__name__} but was {type(value).__name__}"
+        )
+
+
+def _events(value: Any, name: str) -> List[Event]:
+    if isinstance(value, EventFrame):
+        return value.to_events()
+    _check(value, list, name)
+    return value
+
+
+def _frame(value: Any, name: str) -> EventFrame:
+    if isinstance(value, EventFrame):
+        return value
+    _check(value, list, name)
+    return EventFrame.from_events(value)
+
+
+def _rules(classes: list) -> list:
+    from aw_transform import Rule
+
+    return [(cls, Rule(rule)) for cls, rule in classes]
+
+
+@_function("find_bucket")
+def _find_bucket(ctx: _Context, filter_str: str, hostname: Optional[str] = None):
+    _check(filter_str, str, "find_bucket")
+    for bucket_id, bucket in ctx.engine.buckets.items():
+        if filter_str in bucket_id and (
+            not hostname or bucket.metadata.get("hostname") == hostname
+        ):
+            return bucket_id
+    raise ValueError(
+        f"Unable to find bucket matching '{filter_str}' (hostname filter set to '{hostname}')"
+    )
+
+
+@_function("query_bucket")
+def _query_bucket(ctx: _Context, bucket_id: str) -> List[Event]:
+    return ctx.engine.get_events(bucket_id, ctx.start, ctx.end).to_events()
+
+
+@_function("query_bucket", frames=True)
+def _query_bucket_frame(ctx: _Context, bucket_id: str) -> EventFrame:
+    return ctx.engine.get_events(bucket_id, ctx.start, ctx.end)
+
+
+@_function("query_bucket_eventcount")
+def _query_bucket_eventcount(ctx: _Context, bucket_id: str) -> int:
+    return ctx.engine.get_eventcount(bucket_id, ctx.start, ctx.end)
+
+
+@_function("filter_keyvals")
+def _filter_keyvals(ctx: _Context, events, key: str, vals: list) -> List[Event]:
+    from aw_transform import filter_keyvals
+
+    return filter_keyvals(_events(events, "filter_keyvals"), key, vals, False)
+
+
+@_function("exclude_keyvals")
+def _exclude_keyvals(ctx: _Context, events, key: str, vals: list) -> List[Event]:
+    from aw_transform import filter_keyvals
+
+    return filter_keyvals(_events(events, "exclude_keyvals"), key, vals, True)
+
+
+@_function("filter_keyvals_regex")
+def _filter_keyvals_regex(ctx: _Context, events, key: str, regex: str) -> List[Event]:
+    from aw_transform import filter_keyvals_regex
+
+    return filter_keyvals_regex(_events(events, "filter_keyvals_regex"), key, regex)
+
+
+@_function("filter_period_intersect")
+def _filter_period_intersect(ctx: _Context, events, filter_events) -> List[Event]:
+    from aw_transform import filter_period_intersect
+
+    name = "filter_period_intersect"
+    return filter_period_intersect(_events(events, name), _events(filter_events, name))
+
+
+@_function("period_union")
+def _period_union(ctx: _Context, events1, events2) -> List[Event]:
+    from aw_transform import period_union
+
+    return period_union(
+        _events(events1, "period_union"), _events(events2, "period_union")
+    )
+
+
+@_function("limit_events")
+def _limit_events(ctx: _Context, events, count: int) -> List[Event]:
+    _check(count, int, "limit_events")
+    return _events(events, "limit_events")[:count]
+
+
+@_function("merge_events_by_keys")
+def _merge_events_by_keys(ctx: _Context, events, keys: list) -> List[Event]:
+    from aw_transform import merge_events_by_keys
+
+    _check(keys, list, "merge_events_by_keys")
+    return merge_events_by_keys(_events(events, "merge_events_by_keys"), keys)
+
+
+@_function("merge_subwatcher_fields")
+def _merge_subwatcher_fields(
+    ctx: _Context, base_events, subwatcher_events, keys: list, conflict="base_wins"
+) -> List[Event]:
+    from aw_transform import merge_subwatcher_fields
+
+    name = "merge_subwatcher_fields"
+    return merge_subwatcher_fields(
+        _events(base_events, name), _events(subwatcher_events, name), keys, conflict
+    )
+
+
+@_function("chunk_events_by_key")
+def _chunk_events_by_key(ctx: _Context, events, key: str) -> List[Event]:
+    from aw_transform import chunk_events_by_key
+
+    return chunk_events_by_key(_events(events, "chunk_events_by_key"), key)
+
+
+@_function("sort_by_timestamp")
+def _sort_by_timestamp(ctx: _Context, events) -> List[Event]:
+    from aw_transform import sort_by_timestamp
+
+    return sort_by_timestamp(_events(events, "sort_by_timestamp"))
+
+
+@_function("sort_by_duration")
+def _sort_by_duration(ctx: _Context, events) -> List[Event]:
+    from aw_transform import sort_by_duration
+
+    return sort_by_duration(_events(events, "sort_by_duration"))
+
+
+@_function("sum_durations")
+def _sum_durations(ctx: _Context, events) -> timedelta:
+    from aw_transform import sum_durations
+
+    return sum_durations(_events(events, "sum_durations"))
+
+
+@_function("concat")
+def _concat(ctx: _Context, events1, events2) -> List[Event]:
+    return _events(events1, "concat") + _events(events2, "concat")
+
+
+@_function("union_no_overlap")
+def _union_no_overlap(ctx: _Context, events1, events2) -> List[Event]:
+    from aw_transform import union_no_overlap
+
+    name = "union_no_overlap"
+    return union_no_overlap(_events(events1, name), _events(events2, name))
+
+
+@_function("flood")
+def _flood(ctx: _Context, events, pulsetime=5) -> List[Event]:
+    from aw_transform import flood
+
+    return flood(_events(events, "flood"), pulsetime)
+
+
+@_function("split_url_events")
+def _split_url_events(ctx: _Context, events) -> List[Event]:
+    from aw_transform import split_url_events
+
+    return split_url_events(_events(events, "split_url_events"))
+
+
+@_function("simplify_window_titles")
+def _simplify_window_titles(ctx: _Context, events, key: str) -> List[Event]:
+    from aw_transform import simplify_string
+
+    return simplify_string(_events(events, "simplify_window_titles"), key=key)
+
+
+@_function("nop")
+def _nop(ctx: _Context) -> int:
+    return 1
+
+
+@_function("categorize")
+def _categorize(ctx: _Context, events, classes: list) -> List[Event]:
+    from aw_transform import categorize
+
+    _check(classes, list, "categorize")
+    return categorize(_events(events, "categorize"), _rules(classes))
+
+
+@_function("tag")
+def _tag(ctx: _Context, events, classes: list) -> List[Event]:
+    from aw_transform import tag
+
+    _check(classes, list, "tag")
+    return tag(_events(events, "tag"), _rules(classes))
+
+
+#
+#   Query functions on EventFrames, used when vectorized
+#
+
+
+@_function("flood", frames=True)
+def _flood_frame(ctx: _Context, events, pulsetime=5) -> EventFrame:
+    from . import intervals
+
+    return intervals.flood(_frame(events, "flood"), pulsetime)
+
+
+@_function("period_union", frames=True)
+def _period_union_frame(ctx: _Context, events1, events2) -> EventFrame:
+    from . import intervals
+
+    return intervals.period_union(
+        _frame(events1, "period_union"), _frame(events2, "period_union")
+    )
+
+
+@_function("filter_period_intersect", frames=True)
+def _filter_period_intersect_frame(ctx: _Context, events, filter_events) -> EventFrame:
+    from . import intervals
+
+    name = "filter_period_intersect"
+    return intervals.filter_period_intersect(
+        _frame(events, name), _frame(filter_events, name)
+    )
+
+
+@_function("merge_events_by_keys", frames=True)
+def _merge_events_by_keys_frame(ctx: _Context, events, keys: list) -> EventFrame:
+    from . import intervals
+
+    _check(keys, list, "merge_events_by_keys")
+    return intervals.merge_events_by_keys(_frame(events, "merge_events_by_keys"), keys)
+
+
+@_function("sum_durations", frames=True)
+def _sum_durations_frame(ctx: _Context, events) -> timedelta:
+    from . import intervals
+
+    return intervals.sum_durations(_frame(events, "sum_durations"))
+
+
+def _filter_rows(
+    frame: EventFrame, key: str, predicate: Callable[[Any], bool]
+) -> EventFrame:
+    """Returns the rows where `key` is set, and `predicate` is true for its value."""
+    column = frame.data.get(key)
+    if column is None:
+        return frame[:0]
+    # Values repeat a lot (such as app names), so only check each value once
+    matches: Dict[Any, bool] = {}
+
+    def matching(value: Any) -> bool:
+        if value is MISSING:
+            return False
+        try:
+            result = matches.get(value)
+            if result is None:
+                result = matches[value] = predicate(value)
+            return result
+        except TypeError:
+            # Unhashable values, such as lists
+            return predicate(value)
+
+    return frame.take(i for i, value in enumerate(column) if matching(value))
+
+
+@_function("filter_keyvals", frames=True)
+def _filter_keyvals_frame(ctx: _Context, events, key: str, vals: list) -> EventFrame:
+    _check(vals, list, "filter_keyvals")
+    return _filter_rows(_frame(events, "filter_keyvals"), key, vals.__contains__)
+
+
+@_function("exclude_keyvals", frames=True)
+def _exclude_keyvals_frame(ctx: _Context, events, key: str, vals: list) -> EventFrame:
+    _check(vals, list, "exclude_keyvals")
+    frame = _frame(events, "exclude_keyvals")
+    column = frame.data.get(key)
+    if column is None:
+        return frame
+    return frame.take(
+        i for i, value in enumerate(column) if value is MISSING or value not in vals
+    )
+
+
+@_function("filter_keyvals_regex", frames=True)
+def _filter_keyvals_regex_frame(
+    ctx: _Context, events, key: str, regex: str
+) -> EventFrame:
+    r = re.compile(regex)
+    return _filter_rows(
+        _frame(events, "filter_keyvals_regex"), key, lambda v: bool(r.findall(v))
+    )
+
+
+@_function("limit_events", frames=True)
+def _limit_events_frame(ctx: _Context, events, count: int) -> EventFrame:
+    _check(count, int, "limit_events")
+    return _frame(events, "limit_events")[:count]
+
+
+@_function("sort_by_timestamp", frames=True)
+def _sort_by_timestamp_frame(ctx: _Context, events) -> EventFrame:
+    frame = _frame(events, "sort_by_timestamp")
+    return frame.take(sorted(range(len(frame)), key=frame.timestamps.__getitem__))
+
+
+@_function("sort_by_duration", frames=True)
+def _sort_by_duration_frame(ctx: _Context, events) -> EventFrame:
+    frame = _frame(events, "sort_by_duration")
+    return frame.take(
+        sorted(range(len(frame)), key=frame.durations.__getitem__, reverse=True)
+    )
+
+
+@_function("concat", frames=True)
+def _concat_frame(ctx: _Context, events1, events2) -> EventFrame:
+    return EventFrame.concat([_frame(events1, "concat"), _frame(events2, "concat")])
+
+
+@_function("categorize", frames=True)
+def _categorize_frame(ctx: _Context, events, classes: list) -> EventFrame:
+    from aw_transform import categorize
+
+    _check(classes, list, "categorize")
+    frame = _frame(events, "categorize")
+    rules = _rules(classes)
+    keys = list(frame.data)
+    # Events with the same data get the same category, so categorize each distinct data once
+    categories: Dict[Any, list] = {}
+    column = []
+    rows = zip(*(frame.data[key] for key in keys)) if keys else [()] * len(frame)
+    for row in rows:
+        try:
+            category = categories.get(row)
+            hashable = True
+        except TypeError:
+            # Unhashable values, such as lists
+            category, hashable = None, False
+        if category is None:
+            data = {k: v for k, v in zip(keys, row) if v is not MISSING}
+            (event,) = categorize([Event(timestamp=EPOCH, data=data)], rules)
+            category = event.data["$category"]
+            if hashable:
+                categories[row] = category
+        column.append(list(category))
+    data = dict(frame.data)
+    data["$category"] = column
+    return EventFrame(frame.ids, frame.timestamps, frame.durations, data)
+
+
+#
+#   Evaluation
+#
+
+
+def _evaluate(ctx: _Context, node: Node) -> Any:
+    kind, value = node
+    if kind == "const":
+        return value
+    if kind == "var":
+        if value not in ctx.namespace:
+            raise ValueError(
+                f"Tried to reference variable '{value}' which is not defined"
+            )
+        return ctx.namespace[value]
+    if kind == "call":
+        name, arg_nodes = value
+        args = [_evaluate(ctx, arg) for arg in arg_nodes]
+        f = (
+            _frame_functions.get(name) if ctx.engine.vectorized else None
+        ) or _functions.get(name)
+        if f is None:
+            raise ValueError(f"Tried to call function '{name}' which doesn't exist")
+        try:
+            _signatures[f].bind(ctx, *args)
+        except TypeError:
+            raise TypeError(
+                f"Tried to call function {name} with invalid amount of arguments"
+            ) from None
+        return f(ctx, *args)
+    if kind == "list":
+        return [_evaluate(ctx, item) for item in value]
+    if kind == "dict":
+        return {key: _evaluate(ctx, item) for key, item in value}
+    raise AssertionError(f"Unknown node {kind}")
+
+
+def _to_json(value: Any) -> Any:
+    """Converts a query result to what the server would respond with."""
+    if isinstance(value, Event):
+        return value.to_json_dict()
+    if isinstance(value, EventFrame):
+        return [e.to_json_dict() for e in value]
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _to_frames(value: Any) -> Any:
+    """Like `_to_json`, but returns lists of events as EventFrames, like `ActivityWatchClient.query(as_frame=True)`."""
+    if isinstance(value, EventFrame):
+        return value
+    if isinstance(value, list) and all(isinstance(e, Event) for e in value):
+        return EventFrame.from_events(value)
+    if isinstance(value, dict):
+        return {k: _to_frames(v) for k, v in value.items()}
+    return _to_json(value)
+
+
+class _Bucket:
+    def __init__(self, metadata: Dict[str, Any], frame: EventFrame) -> None:
+        self.metadata = metadata
+        # Sorted by timestamp, to find the events of a timeperiod by bisection
+        self.frame = frame.take(
+            sorted(range(len(frame)), key=frame.timestamps.__getitem__)
+        )
+        self.ends = [
+            ts + round(duration * 1e9)
+            for ts, duration in zip(self.frame.timestamps, self.frame.durations)
+        ]
+        self.max_duration = max(
+            (end - ts for ts, end in zip(self.frame.timestamps, self.ends)), default=0
+        )
+
+
+def _round_period(start: datetime, end: datetime) -> Tuple[int, int]:
+    """Rounds a timeperiod outwards to milliseconds, as aw-server does, in ns since the epoch."""
+    start = start.replace(microsecond=start.microsecond // 1000 * 1000)
+    milliseconds = 1 + end.microsecond // 1000
+    end = end.replace(microsecond=milliseconds * 1000 % 1000000) + timedelta(
+        seconds=milliseconds // 1000
+    )
+    return dt_to_ns(start), dt_to_ns(end)
+
+
+class LocalQueryEngine:
+    """
+    Evaluates queries against buckets held in memory.
+
+    Results are the same as `ActivityWatchClient.query` would return for a server with the
+    same buckets. With `vectorized=True`, time periods are kept at full precision instead of
+    being truncated to milliseconds like `Event` timestamps, so durations may differ by up to
+    a millisecond per event. Touching events with equal data may also be merged, and events
+    may be in a different order.
+    """
+
+    def __init__(self, vectorized: bool = False) -> None:
+        """
+        Args:
+            vectorized: Keep events as EventFrames, and use the NumPy kernels of `aw_client.intervals` where possible
+        """
+        self.vectorized = vectorized
+        self.buckets: Dict[str, _Bucket] = {}
+
+        # Worker processes for parallel queries, one pool per max_workers, created on first use
+        self._pools: Dict[int, ProcessPoolExecutor] = {}
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def from_export(cls, export: dict, vectorized: bool = False) -> "LocalQueryEngine":
+        """Creates an engine with the buckets of an export, as returned by `ActivityWatchClient.export_all`."""
+        engine = cls(vectorized)
+        for bucket in export["buckets"].values():
+            engine.add_bucket(bucket)
+        return engine
+
+    def add_bucket(self, bucket: dict) -> None:
+        """
+        Adds a bucket, given as exported.
+
+        The "events" of the bucket can also be a list of `Event`, or an `EventFrame`.
+        """
+        metadata = {k: v for k, v in bucket.items() if k != "events"}
+        events = bucket.get("events", [])
+        if isinstance(events, EventFrame):
+            frame = events
+        elif events and isinstance(events[0], Event):
+            frame = EventFrame.from_events(events)
+        else:
+            frame = EventFrame.from_json(events)
+        self.buckets[bucket["id"]] = _Bucket(metadata, frame)
+        # Workers hold a copy of the buckets, so new ones are started with this bucket
+        self._shutdown_pools(wait=False)
+
+    def _bucket(self, bucket_id: str) -> _Bucket:
+        _check(bucket_id, str, "query_bucket")
+        if bucket_id not in self.buckets:
+            raise ValueError(f"There's no bucket named '{bucket_id}'")
+        return self.buckets[bucket_id]
+
+    def get_events(self, bucket_id: str, start: datetime, end: datetime) -> EventFrame:
+        """
+        Returns the events of a bucket within a timeperiod, as the query function `query_bucket` does.
+
+        Events are trimmed to the timeperiod, and sorted by timestamp in descending order.
+        """
+        bucket = self._bucket(bucket_id)
+        start_ns, end_ns = _round_period(start, end)
+        timestamps = bucket.frame.timestamps
+        rows = [
+            i
+            for i in range(
+                bisect_left(timestamps, start_ns - bucket.max_duration),
+                bisect_right(timestamps, end_ns),
+            )
+            if bucket.ends[i] >= start_ns
+        ]
+        rows.reverse()
+        frame = bucket.frame.take(rows)
+        # Trim events to the timeperiod
+        trimmed_timestamps, trimmed_durations = array("q"), array("d")
+        for i, ts, duration in zip(rows, frame.timestamps, frame.durations):
+            event_end = bucket.ends[i]
+            if ts < start_ns or event_end > end_ns:
+                ts = max(ts, start_ns)
+                duration = (min(event_end, end_ns) - ts) / 1e9
+            trimmed_timestamps.append(ts)
+            trimmed_durations.append(duration)
+        return EventFrame(frame.ids, trimmed_timestamps, trimmed_durations, frame.data)
+
+    def get_eventcount(self, bucket_id: str, start: datetime, end: datetime) -> int:
+        timestamps = self._bucket(bucket_id).frame.timestamps
+        return bisect_right(timestamps, dt_to_ns(end)) - bisect_left(
+            timestamps, dt_to_ns(start)
+        )
+
+    def _query_period(
+        self, query: str, timeperiod: Tuple[datetime, datetime], as_frame: bool
+    ) -> Any:
+        start, end = timeperiod
+        namespace: Dict[str, Any] = {
+            "True": True,
+            "False": False,
+            "true": True,
+            "false": False,
+            "NAME": "",
+            "STARTTIME": start.isoformat(),
+            "ENDTIME": end.isoformat(),
+        }
+        ctx = _Context(self, namespace, start, end)
+        for name, node in parse(query):
+            namespace[name] = _evaluate(ctx, node)
+        if "RETURN" not in namespace:
+            raise ValueError(
+                "Query doesn't assign the RETURN variable, nothing to respond"
+            )
+        result = namespace["RETURN"]
+        return _to_frames(result) if as_frame else _to_json(result)
+
+    def query(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        as_frame: bool = False,
+        max_workers: int = 1,
+    ) -> List[Any]:
+        """
+        Runs a query and returns the result of each timeperiod, like `ActivityWatchClient.query`.
+
+        With `max_workers` > 1, timeperiods are evaluated in parallel by that many worker
+        processes. The workers are kept between calls, and get a copy of the buckets when
+        started; `add_bucket` replaces them, so that they see the added bucket.
+        """
+        for start, end in timeperiods:
+            if start.tzinfo is None or end.tzinfo is None:
+                raise ValueError("start/stop needs to have a timezone set")
+        if max_workers <= 1 or len(timeperiods) <= 1:
+            return [self._query_period(query, tp, as_frame) for tp in timeperiods]
+        with self._pool_lock:
+            # Submitted while holding the lock, so that add_bucket can't shut the pool down before
+            pool = self._pools.get(max_workers)
+            if pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers, initializer=_init_worker, initargs=(self,)
+                )
+                self._pools[max_workers] = pool
+            results = pool.map(
+                _query_in_worker,
+                [query] * len(timeperiods),
+                timeperiods,
+                [as_frame] * len(timeperiods),
+            )
+        return list(results)
+
+    def _shutdown_pools(self, wait: bool = True) -> None:
+        with self._pool_lock:
+            pools, self._pools = self._pools, {}
+        # Already submitted queries still finish
+        for pool in pools.values():
+            pool.shutdown(wait=wait)
+
+    def close(self) -> None:
+        """Stops the worker processes, if any."""
+        self._shutdown_pools()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Sent to worker processes without the pools
+        state = self.__dict__.copy()
+        del state["_pools"], state["_pool_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._pools = {}
+        self._pool_lock = threading.Lock()
+
+
+# The engine of a worker process
+_worker_engine: Optional[LocalQueryEngine] = None
+
+
+def _init_worker(engine: LocalQueryEngine) -> None:
+    global _worker_engine
+    _worker_engine = engine
+
+
+def _query_in_worker(
+    query: str, timeperiod: Tuple[datetime, datetime], as_frame: bool
+) -> Any:
+    assert _worker_engine is not None
+    return _worker_engine._query_period(query, timeperiod, as_frame)
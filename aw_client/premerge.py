@@ -0,0 +1,232 @@
+"""
+Client-side pre-merging of queued heartbeats.
+
+Watchers send a heartbeat every few seconds, most of which only extend the previous event.
+Instead of queueing every heartbeat, they are merged in memory the same way the server
+merges them, and the merged event of a bucket is only queued:
+
+ - when a heartbeat can't be merged into it (the data changed, or it's past the pulsetime),
+ - when it has grown to `commit_interval` long,
+ - by a timer, when it has waited `commit_interval` since its oldest unqueued heartbeat,
+   so that the last event of a watcher that goes quiet still reaches the server,
+ - on `flush()`, which `ActivityWatchClient.disconnect()` calls.
+
+An event that was queued is continued from its end, so that it's never sent twice.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    """The merged heartbeats of a bucket, since it was last queued."""
+
+    __slots__ = ("endpoint", "timestamp", "duration", "data", "dirty_since", "interval")
+
+    def __init__(
+        self,
+        endpoint: str,
+        timestamp: datetime,
+        duration: timedelta,
+        data: dict,
+        dirty_since: Optional[float],
+        interval: float,
+    ) -> None:
+        self.endpoint = endpoint
+        self.timestamp = timestamp
+        self.duration = duration
+        self.data = data
+        # Monotonic time of the oldest heartbeat that hasn't been queued, None if all have been
+        self.dirty_since = dirty_since
+        self.interval = interval
+
+    def to_json_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp.isoformat(),
+            "duration": self.duration.total_seconds(),
+            "data": self.data,
+        }
+
+
+class HeartbeatPremerger:
+    """
+    Pre-merges heartbeats per bucket, and passes merged events to `commit` to be queued.
+
+    `commit` is called with the heartbeat endpoint and the event as a JSON dict, from the
+    thread that adds a heartbeat, or from the flush timer thread. Calls are serialized,
+    so events of a bucket are committed in order.
+
+    Counts heartbeats and commits, and the staleness of committed events (the time their
+    oldest heartbeat waited in memory), to measure write volume and freshness.
+    """
+
+    def __init__(self, commit: Callable[[str, dict], None]) -> None:
+        self.commit = commit
+
+        self._lock = threading.Condition()
+        self._pending: Dict[str, _Pending] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        #: Number of heartbeats added
+        self.heartbeats = 0
+        #: Number of events committed, in total and by the flush timer
+        self.commits = 0
+        self.timed_commits = 0
+        #: Total and max staleness of committed events, in seconds
+        self.total_staleness = 0.0
+        self.max_staleness = 0.0
+
+    def add(
+        self,
+        bucket_id: str,
+        endpoint: str,
+        timestamp: datetime,
+        duration: timedelta,
+        data: dict,
+        pulsetime: float,
+        commit_interval: float,
+    ) -> None:
+        """Adds a heartbeat, merging it like `aw_transform.heartbeat_merge` does."""
+        now = time.monotonic()
+        with self._lock:
+            self.heartbeats += 1
+            self._ensure_thread()
+            pending = self._pending.get(bucket_id)
+            if pending is not None and (pending.data is data or pending.data == data):
+                pulse_end = (
+                    pending.timestamp + pending.duration + timedelta(seconds=pulsetime)
+                )
+                if (
+                    pending.timestamp <= timestamp <= pulse_end
+                    and pending.duration >= timedelta(0)
+                ):
+                    pending.duration = max(
+                        pending.duration, timestamp - pending.timestamp + duration
+                    )
+                    pending.endpoint = endpoint
+                    pending.interval = commit_interval
+                    if pending.dirty_since is None:
+                        pending.dirty_since = now
+                        self._lock.notify()
+                    if pending.duration.total_seconds() >= commit_interval:
+                        self._commit(pending, now)
+                        # Continue from the heartbeat, which is part of the committed event
+                        self._pending[bucket_id] = _Pending(
+                            endpoint, timestamp, duration, data, None, commit_interval
+                        )
+                    return
+            if pending is not None and pending.dirty_since is not None:
+                pending.endpoint = endpoint
+                self._commit(pending, now)
+            self._pending[bucket_id] = _Pending(
+                endpoint, timestamp, duration, data, now, commit_interval
+            )
+            self._lock.notify()
+
+    def _commit(self, pending: _Pending, now: float) -> None:
+        assert pending.dirty_since is not None
+        # Only marked as committed once `commit` returns, so that an event that fails to
+        # be queued is kept, and committed again later
+        self.commit(pending.endpoint, pending.to_json_dict())
+        staleness = now - pending.dirty_since
+        self.commits += 1
+        self.total_staleness += staleness
+        self.max_staleness = max(self.max_staleness, staleness)
+        pending.dirty_since = None
+
+    def _commit_and_continue(
+        self, bucket_id: str, pending: _Pending, now: float
+    ) -> None:
+        """Commits a pending event, and continues merging from its end."""
+        self._commit(pending, now)
+        self._pending[bucket_id] = _Pending(
+            pending.endpoint,
+            pending.timestamp + pending.duration,
+            timedelta(0),
+            pending.data,
+            None,
+            pending.interval,
+        )
+
+    def flush(self) -> int:
+        """Commits the events of all buckets that have unqueued heartbeats, returns how many."""
+        now = time.monotonic()
+        with self._lock:
+            dirty = [
+                (b, p) for b, p in self._pending.items() if p.dirty_since is not None
+            ]
+            for bucket_id, pending in dirty:
+                self._commit_and_continue(bucket_id, pending, now)
+        return len(dirty)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(
+                target=self._run, name="aw-client-premerge", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        with self._lock:
+            while not self._closed:
+                now = time.monotonic()
+                deadline = None
+                for bucket_id, pending in list(self._pending.items()):
+                    if pending.dirty_since is None:
+                        continue
+                    due = pending.dirty_since + pending.interval
+                    if due <= now:
+                        try:
+                            self._commit_and_continue(bucket_id, pending, now)
+                            self.timed_commits += 1
+                            continue
+                        except Exception:
+                            logger.exception(
+                                f"Failed to commit heartbeat to {bucket_id}"
+                            )
+                            # Still pending, retried after another interval
+                            due = now + pending.interval
+                    if deadline is None or due < deadline:
+                        deadline = due
+                self._lock.wait(None if deadline is None else deadline - now)
+
+    def close(self) -> None:
+        """Flushes, and stops the flush timer thread. It's started again by `add`."""
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    @property
+    def pending(self) -> Dict[str, Dict[str, Any]]:
+        """The pending event of each bucket, as JSON dicts."""
+        with self._lock:
+            return {b: p.to_json_dict() for b, p in self._pending.items()}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "heartbeats": self.heartbeats,
+                "commits": self.commits,
+                "timed_commits": self.timed_commits,
+                "mean_staleness": self.total_staleness / self.commits
+                if self.commits
+                else 0.0,
+                "max_staleness": self.max_staleness,
+            }
@@ -4,12 +4,16 @@ Common queries.
 Most of these are from: https://github.com/ActivityWatch/aw-webui/blob/master/src/queries.ts
 """
 
+import copy
 import dataclasses
+import functools
 import json
 import re
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
 from typing import (
+    Any,
+    Dict,
     List,
     Optional,
     Tuple,
@@ -82,24 +86,145 @@ def isAndroidParams(params: QueryParams) -> TypeGuard[AndroidQueryParams]:
     return isinstance(params, AndroidQueryParams)
 
 
-def canonicalEvents(params: Union[DesktopQueryParams, AndroidQueryParams]) -> str:
-    if not params.classes:
+# Marks a frozen dict
+_DICT = object()
+
+
+def _freeze(value: Any) -> Any:
+    """Converts a JSON-like value into a hashable one, which `_thaw` converts back."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return (_DICT, tuple((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_freeze, value))
+    if dataclasses.is_dataclass(value):
+        return _freeze(dataclasses.asdict(value))  # type: ignore
+    # Keeps values that are equal but render differently apart, such as True, 1 and 1.0
+    return (type(value), value)
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, tuple):
+        if value and value[0] is _DICT:
+            return {k: _thaw(v) for k, v in value[1]}
+        if len(value) == 2 and isinstance(value[0], type):
+            return value[1]
+        return [_thaw(v) for v in value]
+    return value
+
+
+# JSON of a classes list -> the frozen list. Keyed by value, since classes are usually
+# equal on every call but not the same list (`get_classes` builds a new one every time),
+# and dumping them is faster than freezing them again.
+_frozen_classes: Dict[str, Tuple[Any, ...]] = {}
+
+# The classes list last frozen, a copy of it as it was then, and the frozen list. Passing
+# the same list again, unchanged, only costs comparing it to the copy.
+_last_frozen_classes: Optional[Tuple[Any, Any, Tuple[Any, ...]]] = None
+
+
+def _freeze_classes(classes: Any) -> Tuple[Any, ...]:
+    global _last_frozen_classes
+    last = _last_frozen_classes
+    if last is not None and last[0] is classes and last[1] == classes:
+        return last[2]
+    try:
+        key = json.dumps(classes, cls=EnhancedJSONEncoder)
+    except (TypeError, ValueError):
+        return _freeze(classes)
+    frozen = _frozen_classes.get(key)
+    if frozen is None:
+        frozen = _freeze(classes)
+        if len(_frozen_classes) >= 64:
+            _frozen_classes.clear()
+        _frozen_classes[key] = frozen
+    _last_frozen_classes = (classes, copy.deepcopy(classes), frozen)
+    return frozen
+
+
+@dataclass(frozen=True)
+class QueryBuilder:
+    """
+    Immutable and hashable form of `QueryParams`, which builds the query text.
+
+    The query text, and fragments of it such as the categorization rules and the browser
+    blocks, are memoized by the parameters they depend on, so building the same query again
+    (such as for each period of a report) only costs a lookup.
+
+    Create with `QueryBuilder.from_params`, which copies the params instead of referencing them.
+    """
+
+    bid_window: str
+    """The window bucket, or the Android bucket if `android` is set."""
+    bid_afk: Optional[str] = None
+    android: bool = False
+    bid_browsers: Tuple[str, ...] = ()
+    classes: Tuple[Any, ...] = ()
+    """The classes, as frozen by `_freeze`."""
+    filter_classes: Tuple[Tuple[str, ...], ...] = ()
+    filter_afk: bool = True
+    include_audible: bool = True
+    always_active_pattern: Optional[str] = None
+
+    @classmethod
+    def from_params(
+        cls, params: Union[DesktopQueryParams, AndroidQueryParams]
+    ) -> "QueryBuilder":
+        """
+        Freezes query params.
+
+        If the params have no classes, the classes are fetched from the server settings.
+        """
         # if categories not explicitly set,
         # get categories from server settings
-        params.classes = get_classes()
-
+        classes = params.classes or get_classes()
+        if isDesktopParams(params):
+            return cls(
+                bid_window=params.bid_window,
+                bid_afk=params.bid_afk,
+                bid_browsers=tuple(params.bid_browsers),
+                classes=_freeze_classes(classes),
+                filter_classes=tuple(map(tuple, params.filter_classes)),
+                filter_afk=params.filter_afk,
+                include_audible=params.include_audible,
+                always_active_pattern=params.always_active_pattern,
+            )
+        elif isAndroidParams(params):
+            return cls(
+                bid_window=params.bid_android,
+                android=True,
+                bid_browsers=tuple(params.bid_browsers),
+                classes=_freeze_classes(classes),
+                filter_classes=tuple(map(tuple, params.filter_classes)),
+                filter_afk=params.filter_afk,
+                include_audible=params.include_audible,
+            )
+        raise TypeError(f"Unsupported query params: {type(params).__name__}")
+
+    def canonical_events(self) -> str:
+        return _canonical_events(self)
+
+    def browser_events(self) -> str:
+        return _browser_events(self.bid_browsers)
+
+    def full_desktop_query(self) -> str:
+        return _full_desktop_query(self)
+
+
+@functools.lru_cache(maxsize=64)
+def _classes_str(classes: Tuple[Any, ...]) -> str:
     # Needs escaping for regex patterns like '\w' to work (JSON.stringify adds extra unnecessary escaping)
-    classes_str = json.dumps(params.classes, cls=EnhancedJSONEncoder)
-    classes_str = re.sub(r"\\\\", r"\\", classes_str)
+    classes_str = json.dumps(_thaw(classes), cls=EnhancedJSONEncoder)
+    return re.sub(r"\\\\", r"\\", classes_str)
+
 
-    cat_filter_str = json.dumps(params.filter_classes)
+@functools.lru_cache(maxsize=1024)
+def _canonical_events(query: QueryBuilder) -> str:
+    desktop = not query.android
 
     # For simplicity, we assume that bid_window and bid_android are exchangeable (note however it needs special treatment)
-    bid_window = (
-        params.bid_window
-        if isinstance(params, DesktopQueryParams)
-        else params.bid_android
-    )
+    bid_window = query.bid_window
 
     return "\n".join(
         [
@@ -108,13 +233,13 @@ def canonicalEvents(params: Union[DesktopQueryParams, AndroidQueryParams]) -> st
             # On Android, merge events to avoid overload of events
             (
                 'events = merge_events_by_keys(events, ["app"]);'
-                if isAndroidParams(params)
+                if query.android
                 else ""
             ),
             # Fetch not-afk events
             (
                 f"""
-            not_afk = flood(query_bucket(find_bucket("{params.bid_afk}")));
+            not_afk = flood(query_bucket(find_bucket("{query.bid_afk}")));
             not_afk = filter_keyvals(not_afk, "status", ["not-afk"]);"""
                 + (
                     """
@@ -123,47 +248,55 @@ def canonicalEvents(params: Union[DesktopQueryParams, AndroidQueryParams]) -> st
             not_treat_as_afk = filter_keyvals_regex(events, "title", "%s");
             not_afk = period_union(not_afk, not_treat_as_afk);"""
                     % (
-                        params.always_active_pattern.replace('"', '\\"'),
-                        params.always_active_pattern.replace('"', '\\"'),
+                        query.always_active_pattern.replace('"', '\\"'),
+                        query.always_active_pattern.replace('"', '\\"'),
                     )
-                    if params.always_active_pattern
+                    if query.always_active_pattern
                     else ""
                 )
-                if isDesktopParams(params)
+                if desktop
                 else ""
             ),
             # Fetch browser events
             (
-                (browserEvents(params) if isDesktopParams(params) else "")
+                (_browser_events(query.bid_browsers) if desktop else "")
                 + (  # Include focused and audible browser events as indications of not-afk
                     """
             audible_events = filter_keyvals(browser_events, "audible", [true]);
             not_afk = period_union(not_afk, audible_events);
             """
-                    if params.include_audible
+                    if query.include_audible
                     else ""
                 )
-                if params.bid_browsers
+                if query.bid_browsers
                 else ""
             ),
             # Filter out window events when the user was afk
             (
                 "events = filter_period_intersect(events, not_afk);"
-                if isDesktopParams(params) and params.filter_afk
+                if desktop and query.filter_afk
                 else ""
             ),
             # Categorize
-            f"events = categorize(events, {classes_str});" if params.classes else "",
+            (
+                f"events = categorize(events, {_classes_str(query.classes)});"
+                if query.classes
+                else ""
+            ),
             # Filter out selected categories
             (
-                f'events = filter_keyvals(events, "$category", {cat_filter_str});'
-                if params.filter_classes
+                f'events = filter_keyvals(events, "$category", {json.dumps(query.filter_classes)});'
+                if query.filter_classes
                 else ""
             ),
         ]
     )
 
 
+def canonicalEvents(params: Union[DesktopQueryParams, AndroidQueryParams]) -> str:
+    return QueryBuilder.from_params(params).canonical_events()
+
+
 def pretty_query(query: str) -> str:
     return "\n".join([line.strip() for line in query.split("\n") if line.strip()])
 
@@ -188,9 +321,14 @@ def browsersWithBuckets(browserbuckets: List[str]) -> List[Tuple[str, str]]:
 
 def browserEvents(params: DesktopQueryParams) -> str:
     """Returns a list of active browser events (where the browser was the active window) from all browser buckets"""
+    return _browser_events(tuple(params.bid_browsers))
+
+
+@functools.lru_cache(maxsize=256)
+def _browser_events(bid_browsers: Tuple[str, ...]) -> str:
     code = "browser_events = [];"
 
-    for browserName, bucketId in browsersWithBuckets(params.bid_browsers):
+    for browserName, bucketId in browsersWithBuckets(list(bid_browsers)):
         browser_appnames_str = json.dumps(browser_appnames[browserName])
         code += f"""
           events_{browserName} = flood(query_bucket("{bucketId}"));
@@ -256,14 +394,24 @@ def escape_doublequote(s: str) -> str:
 def fullDesktopQuery(
     params: DesktopQueryParams,
 ) -> str:
+    return QueryBuilder.from_params(params).full_desktop_query()
+
+
+@functools.lru_cache(maxsize=1024)
+def _full_desktop_query(query: QueryBuilder) -> str:
     # Escape `"`
-    params.bid_window = escape_doublequote(params.bid_window)
-    params.bid_afk = escape_doublequote(params.bid_afk)
-    params.bid_browsers = [escape_doublequote(bucket) for bucket in params.bid_browsers]
+    query = dataclasses.replace(
+        query,
+        bid_window=escape_doublequote(query.bid_window),
+        bid_afk=(
+            escape_doublequote(query.bid_afk) if query.bid_afk is not None else None
+        ),
+        bid_browsers=tuple(escape_doublequote(bucket) for bucket in query.bid_browsers),
+    )
 
     # Build the base query
-    query = f"""
-    {canonicalEvents(params)}
+    text = f"""
+    {_canonical_events(query)}
     title_events = sort_by_duration(merge_events_by_keys(events, ["app", "title"]));
     app_events   = sort_by_duration(merge_events_by_keys(title_events, ["app"]));
     cat_events   = sort_by_duration(merge_events_by_keys(events, ["$category"]));
@@ -273,8 +421,8 @@ def fullDesktopQuery(
     """
 
     # Add browser-related query parts if browser buckets exist
-    if params.bid_browsers:
-        query += """
+    if query.bid_browsers:
+        text += f"""
         browser_events = split_url_events(browser_events);
         browser_urls = merge_events_by_keys(browser_events, ["url"]);
         browser_urls = sort_by_duration(browser_urls);
@@ -285,7 +433,7 @@ def fullDesktopQuery(
         browser_duration = sum_durations(browser_events);
         """
     else:
-        query += """
+        text += """
         browser_events = [];
         browser_urls = [];
         browser_domains = [];
@@ -293,7 +441,7 @@ def fullDesktopQuery(
         """
 
     # Add the return statement
-    query += """
+    text += """
         RETURN = {
             "events": events,
             "window": {
@@ -310,7 +458,7 @@ def fullDesktopQuery(
             }
         };
     """
-    return query
+    return text
 
 
 def test_fullDesktopQuery():
@@ -0,0 +1,221 @@
+"""
+Client-side cache of query results, stored on disk.
+
+Unlike the server's named query cache, this cache needs no query name, survives restarts
+and is shared by every client on the machine. Results are cached per timeperiod, keyed by
+the query text, the timeperiod and the identity of the server. The timeperiod is also
+stored as is, so that the results of a period of time can be invalidated.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    List,
+    Optional,
+    Tuple,
+)
+
+from aw_core.dirs import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# Returned by `QueryCache.get` for results that aren't cached
+MISS = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    period_start REAL NOT NULL,
+    period_end REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+CREATE INDEX IF NOT EXISTS results_query ON results (query);
+CREATE INDEX IF NOT EXISTS results_period ON results (period_end);
+"""
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf8")).hexdigest()
+
+
+class QueryCache:
+    """
+    An on-disk, size-bounded LRU cache of query results.
+
+    Results for timeperiods that ended more than `ttl` ago never change, and are kept until
+    evicted. Results for timeperiods that end later (typically ones that include "now") are
+    kept for at most `ttl`. When the cache grows beyond `max_size` bytes, the least recently
+    used results are evicted.
+
+    Pass to `ActivityWatchClient(query_cache=...)` to cache the results of `query`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_size: int = 64 * 2**20,
+        ttl: timedelta = timedelta(minutes=1),
+    ) -> None:
+        """
+        Args:
+            path: Path of the cache database, by default in the aw-client cache directory
+            max_size: Max total size of cached results, in bytes
+            ttl: How long results for periods that haven't ended yet are kept
+        """
+        if path is None:
+            cache_dir = get_cache_dir("aw-client")
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, "query-cache.v2.sqlite")
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # Shared by all threads, such as the workers of query_chunked, guarded by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(results)")
+            ]
+            if columns and "period_start" not in columns:
+                # Made by an older version, without timeperiods, dropped since it's a cache
+                self._conn.execute("DROP TABLE results")
+            self._conn.executescript(_SCHEMA)
+        self._size = self._count_size()
+
+    def _key(
+        self, server: str, query: str, timeperiod: Tuple[datetime, datetime]
+    ) -> Tuple[str, str]:
+        start, end = timeperiod
+        key = _hash(server, query, start.isoformat(), end.isoformat())
+        return key, _hash(query)
+
+    def get(
+        self, server: str, query: str, timeperiod: Tuple[datetime, datetime]
+    ) -> Any:
+        """Returns the cached result of a timeperiod, or `MISS` if it isn't cached."""
+        key, _ = self._key(server, query, timeperiod)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return MISS
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE results SET accessed = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(
+        self,
+        server: str,
+        query: str,
+        timeperiod: Tuple[datetime, datetime],
+        result: Any,
+    ) -> None:
+        key, query_key = self._key(server, query, timeperiod)
+        value = json.dumps(result)
+        now = time.time()
+        end = timeperiod[1]
+        closed = end < datetime.now(timezone.utc) - self.ttl
+        expires = None if closed else now + self.ttl.total_seconds()
+        if len(value) > self.max_size:
+            return
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT size FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    query_key,
+                    value,
+                    len(value),
+                    expires,
+                    now,
+                    timeperiod[0].timestamp(),
+                    end.timestamp(),
+                ),
+            )
+            self._size += len(value) - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self._size <= self.max_size:
+            return
+        # The cache may be shared with other processes, so recount before evicting
+        self._size = self._count_size()
+        # Expired results go first, then the least recently used
+        now = time.time()
+        rows = self._conn.execute(
+            "SELECT key, size FROM results ORDER BY (expires IS NOT NULL AND expires < ?) DESC, accessed",
+            (now,),
+        )
+        evicted = []
+        for key, size in rows:
+            if self._size <= self.max_size:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} cached query results")
+
+    def _count_size(self) -> int:
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+
+    def invalidate(
+        self,
+        query: Optional[str] = None,
+        timeperiod: Optional[Tuple[datetime, datetime]] = None,
+    ) -> None:
+        """
+        Removes cached results, for all servers.
+
+        If `query` is given, only its results are removed. If `timeperiod` is given, only
+        the results of timeperiods that overlap it are removed, such as those of a day
+        (see `day_period`) that should be queried again. Removes all cached results if
+        neither is given.
+        """
+        conditions = []
+        params: List[Any] = []
+        if query is not None:
+            conditions.append("query = ?")
+            params.append(_hash(query))
+        if timeperiod is not None:
+            conditions.append("period_start < ? AND period_end > ?")
+            params += [timeperiod[1].timestamp(), timeperiod[0].timestamp()]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM results{where}", params)
+            self._size = self._count_size()
+
+    @property
+    def size(self) -> int:
+        """Total size of cached results, in bytes."""
+        return self._size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
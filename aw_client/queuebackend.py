@@ -0,0 +1,565 @@
+"""
+Storage of queued requests, which haven't been sent to the server yet.
+
+`RequestQueue` reads requests in windows and acknowledges a whole window once it has been
+sent, so a backend stores requests in order, and keeps track of what was read and what
+was acknowledged. Requests read but not acknowledged are read again after a restart.
+
+Backends can be compacted, rewriting the requests that haven't been read yet (such as
+merging heartbeats) and reclaiming disk space, see `QueueBackend.compact`.
+
+Two backends are available:
+
+ - `LogQueueBackend`, the default, appends requests to segmented log files, and syncs
+   them to disk in groups (on a time or size budget) instead of on every request.
+ - `SQLiteQueueBackend` stores requests in SQLite with persistqueue, as earlier versions
+   did. Requests left in such a queue are moved to the log by `open_queue_backend`.
+"""
+
+import logging
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .jsoncodec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+QueuedRequest = namedtuple("QueuedRequest", ["endpoint", "data"])
+
+
+class QueueBackend:
+    """Interface of request queue storage. Must be safe to use from several threads."""
+
+    def put(self, request: QueuedRequest) -> None:
+        """Appends a request to the queue."""
+        raise NotImplementedError
+
+    def read(self, max_items: int) -> List[QueuedRequest]:
+        """Reads up to `max_items` of the requests that haven't been read yet, in order."""
+        raise NotImplementedError
+
+    def ack(self) -> None:
+        """Acknowledges all requests read so far, they won't be read again."""
+        raise NotImplementedError
+
+    def qsize(self) -> int:
+        """Number of requests that haven't been read yet."""
+        raise NotImplementedError
+
+    def size(self) -> int:
+        """Bytes taken on disk by the queue."""
+        raise NotImplementedError
+
+    def compact(
+        self,
+        transform: Callable[[List[QueuedRequest]], List[QueuedRequest]],
+        max_size: Optional[int] = None,
+    ) -> Optional[Dict[str, int]]:
+        """
+        Replaces the requests that haven't been read yet with `transform` of them, and
+        reclaims disk space. `transform` may be called several times, with consecutive
+        requests, and must keep them in order.
+
+        If the queue still takes more than `max_size` bytes, the oldest unread requests
+        are dropped. Returns counts of requests and bytes before and after, or None if
+        the backend doesn't support compaction.
+        """
+        return None
+
+    def close(self) -> None:
+        """Writes everything to disk, and releases files. Requests read but not acknowledged are kept."""
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """Stores pickled requests in SQLite, with a transaction per put and per acknowledgement."""
+
+    def __init__(self, path: str) -> None:
+        import persistqueue
+
+        self._queue = persistqueue.FIFOSQLiteQueue(
+            path, multithreading=True, auto_commit=False
+        )
+
+    def put(self, request: QueuedRequest) -> None:
+        self._queue.put(request)
+
+    def read(self, max_items: int) -> List[QueuedRequest]:
+        import persistqueue
+
+        requests: List[QueuedRequest] = []
+        while len(requests) < max_items:
+            try:
+                requests.append(self._queue.get(block=False))
+            except persistqueue.exceptions.Empty:
+                break
+        return requests
+
+    def ack(self) -> None:
+        self._queue.task_done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(self._queue.path, name))
+            for name in os.listdir(self._queue.path)
+        )
+
+    def compact(
+        self,
+        transform: Callable[[List[QueuedRequest]], List[QueuedRequest]],
+        max_size: Optional[int] = None,
+    ) -> Optional[Dict[str, int]]:
+        """Only reclaims disk space (VACUUM), requests are left as they are."""
+        size, requests = self.size(), self.qsize()
+        self._queue.shrink_disk_usage()
+        return {
+            "requests_before": requests,
+            "requests_after": requests,
+            "bytes_before": size,
+            "bytes_after": self.size(),
+            "dropped": 0,
+        }
+
+    def close(self) -> None:
+        self._queue.close()
+
+
+# Each record is the length and CRC-32 of its body, followed by the body: a kind byte, then
+#  - for _ENDPOINT records, an endpoint (UTF-8), given the next index in the segment.
+#  - for _REQUEST records, the index of its endpoint (uint16), then its data as JSON.
+# Heartbeats to a bucket have the same endpoint, which is so only written once per segment.
+_HEADER = struct.Struct("<II")
+_INDEX = struct.Struct("<H")
+_ENDPOINT = b"\x00"
+_REQUEST = b"\x01"
+_MAX_ENDPOINTS = 1 << 16
+
+_SEGMENT_SUFFIX = ".seg"
+# Bytes read from a segment at a time
+_READ_SIZE = 64 * 1024
+_ACK_FILE = "ack"
+
+
+def _record(kind: bytes, payload: bytes) -> bytes:
+    body = kind + payload
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _segment_name(n: int) -> str:
+    return f"{n:012d}{_SEGMENT_SUFFIX}"
+
+
+class _Segment:
+    """A log file, the endpoints defined in it, and its requests."""
+
+    __slots__ = ("name", "path", "size", "endpoints", "count", "requests")
+
+    def __init__(self, directory: str, name: str) -> None:
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.size = 0
+        self.endpoints: List[str] = []
+        # Number of requests
+        self.count = 0
+        # Offsets at which requests end, only kept while the segment is being scanned
+        self.requests: List[int] = []
+
+    def scan(self) -> None:
+        """Reads the endpoints and request offsets, and truncates a torn or corrupt tail."""
+        with open(self.path, "rb") as f:
+            buf = f.read()
+        self.endpoints = []
+        self.requests = []
+        offset = 0
+        while offset + _HEADER.size <= len(buf):
+            length, crc = _HEADER.unpack_from(buf, offset)
+            end = offset + _HEADER.size + length
+            body = buf[offset + _HEADER.size : end]
+            if length == 0 or end > len(buf) or zlib.crc32(body) != crc:
+                break
+            if body[:1] == _ENDPOINT:
+                self.endpoints.append(body[1:].decode("utf8"))
+            else:
+                self.requests.append(end)
+            offset = end
+        if offset < len(buf):
+            logger.warning(
+                f"Truncating {len(buf) - offset} bytes of unreadable records from {self.path}"
+            )
+            self.truncate(offset)
+        self.size = offset
+        self.count = len(self.requests)
+
+    def truncate(self, size: int) -> None:
+        with open(self.path, "r+b") as f:
+            f.truncate(size)
+
+
+class LogQueueBackend(QueueBackend):
+    """
+    Stores requests in append-only log files in `path`, a directory.
+
+    A request is written to the active segment as soon as it's put, so it survives the
+    process crashing, and synced to disk (fsync) in groups: once `sync_bytes` have been
+    written since the last sync, or `sync_interval` seconds after the first unsynced
+    request. A sync_interval of 0 syncs every request.
+
+    The active segment is closed and a new one started once it's `segment_size` bytes.
+    The position up to which requests were acknowledged is kept in a small file, and
+    segments are deleted once all of their requests have been acknowledged.
+
+    Compaction writes the transformed requests to new segments, syncs them, and then
+    truncates and deletes the old ones, so that a crash in between can only leave
+    requests twice. Only requests put since the last compaction are transformed again.
+
+    A directory must only be used by one backend at a time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sync_interval: float = 1.0,
+        sync_bytes: int = 64 * 1024,
+        segment_size: int = 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_bytes = sync_bytes
+        self.segment_size = segment_size
+
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+        #: Bytes written, and number of syncs, for benchmarks
+        self.bytes_written = 0
+        self.syncs = 0
+
+        os.makedirs(path, exist_ok=True)
+        ack_name, ack_offset = self._read_ack()
+        self._segments: List[_Segment] = []
+        self._unread = 0
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(_SEGMENT_SUFFIX):
+                continue
+            if name < ack_name:
+                # Fully acknowledged, but not deleted yet when the process stopped
+                os.remove(os.path.join(path, name))
+                continue
+            segment = _Segment(path, name)
+            segment.scan()
+            start = ack_offset if name == ack_name else 0
+            self._unread += sum(1 for end in segment.requests if end > start)
+            segment.requests = []
+            self._segments.append(segment)
+
+        # Position of the next request to read
+        self._read_index = 0
+        self._read_offset = 0
+        if self._segments and self._segments[0].name == ack_name:
+            self._read_offset = min(ack_offset, self._segments[0].size)
+        self._reader: Optional[Tuple[str, IO[bytes]]] = None
+        # End of the log when it was last compacted, as (segment name, offset)
+        self._compacted: Optional[Tuple[str, int]] = None
+
+        if not self._segments:
+            self._segments.append(_Segment(path, _segment_name(0)))
+        self._open_active()
+
+    def _open_active(self) -> None:
+        active = self._segments[-1]
+        self._file = open(active.path, "ab", buffering=0)
+        self._endpoint_index = {e: i for i, e in enumerate(active.endpoints)}
+        self._unsynced = 0
+
+    def _read_ack(self) -> Tuple[str, int]:
+        try:
+            with open(os.path.join(self.path, _ACK_FILE)) as f:
+                name, offset = f.read().split()
+            return name, int(offset)
+        except (OSError, ValueError):
+            return "", 0
+
+    def _write_ack(self, name: str, offset: int) -> None:
+        path = os.path.join(self.path, _ACK_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{name} {offset}")
+        os.replace(path + ".tmp", path)
+
+    def put(self, request: QueuedRequest) -> None:
+        data = dumps(request.data)
+        with self._lock:
+            self._append(request.endpoint, data)
+            if self._unsynced >= self.sync_bytes or self.sync_interval <= 0:
+                self._sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _append(self, endpoint: str, data: bytes) -> None:
+        if self._segments[-1].size >= self.segment_size or (
+            endpoint not in self._endpoint_index
+            and len(self._endpoint_index) >= _MAX_ENDPOINTS
+        ):
+            self._roll()
+        active = self._segments[-1]
+        record = b""
+        index = self._endpoint_index.get(endpoint)
+        if index is None:
+            index = self._endpoint_index[endpoint] = len(active.endpoints)
+            active.endpoints.append(endpoint)
+            record = _record(_ENDPOINT, endpoint.encode("utf8"))
+        record += _record(_REQUEST, _INDEX.pack(index) + data)
+        # A single write, so that a crash can only tear the last record
+        self._file.write(record)
+        active.size += len(record)
+        active.count += 1
+        self._unread += 1
+        self.bytes_written += len(record)
+        self._unsynced += len(record)
+
+    def _roll(self) -> None:
+        """Syncs and closes the active segment, and starts a new one."""
+        self._sync()
+        self._file.close()
+        n = int(self._segments[-1].name[: -len(_SEGMENT_SUFFIX)]) + 1
+        self._segments.append(_Segment(self.path, _segment_name(n)))
+        self._open_active()
+
+    def sync(self) -> None:
+        """Syncs the requests written to disk."""
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+
+    def _sync(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self.syncs += 1
+
+    def read(self, max_items: int) -> List[QueuedRequest]:
+        with self._lock:
+            requests, self._read_index, self._read_offset = self._read_from(
+                self._read_index, self._read_offset, max_items, len(self._segments)
+            )
+            self._unread -= len(requests)
+        return requests
+
+    def _read_from(
+        self, index: int, offset: int, max_items: int, stop: int
+    ) -> Tuple[List[QueuedRequest], int, int]:
+        """
+        Reads up to `max_items` requests from a position, in segments before `stop`.
+
+        Returns them, and the position after them.
+        """
+        requests: List[QueuedRequest] = []
+        while len(requests) < max_items:
+            segment = self._segments[index]
+            if offset >= segment.size:
+                if index == stop - 1:
+                    break
+                index += 1
+                offset = 0
+                continue
+            f = self._open_reader(segment)
+            f.seek(offset)
+            buf = f.read(min(segment.size - offset, _READ_SIZE))
+            pos = 0
+            while pos < len(buf) and len(requests) < max_items:
+                length = _HEADER.unpack_from(buf, pos)[0]
+                start = pos + _HEADER.size
+                end = start + length
+                if end > len(buf):
+                    if pos > 0:
+                        # Read again from this record
+                        break
+                    buf += f.read(end - len(buf))
+                if buf[start : start + 1] == _REQUEST:
+                    i = _INDEX.unpack_from(buf, start + 1)[0]
+                    data = loads(buf[start + 1 + _INDEX.size : end])
+                    requests.append(QueuedRequest(segment.endpoints[i], data))
+                pos = end
+            offset += pos
+        return requests, index, offset
+
+    def _open_reader(self, segment: _Segment) -> IO[bytes]:
+        if self._reader is not None and self._reader[0] == segment.name:
+            return self._reader[1]
+        self._close_reader()
+        f = open(segment.path, "rb")
+        self._reader = (segment.name, f)
+        return f
+
+    def _close_reader(self) -> None:
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
+
+    def ack(self) -> None:
+        with self._lock:
+            self._write_ack(self._segments[self._read_index].name, self._read_offset)
+            # Segments before the one being read have been acknowledged entirely
+            for segment in self._segments[: self._read_index]:
+                os.remove(segment.path)
+            del self._segments[: self._read_index]
+            self._read_index = 0
+
+    def qsize(self) -> int:
+        with self._lock:
+            return self._unread
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(segment.size for segment in self._segments)
+
+    def _unread_size(self) -> int:
+        return (
+            sum(s.size for s in self._segments[self._read_index :]) - self._read_offset
+        )
+
+    def compact(
+        self,
+        transform: Callable[[List[QueuedRequest]], List[QueuedRequest]],
+        max_size: Optional[int] = None,
+        chunk_size: int = 10_000,
+    ) -> Optional[Dict[str, int]]:
+        """Gives `transform` chunks of up to `chunk_size` requests."""
+        with self._lock:
+            result = {
+                "requests_before": self._unread,
+                "bytes_before": sum(segment.size for segment in self._segments),
+            }
+            index, offset = self._read_index, self._read_offset
+            names = [segment.name for segment in self._segments]
+            if self._compacted is not None and self._compacted[0] in names:
+                compacted = (names.index(self._compacted[0]), self._compacted[1])
+                index, offset = max((index, offset), compacted)
+            n_old = len(self._segments)
+            if index < n_old - 1 or offset < self._segments[-1].size:
+                self._rewrite(index, offset, n_old, transform, chunk_size)
+
+            dropped = 0
+            if max_size is not None and self._unread_size() > max_size:
+                self._roll()
+                # Drop the oldest segments, except the one being read
+                while (
+                    self._unread_size() > max_size
+                    and len(self._segments) > self._read_index + 2
+                ):
+                    segment = self._segments.pop(self._read_index + 1)
+                    os.remove(segment.path)
+                    dropped += segment.count
+                    self._unread -= segment.count
+                if dropped:
+                    logger.warning(
+                        f"Dropped {dropped} queued requests, over {max_size} bytes"
+                    )
+
+            self._close_reader()
+            self._compacted = (self._segments[-1].name, self._segments[-1].size)
+            result.update(
+                requests_after=self._unread,
+                bytes_after=sum(segment.size for segment in self._segments),
+                dropped=dropped,
+            )
+            return result
+
+    def _rewrite(
+        self,
+        index: int,
+        offset: int,
+        stop: int,
+        transform: Callable[[List[QueuedRequest]], List[QueuedRequest]],
+        chunk_size: int,
+    ) -> None:
+        """Rewrites requests from a position to the end of segment `stop - 1` to new segments."""
+        start_index, start_offset = index, offset
+        self._roll()
+        read = 0
+        while True:
+            requests, index, offset = self._read_from(index, offset, chunk_size, stop)
+            if not requests:
+                break
+            read += len(requests)
+            for request in transform(requests):
+                self._append(request.endpoint, dumps(request.data))
+        self._sync()
+        self._unread -= read
+
+        start = self._segments[start_index]
+        self._close_reader()
+        start.truncate(start_offset)
+        start.scan()
+        for segment in self._segments[start_index + 1 : stop]:
+            os.remove(segment.path)
+        del self._segments[start_index + 1 : stop]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+            self._close_reader()
+
+
+def _queue_path(client_name: str, testing: bool, version: int, suffix: str) -> str:
+    from aw_core.dirs import get_data_dir
+
+    queued_dir = os.path.join(get_data_dir("aw-client"), "queued")
+    if not os.path.exists(queued_dir):
+        os.makedirs(queued_dir)
+    return os.path.join(
+        queued_dir,
+        "{}{}.v{}.{}".format(
+            client_name, "-testing" if testing else "", version, suffix
+        ),
+    )
+
+
+def open_queue_backend(client_name: str, testing: bool, version: int) -> QueueBackend:
+    """
+    Opens the queue of requests that have not yet been sent to the server.
+
+    Requests left in the SQLite queue of earlier versions are moved to it first.
+    """
+    path = _queue_path(client_name, testing, version, "log")
+    logger.debug(f"queue path '{path}'")
+    backend = LogQueueBackend(path)
+
+    old_path = _queue_path(client_name, testing, 1, "persistqueue")
+    if os.path.exists(old_path):
+        old = SQLiteQueueBackend(old_path)
+        moved = 0
+        while True:
+            requests = old.read(1000)
+            if not requests:
+                break
+            for request in requests:
+                backend.put(request)
+            moved += len(requests)
+        backend.sync()
+        old.ack()
+        old.close()
+        shutil.rmtree(old_path)
+        logger.info(f"Moved {moved} queued requests from {old_path} to {path}")
+    return backend
@@ -0,0 +1,88 @@
+"""
+Backoff and circuit breaking for the request queues, when the server is unreachable.
+
+While the server is down, the queue probes it with a cheap request, at exponentially
+growing intervals with jitter, so that clients don't reconnect in lockstep, and a
+server that keeps going down isn't hit at a constant rate. The first probes come
+quickly, so a restarted server is used again within about a second.
+
+Dispatching goes through a `CircuitBreaker`: after repeated failures (or one connection
+error) it opens, and requests are held until a probe succeeds. It's then half-open
+until a request goes through, and opens again at the first failure, without resetting
+the backoff, so a flapping server is probed less and less often.
+"""
+
+import random
+from typing import Callable
+
+
+class Backoff:
+    """
+    Exponentially growing delays, from `initial` up to `maximum` seconds.
+
+    Each delay is reduced by a random fraction of up to `jitter` of it.
+    """
+
+    def __init__(
+        self,
+        initial: float = 0.5,
+        maximum: float = 10.0,
+        factor: float = 2.0,
+        jitter: float = 0.5,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng
+        #: Number of delays since the last reset
+        self.attempts = 0
+
+    def next(self) -> float:
+        """Returns the delay before the next attempt."""
+        # The exponent is capped, as floats overflow long before attempts run out
+        delay = min(self.maximum, self.initial * self.factor ** min(self.attempts, 64))
+        self.attempts += 1
+        return delay * (1 - self.jitter * self.rng())
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, see the module docstring."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold: int = 3) -> None:
+        self.threshold = threshold
+        self.state = self.CLOSED
+        self.failures = 0
+        #: Number of times the breaker opened
+        self.trips = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.open()
+
+    def open(self) -> None:
+        if self.state != self.OPEN:
+            self.trips += 1
+        self.state = self.OPEN
+
+    def half_open(self) -> None:
+        """Called once the server responds again, lets requests through to try it."""
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
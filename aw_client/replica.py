@@ -0,0 +1,457 @@
+"""
+Local replica of buckets, kept in sync incrementally.
+
+A replica mirrors buckets of a server into an on-disk columnar store, so that their history
+doesn't have to be fetched again for every analysis. The first sync of a bucket fetches all
+of its events, a segment at a time. Later syncs only fetch the events since the newest replicated one, minus a
+`trailing_window` in which events may still change, such as events extended by heartbeats.
+
+Range reads (`get_events`) and queries (`query`, evaluated by `LocalQueryEngine`) are served
+from the replica. They first sync the buckets they read, at most once per `sync_interval`,
+and if that fails, because the server is unreachable or (with a timeout set on the client's
+transport) too slow to respond, are served from the replica as it was last synced.
+
+On disk, each bucket is a directory of segments sorted by timestamp, of at most
+`segment_size` events each:
+
+    <path>/<quoted bucket id>/manifest.json  metadata of the bucket, and its segments
+    <path>/<quoted bucket id>/<n>.columns    ids, timestamps and durations, as int64 (ns), int64 and float64 arrays
+    <path>/<quoted bucket id>/<n>.data       data of each event, as one JSON object per line
+
+A sync only rewrites the segments that overlap the trailing window, and replaces the manifest
+last, so an interrupted sync leaves the replica as it was.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote, unquote
+
+import requests as req
+from aw_core.dirs import get_cache_dir
+from aw_core.models import Event
+
+from .eventframe import EPOCH, MISSING, EventFrame, data_columns, ns_to_dt
+from .jsoncodec import dumps, loads
+from .localquery import LocalQueryEngine
+
+if TYPE_CHECKING:
+    from .client import ActivityWatchClient
+
+logger = logging.getLogger(__name__)
+
+_MANIFEST = "manifest.json"
+
+# End of the timeperiod of reads without an end
+_END_OF_TIME = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
+
+def _data_rows(frame: EventFrame) -> List[dict]:
+    columns = list(frame.data.items())
+    return [
+        {key: column[i] for key, column in columns if column[i] is not MISSING}
+        for i in range(len(frame))
+    ]
+
+
+def _sorted_by_time(frame: EventFrame) -> EventFrame:
+    return frame.take(
+        sorted(range(len(frame)), key=lambda i: (frame.timestamps[i], frame.ids[i]))
+    )
+
+
+def _little_endian(column: array) -> array:
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+class _ReplicatedBucket:
+    """The segments and manifest of a replicated bucket."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        path = os.path.join(directory, _MANIFEST)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.manifest: Dict[str, Any] = loads(f.read())
+        else:
+            self.manifest = {"metadata": {}, "segments": [], "next_segment": 0}
+        # Frames of the segments by name, read on first use
+        self._segments: Dict[str, EventFrame] = {}
+        self._frame: Optional[EventFrame] = None
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.manifest["metadata"]
+
+    @property
+    def newest(self) -> Optional[int]:
+        """Timestamp of the newest event, in ns since the epoch."""
+        segments = self.manifest["segments"]
+        return segments[-1]["last"] if segments else None
+
+    def _path(self, name: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{name}.{ext}")
+
+    def _segment(self, segment: Dict[str, Any]) -> EventFrame:
+        frame = self._segments.get(segment["name"])
+        if frame is None:
+            frame = self._segments[segment["name"]] = self._read_segment(segment)
+        return frame
+
+    def _read_segment(self, segment: Dict[str, Any]) -> EventFrame:
+        count = segment["count"]
+        with open(self._path(segment["name"], "columns"), "rb") as f:
+            raw = memoryview(f.read())
+        columns = []
+        for i, typecode in enumerate("qqd"):
+            column = array(typecode)
+            column.frombytes(raw[i * 8 * count : (i + 1) * 8 * count])
+            columns.append(_little_endian(column))
+        with open(self._path(segment["name"], "data"), "rb") as f:
+            data = data_columns(loads(line) for line in f)
+        return EventFrame(columns[0], columns[1], columns[2], data)
+
+    def _write_segment(self, frame: EventFrame) -> Dict[str, Any]:
+        name = f"{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        with open(self._path(name, "columns"), "wb") as f:
+            f.write(_little_endian(array("q", frame.ids)).tobytes())
+            f.write(_little_endian(array("q", frame.timestamps)).tobytes())
+            f.write(_little_endian(array("d", frame.durations)).tobytes())
+        with open(self._path(name, "data"), "wb") as f:
+            f.writelines(dumps(data) + b"\n" for data in _data_rows(frame))
+        return {
+            "name": name,
+            "count": len(frame),
+            "first": frame.timestamps[0],
+            "last": frame.timestamps[-1],
+        }
+
+    def _write_manifest(self) -> None:
+        path = os.path.join(self.directory, _MANIFEST)
+        with open(path + ".tmp", "wb") as f:
+            f.write(dumps(self.manifest))
+        os.replace(path + ".tmp", path)
+
+    @property
+    def frame(self) -> EventFrame:
+        """All events of the bucket, sorted by timestamp."""
+        if self._frame is None:
+            segments = [self._segment(s) for s in self.manifest["segments"]]
+            self._frame = (
+                segments[0] if len(segments) == 1 else EventFrame.concat(segments)
+            )
+        return self._frame
+
+    def update(
+        self,
+        metadata: Dict[str, Any],
+        fetched: EventFrame,
+        cutoff: Optional[int],
+        segment_size: int,
+    ) -> bool:
+        """
+        Replaces the events since `cutoff` (all events if None) with the fetched ones.
+
+        Returns whether any events changed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.manifest["segments"]
+        keep = 0
+        if cutoff is not None:
+            # Fetched events that start before the cutoff still replace their old version
+            rewrite_from = min([cutoff, *fetched.timestamps])
+            while keep < len(segments) and segments[keep]["last"] < rewrite_from:
+                keep += 1
+        replaced = segments[keep:]
+        old = EventFrame.concat(self._segment(s) for s in replaced)
+
+        timestamps = array("q", fetched.timestamps)
+        durations = array("d", fetched.durations)
+        fetched_rows = {event_id: i for i, event_id in enumerate(fetched.ids)}
+        rows = []
+        for i, (event_id, ts) in enumerate(zip(old.ids, old.timestamps)):
+            if cutoff is None or ts >= cutoff:
+                # Replaced by the fetched events, or deleted since
+                continue
+            j = fetched_rows.get(event_id)
+            if j is None:
+                rows.append(i)
+            elif ts < timestamps[j]:
+                # Cropped by the server to the start of the request, keep its real start
+                durations[j] += (timestamps[j] - ts) / 1e9
+                timestamps[j] = ts
+        fetched = EventFrame(fetched.ids, timestamps, durations, fetched.data)
+        merged = _sorted_by_time(EventFrame.concat([old.take(rows), fetched]))
+
+        changed = not (
+            merged.ids == old.ids
+            and merged.timestamps == old.timestamps
+            and merged.durations == old.durations
+            and _data_rows(merged) == _data_rows(old)
+        )
+        if changed:
+            written = []
+            for i in range(0, len(merged), segment_size):
+                chunk = merged[i : i + segment_size]
+                written.append(self._write_segment(chunk))
+                self._segments[written[-1]["name"]] = chunk
+            self.manifest["segments"] = segments[:keep] + written
+            self._frame = None
+        self.manifest["metadata"] = metadata
+        self._write_manifest()
+        if changed:
+            for segment in replaced:
+                del self._segments[segment["name"]]
+                for ext in ("columns", "data"):
+                    os.remove(self._path(segment["name"], ext))
+        return changed
+
+    def replace(
+        self, metadata: Dict[str, Any], events: Iterable[Event], segment_size: int
+    ) -> int:
+        """
+        Replaces all events with `events`, given newest first, as `iter_events` yields them.
+
+        Only holds a segment of events in memory at a time. Returns the number of events.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        replaced = self.manifest["segments"]
+        written: List[Dict[str, Any]] = []
+        events = iter(events)
+        try:
+            while True:
+                chunk = list(itertools.islice(events, segment_size))
+                if not chunk:
+                    break
+                frame = _sorted_by_time(EventFrame.from_events(chunk))
+                written.append(self._write_segment(frame))
+        except BaseException:
+            for segment in written:
+                for ext in ("columns", "data"):
+                    os.remove(self._path(segment["name"], ext))
+            raise
+        # Written newest first
+        written.reverse()
+        self.manifest["segments"] = written
+        self.manifest["metadata"] = metadata
+        self._segments = {}
+        self._frame = None
+        self._write_manifest()
+        for segment in replaced:
+            for ext in ("columns", "data"):
+                os.remove(self._path(segment["name"], ext))
+        return sum(segment["count"] for segment in written)
+
+
+class Replica:
+    """
+    A local replica of a server's buckets, kept in sync incrementally.
+
+    Events deleted on the server are only removed from the replica if they are within the
+    trailing window, sync with `full=True` to fetch buckets again from scratch. A replica
+    directory should only be used by one process at a time.
+    """
+
+    def __init__(
+        self,
+        client: "ActivityWatchClient",
+        path: Optional[str] = None,
+        bucket_ids: Optional[Iterable[str]] = None,
+        trailing_window: timedelta = timedelta(hours=1),
+        sync_interval: timedelta = timedelta(minutes=1),
+        segment_size: int = 20_000,
+        vectorized: bool = False,
+    ) -> None:
+        """
+        Args:
+            client: Client used to sync, give it a transport with a timeout (`HTTPTransport(timeout=...)`) to serve reads from the replica when the server is slow
+            path: Directory of the replica, by default in the aw-client cache directory, per server
+            bucket_ids: Buckets to replicate, by default all buckets of the server
+            trailing_window: How far back from the newest replicated event events are fetched again
+            sync_interval: Reads only sync if the buckets they read haven't been synced for this long
+            segment_size: Max number of events per segment file
+            vectorized: Passed to the `LocalQueryEngine` that serves reads
+        """
+        if path is None:
+            server = hashlib.sha256(client.server_address.encode("utf8")).hexdigest()
+            path = os.path.join(get_cache_dir("aw-client"), "replica.v1", server[:16])
+        os.makedirs(path, exist_ok=True)
+        self.client = client
+        self.path = path
+        self.bucket_ids = list(bucket_ids) if bucket_ids is not None else None
+        self.trailing_window = trailing_window
+        self.sync_interval = sync_interval
+        self.segment_size = segment_size
+
+        self._lock = threading.RLock()
+        self._buckets: Dict[str, _ReplicatedBucket] = {}
+        for name in os.listdir(path):
+            if os.path.exists(os.path.join(path, name, _MANIFEST)):
+                self._buckets[unquote(name)] = _ReplicatedBucket(
+                    os.path.join(path, name)
+                )
+        # Time of the last sync attempt per bucket, and for all buckets (None)
+        self._attempted: Dict[Optional[str], float] = {}
+        self._engine = LocalQueryEngine(vectorized)
+        # Buckets that are up to date in the engine
+        self._loaded: Set[str] = set()
+
+    @property
+    def buckets(self) -> Dict[str, Dict[str, Any]]:
+        """Metadata of the replicated buckets, as of their last sync."""
+        with self._lock:
+            return {bid: bucket.metadata for bid, bucket in self._buckets.items()}
+
+    def sync(
+        self, bucket_ids: Optional[Iterable[str]] = None, full: bool = False
+    ) -> Dict[str, int]:
+        """
+        Fetches new and changed events of the replicated buckets, or only of `bucket_ids`.
+
+        With `full`, all events are fetched again. Returns the number of events fetched
+        for each bucket. Raises request errors, unlike reads.
+        """
+        server_buckets = self.client.get_buckets()
+        if bucket_ids is None:
+            bucket_ids = self.bucket_ids
+        if bucket_ids is None:
+            bucket_ids = server_buckets
+        fetched_counts = {}
+        for bucket_id in bucket_ids:
+            if bucket_id not in server_buckets:
+                logger.warning(f"Bucket {bucket_id} isn't on the server, not synced")
+                continue
+            with self._lock:
+                self._attempted[bucket_id] = time.monotonic()
+                fetched_counts[bucket_id] = self._sync_bucket(
+                    bucket_id, server_buckets[bucket_id], full
+                )
+        return fetched_counts
+
+    def _sync_bucket(self, bucket_id: str, metadata: dict, full: bool) -> int:
+        bucket = self._buckets.get(bucket_id)
+        if bucket is None:
+            directory = os.path.join(self.path, quote(bucket_id, safe=""))
+            bucket = self._buckets[bucket_id] = _ReplicatedBucket(directory)
+        newest = bucket.newest
+        cutoff = None
+        if not full and newest is not None:
+            window_ns = self.trailing_window // timedelta(microseconds=1) * 1000
+            cutoff = max(newest - window_ns, 0)
+        if cutoff is None:
+            # Paged, so that large buckets aren't held in memory
+            count = bucket.replace(
+                metadata,
+                self.client.iter_events(bucket_id, page_size=self.segment_size),
+                self.segment_size,
+            )
+            self._loaded.discard(bucket_id)
+            logger.debug(f"Synced {bucket_id}, fetched all {count} events")
+            return count
+        fetched = self.client.get_events(
+            bucket_id, start=ns_to_dt(cutoff), as_frame=True
+        )
+        metadata_changed = metadata != bucket.metadata
+        if (
+            bucket.update(metadata, fetched, cutoff, self.segment_size)
+            or metadata_changed
+        ):
+            self._loaded.discard(bucket_id)
+        logger.debug(f"Synced {bucket_id}, fetched {len(fetched)} events")
+        return len(fetched)
+
+    def _maybe_sync(self, bucket_id: Optional[str]) -> None:
+        """Syncs a bucket (all buckets if None) if it's due, and only logs failures."""
+        now = time.monotonic()
+        attempted = self._attempted.get(bucket_id)
+        if (
+            attempted is not None
+            and now - attempted < self.sync_interval.total_seconds()
+        ):
+            return
+        self._attempted[bucket_id] = now
+        try:
+            self.sync(None if bucket_id is None else [bucket_id])
+        except req.RequestException as e:
+            logger.warning(f"Failed to sync replica, serving it as last synced: {e}")
+
+    def _engine_with(self, bucket_ids: Iterable[str]) -> LocalQueryEngine:
+        """The query engine, with the current events of `bucket_ids`."""
+        for bucket_id in bucket_ids:
+            if bucket_id in self._loaded:
+                continue
+            bucket = self._buckets.get(bucket_id)
+            if bucket is None:
+                raise ValueError(f"Bucket {bucket_id} isn't replicated")
+            self._engine.add_bucket(
+                {"id": bucket_id, **bucket.metadata, "events": bucket.frame}
+            )
+            self._loaded.add(bucket_id)
+        return self._engine
+
+    def get_events(
+        self,
+        bucket_id: str,
+        limit: int = -1,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        as_frame: bool = False,
+        sync: bool = True,
+    ) -> Union[List[Event], EventFrame]:
+        """
+        Returns the events of a replicated bucket, newest first, like `ActivityWatchClient.get_events`.
+
+        Events that overlap `start` or `end` are trimmed to them. Syncs the bucket first, if
+        `sync` is set and it's due.
+        """
+        with self._lock:
+            if sync:
+                self._maybe_sync(bucket_id)
+            engine = self._engine_with([bucket_id])
+            frame = engine.get_events(bucket_id, start or EPOCH, end or _END_OF_TIME)
+        if limit >= 0:
+            frame = frame[:limit]
+        return frame if as_frame else frame.to_events()
+
+    def query(
+        self,
+        query: str,
+        timeperiods: List[Tuple[datetime, datetime]],
+        as_frame: bool = False,
+        max_workers: int = 1,
+        sync: bool = True,
+    ) -> List[Any]:
+        """
+        Runs a query on the replicated buckets, like `ActivityWatchClient.query`.
+
+        Syncs all replicated buckets first, if `sync` is set and they are due.
+        """
+        with self._lock:
+            if sync:
+                self._maybe_sync(None)
+            engine = self._engine_with(list(self._buckets))
+            return engine.query(query, timeperiods, as_frame, max_workers)
+
+    def close(self) -> None:
+        """Stops the worker processes of queries, if any."""
+        self._engine.close()
@@ -0,0 +1,102 @@
+"""
+Client-side cache of server settings.
+
+Settings such as the category classes rarely change, but are needed every time a query
+is built. The cache fetches each setting once and keeps it for a TTL, after which it is
+refreshed, by default in the background while the previous value is still returned.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Optional,
+    Set,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from .client import ActivityWatchClient
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsCache:
+    """
+    Caches the settings of a client's server.
+
+    Values are returned as-is from the cache, so they should not be modified by the caller.
+    """
+
+    def __init__(
+        self,
+        client: "ActivityWatchClient",
+        ttl: timedelta = timedelta(minutes=5),
+        background_refresh: bool = True,
+    ) -> None:
+        """
+        Args:
+            client: Client used to fetch settings
+            ttl: How long a value is used before it is fetched again
+            background_refresh: If set, expired values are returned while they are refreshed in a background thread, instead of fetching them before returning
+        """
+        self.client = client
+        self.ttl = ttl
+        self.background_refresh = background_refresh
+
+        self._lock = threading.Lock()
+        # Key (None for all settings) -> (time fetched, value)
+        self._values: Dict[Optional[str], Tuple[float, Any]] = {}
+        self._refreshing: Set[Optional[str]] = set()
+
+    def get(self, key: Optional[str] = None) -> Any:
+        """Returns the value of a setting, or of all settings if `key` is None."""
+        with self._lock:
+            entry = self._values.get(key)
+        if entry is None:
+            return self.refresh(key)
+        fetched_at, value = entry
+        if time.monotonic() - fetched_at > self.ttl.total_seconds():
+            if not self.background_refresh:
+                return self.refresh(key)
+            self._refresh_in_background(key)
+        return value
+
+    def refresh(self, key: Optional[str] = None) -> Any:
+        """Fetches a setting from the server, and caches it."""
+        value = self.client.get_setting(key)
+        with self._lock:
+            self._values[key] = (time.monotonic(), value)
+        return value
+
+    def _refresh_in_background(self, key: Optional[str]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh() -> None:
+            try:
+                self.refresh(key)
+            except Exception as e:
+                # Keep using the old value until a refresh succeeds
+                logger.warning(f"Failed to refresh setting {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Drops a cached setting, or all cached settings if `key` is None."""
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+                # The value of all settings includes this one
+                self._values.pop(None, None)
@@ -0,0 +1,155 @@
+"""
+HTTP transport used by ActivityWatchClient.
+
+Each client owns one transport, which keeps pooled keep-alive connections to the server
+instead of opening a new TCP connection for every request.
+
+Responses are always requested with `Accept-Encoding: gzip, deflate`, and decoded
+transparently, so a server (or a reverse proxy in front of it) can compress large
+responses such as exports and query results. Request bodies are only compressed if
+enabled with `compression`, since the server has to support it.
+"""
+
+import gzip
+import logging
+import threading
+import weakref
+import zlib
+from typing import (
+    Any,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import requests as req
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Same as the `timeout` argument to requests: a single value, or a (connect, read) tuple.
+Timeout = Union[None, float, Tuple[Optional[float], Optional[float]]]
+
+# Content codings supported for request bodies
+COMPRESSIONS = ("gzip", "deflate")
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    """Compresses a body with a content coding, "gzip" or "deflate" (zlib format, as in HTTP)."""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    if encoding == "deflate":
+        return zlib.compress(data, level)
+    raise ValueError(f"Unsupported compression: {encoding}")
+
+
+class _ThreadSession:
+    """The session of a thread, closed once the thread ends and its thread-local data is dropped."""
+
+    __slots__ = ("session", "generation", "__weakref__")
+
+    def __init__(self, session: req.Session, generation: int) -> None:
+        self.session = session
+        self.generation = generation
+        weakref.finalize(self, session.close)
+
+
+class HTTPTransport:
+    """
+    A pooled, keep-alive HTTP transport.
+
+    `requests.Session` is not guaranteed to be thread-safe, so every thread that uses the
+    transport (typically the caller and the RequestQueue thread) gets its own session,
+    each with its own connection pool. The session of a thread is closed when the thread
+    ends, so short-lived worker threads don't leave connections open. All sessions are
+    closed by `close()`, after which the transport can still be used and will open new
+    sessions as needed.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        timeout: Timeout = None,
+        max_retries: int = 0,
+        compression: Optional[str] = None,
+        compression_threshold: int = 64 * 1024,
+        compression_level: int = 6,
+    ) -> None:
+        """
+        Args:
+            pool_size: Max number of keep-alive connections kept per thread
+            timeout: Default timeout for requests, same format as in requests
+            max_retries: Number of retries on failed connects (passed to urllib3)
+            compression: Compress request bodies with this content coding, "gzip" or "deflate"
+            compression_threshold: Bodies smaller than this many bytes are sent uncompressed
+            compression_level: Compression level, from 1 (fastest) to 9 (smallest)
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Sessions of live threads, which are dropped with the thread-local data of their thread
+        self._sessions: weakref.WeakSet[_ThreadSession] = weakref.WeakSet()
+        # Incremented on close, so that threads know to replace their closed session
+        self._generation = 0
+
+    def _new_session(self) -> req.Session:
+        session = req.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=self.max_retries,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _session(self) -> req.Session:
+        local = self._local
+        thread_session = getattr(local, "session", None)
+        if thread_session is None or thread_session.generation != self._generation:
+            with self._lock:
+                thread_session = _ThreadSession(self._new_session(), self._generation)
+                local.session = thread_session
+                self._sessions.add(thread_session)
+        return thread_session.session
+
+    def request(self, method: str, url: str, **kwargs: Any) -> req.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        data = kwargs.get("data")
+        if (
+            self.compression is not None
+            and isinstance(data, bytes)
+            and len(data) >= self.compression_threshold
+        ):
+            kwargs["data"] = compress(data, self.compression, self.compression_level)
+            kwargs["headers"] = dict(
+                kwargs.get("headers") or {}, **{"Content-Encoding": self.compression}
+            )
+        return self._session().request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> req.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> req.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url: str, **kwargs: Any) -> req.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self) -> None:
+        """Closes all pooled connections held by the transport."""
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions = weakref.WeakSet()
+            self._generation += 1
+        for thread_session in sessions:
+            thread_session.session.close()
+        logger.debug(f"Closed {len(sessions)} HTTP session(s)")
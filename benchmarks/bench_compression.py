@@ -0,0 +1,102 @@
+"""
+Reports bytes on the wire, and time taken, for bulk requests with and without compression.
+
+Request bodies (`insert_events`, `import_bucket`) are compressed by the client with
+`HTTPTransport(compression=...)`, responses (`export_all`, `query`) by the server, like a
+compressing reverse proxy would. Runs against a local stand-in server:
+
+    python3 benchmarks/bench_compression.py [n_events]
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.transport import HTTPTransport
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(n: int) -> List[Event]:
+    rng = random.Random(0)
+    apps = ["Firefox", "Code", "Slack", "Terminal", "Spotify"]
+    return [
+        Event(
+            timestamp=start + timedelta(seconds=i * 3),
+            duration=rng.choice([1, 2, 3]),
+            data={
+                "app": rng.choice(apps),
+                "title": f"Issue #{rng.randrange(200)} · ActivityWatch/aw-client",
+            },
+        )
+        for i in range(n)
+    ]
+
+
+def _requests(
+    client: ActivityWatchClient, events: List[Event], timeperiods: list
+) -> List[Tuple[str, Callable[[], Any]]]:
+    bucket = {"id": "imported", "type": "test", "client": "bench", "hostname": "h"}
+    return [
+        ("insert_events", lambda: client.insert_events("bench", events)),
+        ("import_bucket", lambda: client.import_bucket(dict(bucket, events=events))),
+        ("export_all", lambda: client.export_all()),
+        ("query", lambda: client.query("RETURN = [];", timeperiods)),
+    ]
+
+
+def measure(server: StandInServer, f: Callable[[], Any]) -> Tuple[int, int, float]:
+    received, sent = server.bytes_received, server.bytes_sent
+    t = time.perf_counter()
+    f()
+    t = time.perf_counter() - t
+    return server.bytes_received - received, server.bytes_sent - sent, t
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    events = _events(n)
+    timeperiods = [(start, start + timedelta(seconds=n * 3))]
+
+    print(f"Bulk requests of {n} events, bytes on the wire:")
+    print(
+        f"  {'':<14} {'compression':<12} {'request':>10} {'response':>10} {'time':>8}"
+    )
+    baseline = {}
+    compression: Optional[str]
+    for compression in [None, "gzip", "deflate"]:
+        server = StandInServer().start()
+        server.compress_responses = compression is not None
+        client = ActivityWatchClient(
+            "bench-compression",
+            host="127.0.0.1",
+            port=server.port,
+            transport=HTTPTransport(compression=compression),
+        )
+        client.create_bucket("bench", "test")
+        for name, f in _requests(client, events, timeperiods):
+            request, response, t = measure(server, f)
+            if compression is None:
+                baseline[name] = request + response
+                saved = ""
+            else:
+                saved = f"  ({1 - (request + response) / baseline[name]:.0%} saved)"
+            print(
+                f"  {name:<14} {compression or 'none':<12} {request / 2**20:>8.2f}MB"
+                f" {response / 2**20:>8.2f}MB {t:>7.2f}s{saved}"
+            )
+        client.disconnect()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
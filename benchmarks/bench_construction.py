@@ -0,0 +1,61 @@
+"""
+Measures the cost of constructing an ActivityWatchClient.
+
+Compares the lazy construction, where the config is cached and the request queue and its
+lock are only created once queued requests are used, to doing all of that up front as
+construction used to:
+
+    python3 benchmarks/bench_construction.py [n_clients]
+"""
+
+import sys
+import time
+from random import randint
+from typing import Callable
+
+from aw_core.config import load_config_toml
+
+from aw_client import ActivityWatchClient
+from aw_client.config import default_config
+
+
+def _new_client() -> ActivityWatchClient:
+    # A new name each time, so each client gets its own lock and queue file
+    return ActivityWatchClient(f"bench-construction-{randint(0, 10**9)}")
+
+
+def lazy() -> ActivityWatchClient:
+    return _new_client()
+
+
+def eager() -> ActivityWatchClient:
+    load_config_toml("aw-client", default_config)
+    client = _new_client()
+    client.request_queue.register_bucket("bench-construction", "test")
+    return client
+
+
+def per_client(f: Callable[[], ActivityWatchClient], n: int) -> float:
+    """Returns the time to construct a client, in ms."""
+    clients = []
+    start = time.perf_counter()
+    for _ in range(n):
+        clients.append(f())
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.disconnect()
+    return elapsed / n * 1000
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # Warm up imports and the config cache
+    lazy().disconnect()
+
+    print(f"Constructing {n} clients:")
+    for name, f in [("eager", eager), ("lazy", lazy)]:
+        print(f"  {name:<6} {per_client(f, n):6.2f} ms/client")
+
+
+if __name__ == "__main__":
+    main()
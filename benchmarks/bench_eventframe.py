@@ -0,0 +1,77 @@
+"""
+Compares decoding events into a list of `Event` and into an `EventFrame`.
+
+Starts from the raw bytes of a response of the events endpoint, received in chunks as
+`ActivityWatchClient` reads them, and measures decode time, peak memory while decoding,
+and memory held by the result:
+
+    python3 benchmarks/bench_eventframe.py [n_events]
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Iterator, Tuple
+
+from aw_core.models import Event
+
+from aw_client import EventFrame
+from aw_client.client import STREAM_CHUNK_SIZE
+from aw_client.jsonstream import ANY, iterparse
+
+
+def measure(f: Callable[[], Any]) -> Tuple[float, float]:
+    """Returns the peak memory while calling f, and the memory held by its result, in MiB."""
+    gc.collect()
+    tracemalloc.start()
+    result = f()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 2**20, size / 2**20
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    now = datetime.now(timezone.utc)
+    raw = json.dumps(
+        [
+            Event(
+                timestamp=now - timedelta(seconds=i),
+                duration=1.0,
+                data={
+                    "app": ["Firefox", "Terminal", "Code"][i % 3],
+                    "title": f"Page {i % 1000}",
+                },
+            ).to_json_dict()
+            for i in range(n)
+        ]
+    ).encode("utf8")
+
+    def chunks() -> Iterator[bytes]:
+        for i in range(0, len(raw), STREAM_CHUNK_SIZE):
+            yield raw[i : i + STREAM_CHUNK_SIZE]
+
+    print(f"Decoding {n} events ({len(raw) / 2**20:.1f} MiB of JSON):")
+    print(f"  {'':<22} {'peak':>10} {'result':>10} {'time':>6}")
+    for name, f in [
+        ("List[Event]", lambda: [Event(**e) for e in json.loads(raw)]),
+        ("EventFrame, decoded", lambda: EventFrame.from_json(json.loads(raw))),
+        (
+            "EventFrame, streamed",
+            lambda: EventFrame.from_json(e for _, e in iterparse(chunks(), [ANY])),
+        ),
+    ]:
+        # Time without tracemalloc, which slows down allocations
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        peak, size = measure(f)
+        print(f"  {name:<22} {peak:6.1f} MiB {size:6.1f} MiB {elapsed:5.2f}s")
+
+
+if __name__ == "__main__":
+    main()
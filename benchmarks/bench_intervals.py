@@ -0,0 +1,85 @@
+"""
+Compares the throughput of interval operations in `aw_transform` and `aw_client.intervals`.
+
+Both get the same events as input, as a list of `Event` and as an `EventFrame` respectively:
+
+    python3 benchmarks/bench_intervals.py [n_events]
+"""
+
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List
+
+import aw_transform
+from aw_core.models import Event
+from aw_transform.filter_period_intersect import period_union
+
+from aw_client import EventFrame, intervals
+
+
+def _events(n: int, seed: int) -> List[Event]:
+    rng = random.Random(seed)
+    events = []
+    ts = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for _ in range(n):
+        ts += timedelta(seconds=rng.choice([0, 0, 1, 3, 7, 20]))
+        duration = timedelta(seconds=rng.choice([1, 2, 5, 30]))
+        events.append(
+            Event(timestamp=ts, duration=duration, data={"app": rng.choice("abcdef")})
+        )
+        ts += duration
+    return events
+
+
+def timed(f: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # aw_transform.flood logs a warning for every batch with overlaps
+    logging.getLogger("aw_transform").setLevel(logging.ERROR)
+
+    events, other = _events(n, 0), _events(n, 1)
+    frame, other_frame = EventFrame.from_events(events), EventFrame.from_events(other)
+
+    print(f"Operations on {n} events:")
+    print(f"  {'':<24} {'aw_transform':>12} {'intervals':>10} {'speedup':>8}")
+    for name, slow, fast in [
+        (
+            "flood",
+            lambda: aw_transform.flood(events, 5),
+            lambda: intervals.flood(frame, 5),
+        ),
+        (
+            "period_union",
+            lambda: period_union(events, other),
+            lambda: intervals.period_union(frame, other_frame),
+        ),
+        (
+            "filter_period_intersect",
+            lambda: aw_transform.filter_period_intersect(events, other),
+            lambda: intervals.filter_period_intersect(frame, other_frame),
+        ),
+        (
+            "merge_events_by_keys",
+            lambda: aw_transform.merge_events_by_keys(events, ["app"]),
+            lambda: intervals.merge_events_by_keys(frame, ["app"]),
+        ),
+        (
+            "sum_durations",
+            lambda: aw_transform.sum_durations(events),
+            lambda: intervals.sum_durations(frame),
+        ),
+    ]:
+        t_slow, t_fast = timed(slow), timed(fast)
+        print(f"  {name:<24} {t_slow:11.2f}s {t_fast:9.3f}s {t_slow / t_fast:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
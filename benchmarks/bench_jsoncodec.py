@@ -0,0 +1,81 @@
+"""
+Compares encoding and decoding request and response bodies, as done before `aw_client.jsoncodec`
+(`Event.to_json_dict`, `json.dumps` and a copy into bytes) and with each `jsoncodec` backend.
+
+Covers the payloads of a heartbeat (one event), `insert_events` and `get_events` (also
+with `as_frame=True`):
+
+    python3 benchmarks/bench_jsoncodec.py [n_events]
+"""
+
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List
+
+from aw_core.models import Event
+
+from aw_client import EventFrame, jsoncodec
+
+
+def _events(n: int) -> List[Event]:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        Event(
+            timestamp=start + timedelta(seconds=i * 1.5),
+            duration=1.25,
+            data={"app": "Firefox", "title": f"Page {i % 1000} - Mozilla Firefox"},
+        )
+        for i in range(n)
+    ]
+
+
+def timed(f: Callable[[], Any], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    events = _events(n)
+    heartbeat = events[0]
+    response = json.dumps([e.to_json_dict() for e in events]).encode("utf8")
+
+    baseline = {
+        "heartbeat": lambda: bytes(json.dumps(heartbeat.to_json_dict()), "utf8"),
+        "insert_events": lambda: bytes(
+            json.dumps([e.to_json_dict() for e in events]), "utf8"
+        ),
+        "get_events": lambda: [Event(**e) for e in json.loads(response)],
+        "get_events (frame)": lambda: EventFrame.from_json(json.loads(response)),
+    }
+    codec = {
+        "heartbeat": lambda: jsoncodec.dumps(heartbeat),
+        "insert_events": lambda: jsoncodec.dumps(events),
+        "get_events": lambda: [Event(**e) for e in jsoncodec.loads(response)],
+        "get_events (frame)": lambda: EventFrame.from_json(jsoncodec.loads(response)),
+    }
+    backends = ["json"] + (["orjson"] if jsoncodec.orjson is not None else [])
+
+    print(f"Encoding/decoding payloads ({n} events for insert_events and get_events):")
+    print(f"  {'':<18} {'before':>10}" + "".join(f" {b:>10}" for b in backends))
+    for name in baseline:
+        repeat = 10_000 if name == "heartbeat" else 5
+        times = [timed(baseline[name], repeat)]
+        for backend in backends:
+            jsoncodec.set_backend(backend)
+            times.append(timed(codec[name], repeat))
+        jsoncodec.set_backend(None)
+        unit, scale = ("us", 1e6) if name == "heartbeat" else ("ms", 1e3)
+        print(
+            f"  {name:<18}"
+            + "".join(f" {t * scale:>8.1f}{unit}" for t in times)
+            + f"  ({times[0] / times[-1]:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
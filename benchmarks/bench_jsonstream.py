@@ -0,0 +1,76 @@
+"""
+Compares peak memory of decoding a large export with `export_all` and `stream_export`.
+
+Runs against a local stand-in server in a subprocess, so no aw-server is needed:
+
+    python3 benchmarks/bench_jsonstream.py [n_events]
+"""
+
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Tuple
+
+from aw_core.models import Event
+
+from aw_client import ActivityWatchClient
+
+SERVER = os.path.join(os.path.dirname(__file__), "..", "tests", "stand_in_server.py")
+PORT = 5677
+
+
+def peak_memory(f: Callable[[], object]) -> Tuple[float, float]:
+    """Returns peak traced memory in MiB, and time elapsed, when calling f."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, elapsed
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    server = subprocess.Popen(
+        [sys.executable, SERVER, str(PORT)], stdout=subprocess.PIPE
+    )
+    assert server.stdout
+    server.stdout.readline()
+
+    client = ActivityWatchClient("bench-jsonstream", host="127.0.0.1", port=PORT)
+    client.create_bucket("bench", "test")
+    now = datetime.now(timezone.utc)
+    for i in range(0, n, 10_000):
+        client.insert_events(
+            "bench",
+            [
+                Event(
+                    timestamp=now - timedelta(seconds=j),
+                    duration=1,
+                    data={"app": "Firefox", "title": f"Page {j % 1000}"},
+                )
+                for j in range(i, min(n, i + 10_000))
+            ],
+        )
+
+    def count_streamed():
+        return sum(1 for _ in client.stream_export())
+
+    print(f"Exporting a bucket with {n} events:")
+    for name, f in [
+        ("export_all", client.export_all),
+        ("stream_export", count_streamed),
+    ]:
+        peak, elapsed = peak_memory(f)
+        print(f"  {name:<14} peak {peak:8.1f} MiB, {elapsed:5.2f}s")
+
+    client.disconnect()
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measures evaluating `fullDesktopQuery` with `LocalQueryEngine`, for one day per timeperiod:
+
+    python3 benchmarks/bench_localquery.py [n_days] [max_workers]
+"""
+
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from aw_client import queries
+from aw_client.classes import default_classes
+from aw_client.localquery import LocalQueryEngine
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(rng: random.Random, days: int, data) -> List[dict]:
+    events = []
+    ts = start
+    end = start + timedelta(days=days)
+    while ts < end:
+        ts += timedelta(seconds=rng.choice([0, 0, 1, 5, 30]))
+        duration = rng.choice([1, 2, 10, 60])
+        events.append(
+            {"timestamp": ts.isoformat(), "duration": duration, "data": data()}
+        )
+        ts += timedelta(seconds=duration)
+    return events
+
+
+def _export(days: int) -> dict:
+    rng = random.Random(0)
+    apps = ["Firefox", "vim", "Slack", "Google Chrome", "Terminal"]
+    titles = ["GitHub - aw-client", "YouTube", "notes", "reddit", "Gmail"]
+    buckets = {
+        "aw-watcher-window_host": lambda: {
+            "app": rng.choice(apps),
+            "title": rng.choice(titles),
+        },
+        "aw-watcher-afk_host": lambda: {"status": rng.choice(["afk", "not-afk"])},
+        "aw-watcher-web-chrome_host": lambda: {
+            "url": rng.choice(["https://github.com/", "https://youtube.com/"]),
+            "title": rng.choice(titles),
+            "audible": rng.random() < 0.2,
+        },
+    }
+    return {
+        "buckets": {
+            bid: {"id": bid, "events": _events(rng, days, data)}
+            for bid, data in buckets.items()
+        }
+    }
+
+
+def main() -> None:
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    logging.getLogger("aw_transform").setLevel(logging.ERROR)
+
+    export = _export(days)
+    n = sum(len(b["events"]) for b in export["buckets"].values())
+    query = queries.fullDesktopQuery(
+        queries.DesktopQueryParams(
+            bid_window="aw-watcher-window_host",
+            bid_afk="aw-watcher-afk_host",
+            bid_browsers=["aw-watcher-web-chrome_host"],
+            classes=default_classes,
+        )
+    )
+    timeperiods = [
+        (start + timedelta(days=d), start + timedelta(days=d + 1)) for d in range(days)
+    ]
+
+    print(f"fullDesktopQuery over {days} days ({n} events):")
+    for vectorized in [False, True]:
+        engine = LocalQueryEngine.from_export(export, vectorized=vectorized)
+        for workers in sorted({1, max_workers}):
+            # Start the worker processes before timing
+            engine.query(query, timeperiods[:2], max_workers=workers)
+            t = time.perf_counter()
+            engine.query(query, timeperiods, max_workers=workers)
+            t = time.perf_counter() - t
+            mode = "vectorized" if vectorized else "aw_transform"
+            print(
+                f"  {mode:<12} {workers:>2} workers: {t:7.2f}s ({t / days * 1000:.0f}ms/day)"
+            )
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
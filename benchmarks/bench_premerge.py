@@ -0,0 +1,136 @@
+"""
+Benchmarks for pre-merging queued heartbeats:
+
+ - the cost of adding a heartbeat, as done before `aw_client.premerge` (an `Event` per
+   heartbeat, merged with `aw_transform.heartbeat_merge`), with `heartbeat(queued=True)`,
+   and with `heartbeat_raw`.
+ - write volume (heartbeats queued, out of those sent by a watcher) and freshness (how long
+   heartbeats wait in memory before being queued), for a watcher that goes quiet at the end.
+
+    python3 benchmarks/bench_premerge.py [n_heartbeats]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from aw_core.models import Event
+from aw_transform.heartbeats import heartbeat_merge
+
+from aw_client.premerge import HeartbeatPremerger
+
+endpoint = "buckets/bench/heartbeat?pulsetime=5"
+
+
+class OldPremerger:
+    """What `ActivityWatchClient.heartbeat(queued=True)` did before: no timer, no flush."""
+
+    def __init__(self, commit: Callable[[str, dict], None]) -> None:
+        self.commit = commit
+        self.last_heartbeat: Dict[str, Event] = {}
+
+    def add(self, bucket_id: str, event: Event, commit_interval: float) -> None:
+        if bucket_id not in self.last_heartbeat:
+            self.last_heartbeat[bucket_id] = event
+            return
+        last_heartbeat = self.last_heartbeat[bucket_id]
+        merge = heartbeat_merge(last_heartbeat, event, 5)
+        if merge:
+            if last_heartbeat.duration.total_seconds() >= commit_interval:
+                self.commit(endpoint, merge.to_json_dict())
+                self.last_heartbeat[bucket_id] = event
+            else:
+                self.last_heartbeat[bucket_id] = merge
+        else:
+            self.commit(endpoint, last_heartbeat.to_json_dict())
+            self.last_heartbeat[bucket_id] = event
+
+
+def _data(i: int) -> dict:
+    # A new window title every 50 heartbeats
+    return {"app": "Firefox", "title": f"Page {i // 50}"}
+
+
+def cost(n: int) -> None:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    timestamps = [start + timedelta(seconds=i) for i in range(n)]
+    data = [_data(i) for i in range(n)]
+
+    def before() -> None:
+        old = OldPremerger(lambda endpoint, data: None)
+        for ts, d in zip(timestamps, data):
+            old.add("bench", Event(timestamp=ts, data=d), 10)
+
+    def with_event() -> None:
+        premerger = HeartbeatPremerger(lambda endpoint, data: None)
+        for ts, d in zip(timestamps, data):
+            e = Event(timestamp=ts, data=d)
+            premerger.add("bench", endpoint, e.timestamp, e.duration, e.data, 5, 10)
+        premerger.close()
+
+    def raw() -> None:
+        premerger = HeartbeatPremerger(lambda endpoint, data: None)
+        zero = timedelta(0)
+        for ts, d in zip(timestamps, data):
+            premerger.add("bench", endpoint, ts, zero, d, 5, 10)
+        premerger.close()
+
+    print(f"Cost of adding a heartbeat ({n} heartbeats):")
+    for name, f in [
+        ("before", before),
+        ("heartbeat(queued=True)", with_event),
+        ("heartbeat_raw", raw),
+    ]:
+        t = time.perf_counter()
+        f()
+        print(f"  {name:<24} {(time.perf_counter() - t) / n * 1e6:>6.2f}us")
+
+
+def volume(n: int, interval: float, commit_interval: float) -> None:
+    """Sends `n` heartbeats every `interval` seconds of real time, then goes quiet."""
+    sent_at: List[float] = []
+
+    def commit(endpoint: str, data: dict) -> None:
+        sent_at.append(time.monotonic())
+
+    old_sent_at: List[float] = []
+    old = OldPremerger(lambda endpoint, data: old_sent_at.append(time.monotonic()))
+    premerger = HeartbeatPremerger(commit)
+    last: Optional[float] = None
+    for i in range(n):
+        now = datetime.now(timezone.utc)
+        old.add("bench", Event(timestamp=now, data=_data(i)), commit_interval)
+        premerger.add(
+            "bench", endpoint, now, timedelta(0), _data(i), 5, commit_interval
+        )
+        last = time.monotonic()
+        time.sleep(interval)
+    # Quiet for a while
+    time.sleep(commit_interval * 2)
+    assert last is not None
+
+    stats: Dict[str, Any] = premerger.stats
+    print(
+        f"Watcher sending {n} heartbeats every {interval * 1000:.0f}ms, then quiet"
+        f" (commit_interval={commit_interval}s):"
+    )
+    print(f"  {'':<8} {'queued':>7} {'last heartbeat queued after':>28}")
+    old_last = f"{old_sent_at[-1] - last:.2f}s" if old_sent_at[-1] >= last else "never"
+    print(f"  {'before':<8} {len(old_sent_at):>7} {old_last:>28}")
+    print(f"  {'now':<8} {len(sent_at):>7} {sent_at[-1] - last:>27.2f}s")
+    print(
+        f"  staleness of queued events: mean {stats['mean_staleness']:.2f}s,"
+        f" max {stats['max_staleness']:.2f}s"
+    )
+    premerger.close()
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    cost(n)
+    volume(500, 0.01, 1.0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Compares the request queue backends: puts per second, bytes written to disk (as counted
+by the kernel, on Linux) and on-disk size, and the cost of draining the queue in windows
+of 100 requests, as `RequestQueue` does.
+
+Then compacts the backlog of a watcher after a week offline, with the limits of the
+default config.
+
+    python3 benchmarks/bench_queuebackend.py [n_requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from aw_client.client import _compact_queue
+from aw_client.queuebackend import (
+    LogQueueBackend,
+    QueueBackend,
+    QueuedRequest,
+    SQLiteQueueBackend,
+)
+
+
+def _requests(n: int) -> List[QueuedRequest]:
+    start = datetime.now(timezone.utc)
+    return [
+        QueuedRequest(
+            "buckets/aw-watcher-window_bench/heartbeat?pulsetime=2.0",
+            {
+                "timestamp": (start + timedelta(seconds=i)).isoformat(),
+                "duration": 0,
+                "data": {"app": "Firefox", "title": f"Page {i // 60}"},
+            },
+        )
+        for i in range(n)
+    ]
+
+
+def _written() -> Optional[int]:
+    """Bytes this process has written, including by SQLite, or None if unknown."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(d, f))
+        for d, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def run(
+    open_backend: Callable[[str], QueueBackend], requests: List[QueuedRequest]
+) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "queue")
+        backend = open_backend(path)
+        written = _written()
+        t = time.perf_counter()
+        for r in requests:
+            backend.put(r)
+        put_time = time.perf_counter() - t
+        size = _size(path)
+
+        t = time.perf_counter()
+        n = 0
+        while True:
+            window = backend.read(100)
+            if not window:
+                break
+            n += len(window)
+            backend.ack()
+        drain_time = time.perf_counter() - t
+        assert n == len(requests)
+        backend.close()
+        after = _written()
+        return {
+            "puts/s": len(requests) / put_time,
+            "drain/s": len(requests) / drain_time,
+            "size": size,
+            "written": float("nan")
+            if after is None or written is None
+            else after - written,
+        }
+
+
+def offline_week() -> None:
+    """A week of heartbeats pre-merged every 10s, with a new window title every 5 minutes."""
+    n = 7 * 24 * 360
+    start = datetime.now(timezone.utc) - timedelta(days=7)
+    requests = [
+        QueuedRequest(
+            "buckets/aw-watcher-window_bench/heartbeat?pulsetime=11.0",
+            {
+                "timestamp": (start + timedelta(seconds=10 * i)).isoformat(),
+                "duration": 10,
+                "data": {"app": "Firefox", "title": f"Page {i // 30}"},
+            },
+        )
+        for i in range(n)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = LogQueueBackend(os.path.join(tmp, "queue"))
+        for r in requests:
+            backend.put(r)
+        t = time.perf_counter()
+        result = _compact_queue(backend, 100 * 1024 * 1024, timedelta(days=30))
+        elapsed = time.perf_counter() - t
+        backend.close()
+    assert result is not None
+    print("Compacting a week offline:")
+    print(
+        "  {requests_before} requests ({bytes_before} bytes) to {requests_after}"
+        " ({bytes_after} bytes)".format(**result)
+        + f" in {elapsed:.2f}s"
+    )
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    requests = _requests(n)
+    backends: Dict[str, Callable[[str], QueueBackend]] = {
+        "sqlite (persistqueue)": SQLiteQueueBackend,
+        "log": LogQueueBackend,
+        "log, fsync every put": lambda path: LogQueueBackend(path, sync_interval=0),
+    }
+    print(f"Queueing and draining {n} heartbeats:")
+    print(
+        f"  {'':<22} {'puts/s':>9} {'drain/s':>9} {'size':>9} {'written':>11} {'per put':>8}"
+    )
+    for name, open_backend in backends.items():
+        r = run(open_backend, requests)
+        print(
+            f"  {name:<22} {r['puts/s']:>9.0f} {r['drain/s']:>9.0f}"
+            f" {r['size'] / 1e6:>8.2f}M {r['written'] / 1e6:>10.2f}M"
+            f" {r['written'] / n:>7.0f}B"
+        )
+    print()
+    offline_week()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares reading the history of a bucket from the server with reading it from a `Replica`,
+and the cost of the first and of incremental syncs. Runs against a local stand-in server:
+
+    python3 benchmarks/bench_replica.py [n_events]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.replica import Replica
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(n: int, offset: int = 0) -> List[Event]:
+    return [
+        Event(
+            timestamp=start + timedelta(seconds=(offset + i) * 10),
+            duration=9,
+            data={"app": f"app{i % 7}", "title": f"Page {i % 1000}"},
+        )
+        for i in range(n)
+    ]
+
+
+def timed(f: Callable[[], Any]) -> float:
+    t = time.perf_counter()
+    f()
+    return time.perf_counter() - t
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    server = StandInServer().start()
+    client = ActivityWatchClient("bench-replica", host="127.0.0.1", port=server.port)
+    client.create_bucket("bench", "test")
+    client.insert_events("bench", _events(n))
+
+    with tempfile.TemporaryDirectory() as path:
+        replica = Replica(client, path, trailing_window=timedelta(minutes=10))
+        results = [
+            ("get_events from server", timed(lambda: client.get_events("bench"))),
+            (
+                "get_events from server (frame)",
+                timed(lambda: client.get_events("bench", as_frame=True)),
+            ),
+            ("first sync", timed(replica.sync)),
+        ]
+        client.insert_events("bench", _events(100, offset=n))
+        results += [
+            ("incremental sync (100 new events)", timed(replica.sync)),
+            ("incremental sync (no new events)", timed(replica.sync)),
+            (
+                "get_events from replica",
+                timed(lambda: replica.get_events("bench", sync=False)),
+            ),
+            (
+                "get_events from replica (frame)",
+                timed(lambda: replica.get_events("bench", as_frame=True, sync=False)),
+            ),
+        ]
+        # A new process, reading the replica from disk
+        reopened = Replica(client, path)
+        results.append(
+            (
+                "get_events from reopened replica (frame)",
+                timed(lambda: reopened.get_events("bench", as_frame=True, sync=False)),
+            )
+        )
+
+    client.disconnect()
+    server.stop()
+    print(f"Bucket of {n} events:")
+    for name, t in results:
+        print(f"  {name:<42} {t * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmarks for the RequestQueue:
+
+ - how long it takes to drain a backlog of queued heartbeats,
+   as it would after the server has been down for a while.
+ - the latency from enqueueing a heartbeat to it being sent.
+ - how often an idle queue thread wakes up.
+
+Runs against a local stand-in server, so no aw-server is needed:
+
+    python3 benchmarks/bench_requestqueue.py [n_heartbeats]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from random import randint, uniform
+from statistics import mean, quantiles
+from typing import List, Type
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.client import RequestQueue
+
+
+class PollingRequestQueue(RequestQueue):
+    """What the queue did before: re-poll the empty queue every 200ms."""
+
+    def _wait_for_requests(self) -> None:
+        self.wait(0.2)
+
+
+def _client(server: StandInServer) -> ActivityWatchClient:
+    return ActivityWatchClient(
+        f"bench-queue-{randint(0, 10**6)}", host="127.0.0.1", port=server.port
+    )
+
+
+def fill(rq: RequestQueue, bucket_id: str, n: int) -> None:
+    start = datetime.now(timezone.utc) - timedelta(seconds=n)
+    endpoint = f"buckets/{bucket_id}/heartbeat?pulsetime=2"
+    for i in range(n):
+        # A new window title every minute, like a typical window watcher
+        e = Event(timestamp=start + timedelta(seconds=i), data={"title": str(i // 60)})
+        rq.add_request(endpoint, e.to_json_dict())
+
+
+def drain(server: StandInServer, batch_size: int, n: int) -> float:
+    bucket_id = f"bench-queue-{batch_size}"
+    client = _client(server)
+    client.request_queue = rq = RequestQueue(client, batch_size=batch_size)
+    rq.register_bucket(bucket_id, "test")
+    fill(rq, bucket_id, n)
+
+    start = time.perf_counter()
+    client.connect()
+    while rq._backend.qsize() > 0 or rq._window:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    return elapsed
+
+
+def latency(server: StandInServer, queue_cls: Type[RequestQueue]) -> List[float]:
+    """Returns the enqueue-to-send latency of heartbeats added at random intervals."""
+    bucket_id = "bench-queue-latency"
+    client = _client(server)
+    client.request_queue = rq = queue_cls(client)
+    rq.register_bucket(bucket_id, "test")
+
+    enqueued: List[float] = []
+    sent: List[float] = []
+    post = client._post
+
+    def timed_post(*args, **kwargs):
+        r = post(*args, **kwargs)
+        sent.append(time.perf_counter())
+        return r
+
+    client._post = timed_post  # type: ignore
+    client.connect()
+    time.sleep(0.5)
+    for i in range(50):
+        time.sleep(uniform(0.01, 0.1))
+        e = Event(timestamp=datetime.now(timezone.utc), data={"n": i})
+        enqueued.append(time.perf_counter())
+        rq.add_request(f"buckets/{bucket_id}/heartbeat?pulsetime=0", e.to_json_dict())
+    time.sleep(0.5)
+    client.disconnect()
+    # The first post is the bucket creation
+    return [s - e for e, s in zip(enqueued, sent[1:])]
+
+
+def idle_wakeups(server: StandInServer, queue_cls: Type[RequestQueue]) -> float:
+    """Returns how many times per minute an idle queue thread polls the queue."""
+    seconds = 3
+    polls = 0
+
+    client = _client(server)
+    client.request_queue = rq = queue_cls(client)
+    get_next = rq._get_next
+
+    def counted_get_next():
+        nonlocal polls
+        polls += 1
+        return get_next()
+
+    rq._get_next = counted_get_next  # type: ignore
+    client.connect()
+    time.sleep(0.5)
+    polls = 0
+    time.sleep(seconds)
+    n_polls = polls
+    client.disconnect()
+    return n_polls * 60 / seconds
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    server = StandInServer().start()
+
+    results = {batch_size: drain(server, batch_size, n) for batch_size in [1, 100]}
+    print(f"Draining {n} queued heartbeats:")
+    for batch_size, elapsed in results.items():
+        print(f"  batch_size={batch_size:<4} {elapsed:6.2f}s ({n / elapsed:6.0f}/s)")
+    print(f"  speedup: {results[1] / results[100]:.1f}x")
+    print()
+
+    for name, queue_cls in [
+        ("polling", PollingRequestQueue),
+        ("event-driven", RequestQueue),
+    ]:
+        lat = [1000 * t for t in latency(server, queue_cls)]
+        percentiles = quantiles(lat, n=100)
+        p50, p99 = percentiles[49], percentiles[98]
+        print(f"{name}:")
+        print(
+            f"  enqueue-to-send latency: mean {mean(lat):6.1f}ms, p50 {p50:6.1f}ms, p99 {p99:6.1f}ms"
+        )
+        print(f"  idle wakeups: {idle_wakeups(server, queue_cls):6.0f}/min")
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares requests/sec with and without the pooled keep-alive transport.
+
+Runs against a local stand-in server, so no aw-server is needed:
+
+    python3 benchmarks/bench_transport.py [n_requests]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import requests as req
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.transport import HTTPTransport
+
+
+class UnpooledTransport(HTTPTransport):
+    """What the client did before: a new connection for every request."""
+
+    def request(self, method, url, **kwargs):
+        return req.request(method, url, **kwargs)
+
+
+def bench(client: ActivityWatchClient, bucket_id: str, n: int) -> float:
+    event = Event(timestamp=datetime.now(timezone.utc), data={"label": "bench"})
+    start = time.perf_counter()
+    for _ in range(n):
+        client.heartbeat(bucket_id, event, pulsetime=60)
+    return n / (time.perf_counter() - start)
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server = StandInServer().start()
+    bucket_id = "bench-transport"
+
+    results = {}
+    for name, transport in [
+        ("unpooled", UnpooledTransport()),
+        ("pooled", HTTPTransport()),
+    ]:
+        client = ActivityWatchClient(
+            f"bench-transport-{name}",
+            host="127.0.0.1",
+            port=server.port,
+            transport=transport,
+        )
+        client.create_bucket(bucket_id, "test")
+        results[name] = bench(client, bucket_id, n)
+        client.disconnect()
+
+    server.stop()
+
+    for name, rps in results.items():
+        print(f"{name:>10}: {rps:8.0f} requests/sec")
+    print(f"   speedup: {results['pooled'] / results['unpooled']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import os
 import socket
 from datetime import datetime, timedelta, timezone
 
-import iso8601
+import numpy as np
 import pandas as pd
 from aw_client import ActivityWatchClient
 from aw_client.classes import default_classes
@@ -35,22 +35,14 @@ def main() -> None:
     aw = ActivityWatchClient()
     print("Querying...")
     query = build_query()
-    data = aw.query(query, [(now - td30d, now)])
-
-    events = [
-        {
-            "timestamp": e["timestamp"],
-            "duration": timedelta(seconds=e["duration"]),
-            **e["data"],
-        }
-        for e in data[0]["events"]
-    ]
-
-    for e in events:
-        e["$category"] = " > ".join(e["$category"])
-
-    df = pd.json_normalize(events)
-    df["timestamp"] = pd.to_datetime(df["timestamp"].apply(iso8601.parse_date))
+    data = aw.query(query, [(now - td30d, now)], as_frame=True)
+    frame = data[0]["events"]
+
+    # Build the dataframe straight from the columns, without creating an Event per row
+    df = pd.DataFrame({key: frame.column(key) for key in frame.data})
+    df["$category"] = df["$category"].map(" > ".join)
+    df["duration"] = pd.to_timedelta(np.asarray(frame.durations), unit="s")
+    df["timestamp"] = pd.to_datetime(np.asarray(frame.timestamps), utc=True)
     df.set_index("timestamp", inplace=True)
 
     print(df)
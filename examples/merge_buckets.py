@@ -1,7 +1,5 @@
-from datetime import timedelta
-
 import aw_client
-from aw_transform.filter_period_intersect import _intersecting_eventpairs
+from aw_client import intervals
 
 
 def main():
@@ -26,16 +24,16 @@ def main():
     src_id = input("Source bucket ID: ")
     dest_id = input("Destination bucket ID: ")
 
-    src_events = aw.get_events(src_id)
+    src_events = aw.get_events(src_id, as_frame=True)
     print(f"✓ src events: {len(src_events)}")
-    dest_events = aw.get_events(dest_id)
+    dest_events = aw.get_events(dest_id, as_frame=True)
     print(f"✓ dest events: {len(dest_events)}")
 
     print("Checking overlap...")
-    overlaps = list(_intersecting_eventpairs(src_events, dest_events))
+    overlaps = intervals.filter_period_intersect(src_events, dest_events)
     if overlaps:
-        total_duration_src = sum((e.duration for e in src_events), timedelta())
-        total_overlap = sum((tp.duration for _, _, tp in overlaps), timedelta())
+        total_duration_src = intervals.sum_durations(src_events)
+        total_overlap = intervals.sum_durations(overlaps)
         print(
             f"Buckets had overlap ({total_overlap} out of {total_duration_src}), can't safely merge, exiting."
         )
@@ -53,7 +51,18 @@ def main():
         exit(1)
 
     print("Inserting source events into destination bucket...")
-    aw.insert_events(dest_id, src_events)
+
+    def progress(result):
+        status = "✓" if result.ok else f"✗ ({result.error})"
+        print(f" {status} events {result.first}-{result.first + result.count - 1}")
+
+    results = aw.insert_events_chunked(dest_id, src_events, progress=progress)
+    failed = [r for r in results if not r.ok]
+    if failed:
+        print(
+            f"Failed to insert {sum(r.count for r in failed)} events, not deleting the source bucket."
+        )
+        exit(1)
 
     print("Operation complete")
     if input("Do you want to delete the source bucket? (y/n): ") == "y":
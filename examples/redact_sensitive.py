@@ -12,9 +12,9 @@ import re
 import sys
 from copy import deepcopy
 from typing import (
+    Iterable,
     List,
     Pattern,
-    Set,
     Union,
     cast,
 )
@@ -83,30 +83,29 @@ def _redact_bucket(bucket_id: str, pattern: Union[str, Pattern]):
     print(f"\nChecking bucket: {bucket_id}")
 
     global aw
-    events = aw.get_events(bucket_id, limit=-1)
-    sensitive_ids = _find_sensitive(events, pattern)
-    print(f"Found {len(sensitive_ids)} sensitive events")
+    # Walk through the bucket page by page, so that only the sensitive events are kept in memory
+    sensitive_events = _find_sensitive(aw.iter_events(bucket_id), pattern)
+    print(f"Found {len(sensitive_events)} sensitive events")
 
-    if not sensitive_ids:
+    if not sensitive_events:
         return
 
     yes_redact = input(
         f"Do you want to replace all the matching strings with '{REDACTED}'? (y/N): "
     )
     if yes_redact == "y":
-        for e in events:
-            if e.id in sensitive_ids:
-                e_before = e
-                e = _redact_event(e, pattern)
-                print(f"\nData before: {e_before.data}")
-                print(f"Data after:  {e.data}")
-
-                if DRYRUN:
-                    print("DRYRUN, would do: aw.insert_event(bucket_id, e)")
-                else:
-                    aw.delete_event(bucket_id, cast(int, e_before.id))
-                    aw.insert_event(bucket_id, e)
-                    print("Redacted event")
+        for e in sensitive_events:
+            e_before = e
+            e = _redact_event(e, pattern)
+            print(f"\nData before: {e_before.data}")
+            print(f"Data after:  {e.data}")
+
+            if DRYRUN:
+                print("DRYRUN, would do: aw.insert_event(bucket_id, e)")
+            else:
+                aw.delete_event(bucket_id, cast(int, e_before.id))
+                aw.insert_event(bucket_id, e)
+                print("Redacted event")
 
 
 def _check_event(e: Event, pattern: Union[str, Pattern]) -> bool:
@@ -134,13 +133,8 @@ def _redact_event(e: Event, pattern: Union[str, Pattern]) -> Event:
     return e
 
 
-def _find_sensitive(el: List[Event], pattern: Union[str, Pattern]) -> Set:
-    sensitive_ids = set()
-    for e in el:
-        if _check_event(e, pattern):
-            sensitive_ids.add(e.id)
-
-    return sensitive_ids
+def _find_sensitive(el: Iterable[Event], pattern: Union[str, Pattern]) -> List[Event]:
+    return [e for e in el if _check_event(e, pattern)]
 
 
 if __name__ == "__main__":
@@ -14,9 +14,7 @@ from datetime import datetime, time, timedelta
 from typing import Dict, List, Tuple
 
 import aw_client
-from aw_client import queries
-from aw_core import Event
-from aw_transform import flood
+from aw_client import EventFrame, intervals, queries
 from tabulate import tabulate
 
 OUTPUT_HTML = os.environ.get("OUTPUT_HTML", "").lower() == "true"
@@ -43,14 +41,12 @@ def generous_approx(events: List[dict], max_break: float) -> timedelta:
 
     max_break: Max time (in seconds) to flood when there's an empty slot between events
     """
-    events_e: List[Event] = [Event(**e) for e in events]
-    return sum(
-        map(lambda e: e.duration, flood(events_e, max_break)),
-        timedelta(),
+    return intervals.sum_durations(
+        intervals.flood(EventFrame.from_json(events), max_break)
     )
 
 
-def query(regex: str, timeperiods, hostname: str):
+def query(regex: str, timeperiods: List[Tuple[datetime, datetime]], hostname: str):
     print("Querying events...")
     print(f"  Day offset: {day_offset}")
     print("")
@@ -82,7 +78,11 @@ def query(regex: str, timeperiods, hostname: str):
     RETURN = {{"events": events, "duration": duration}};
     """
 
-    res = aw.query(query, timeperiods)
+    # The timeperiods are consecutive days, results of past days are reused from earlier runs
+    days = aw.query_by_day(
+        query, timeperiods[0][0].date(), timeperiods[-1][0].date(), day_offset
+    )
+    res = list(days.values())
 
     return res
 
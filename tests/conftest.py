@@ -0,0 +1,54 @@
+from typing import Any, Callable
+
+import pytest
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+
+
+@pytest.fixture(autouse=True)
+def user_dirs(tmp_path_factory, monkeypatch):
+    """
+    Points the data dir (where request queues are stored) and the lock files of clients
+    at a temporary dir, so that tests don't leave them behind in the user's dirs.
+    """
+    root = tmp_path_factory.mktemp("user")
+
+    def get_dir(kind: str):
+        def get(module_name=None) -> str:
+            path = root / kind / (module_name or "")
+            path.mkdir(parents=True, exist_ok=True)
+            return str(path)
+
+        return get
+
+    monkeypatch.setattr("aw_core.dirs.get_data_dir", get_dir("data"))
+    monkeypatch.setattr("aw_client.singleinstance.get_cache_dir", get_dir("cache"))
+    return root
+
+
+@pytest.fixture
+def server_class() -> type:
+    """The class of `server`, test modules override it to use a subclass of StandInServer."""
+    return StandInServer
+
+
+@pytest.fixture
+def server(server_class):
+    server = server_class().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_client(request) -> Callable[..., Any]:
+    """
+    Creates clients of a stand-in server, named after the test module, such as
+    "test-transport" in test_transport.py.
+    """
+    name = request.module.__name__.rpartition(".")[2].replace("_", "-")
+
+    def make(server: StandInServer, client_class: type = ActivityWatchClient, **kwargs):
+        return client_class(name, host="127.0.0.1", port=server.port, **kwargs)
+
+    return make
@@ -0,0 +1,282 @@
+"""
+A small in-memory stand-in for aw-server, used by tests and benchmarks.
+
+Implements just enough of the REST API for the client to talk to it over real
+HTTP/1.1 keep-alive connections, without needing a running aw-server.
+"""
+
+import gzip
+import json
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def _parse_dt(s: str) -> datetime:
+    return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "StandInServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            with self.server.lock:
+                self.server.connections.discard(self.connection)
+
+    def _send(
+        self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        payload = json.dumps(body).encode("utf8") if body is not None else b""
+        accepted = self.headers.get("Accept-Encoding") or ""
+        gzipped = self.server.compress_responses and "gzip" in accepted and payload
+        if gzipped:
+            payload = gzip.compress(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        # Counted before writing, so that it is up to date once the client has the response
+        with self.server.lock:
+            self.server.bytes_sent += len(payload)
+        self.wfile.write(payload)
+
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        with self.server.lock:
+            self.server.bytes_received += len(raw)
+        encoding = self.headers.get("Content-Encoding")
+        if encoding == "gzip":
+            raw = gzip.decompress(raw)
+        elif encoding == "deflate":
+            raw = zlib.decompress(raw)
+        return json.loads(raw) if raw else None
+
+    def _route(self, method: str) -> None:
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p][2:]  # strip api/0
+        body = self._body() if method in ("POST", "DELETE") else None
+        if parts == ["query"] and body and self.server.query_delay:
+            # Outside the lock, so that concurrent queries are evaluated concurrently
+            time.sleep(self.server.query_delay * len(body["timeperiods"]))
+        if parts[-1:] == ["events"] and method == "POST" and self.server.insert_delay:
+            with self.server.lock:
+                self.server.inserts_in_flight += 1
+                self.server.max_inserts_in_flight = max(
+                    self.server.max_inserts_in_flight, self.server.inserts_in_flight
+                )
+            time.sleep(self.server.insert_delay)
+            with self.server.lock:
+                self.server.inserts_in_flight -= 1
+        with self.server.lock:
+            self.server.request_count += 1
+            # (status, body), or (status, body, headers)
+            response = self.server.handle(method, parts, params, body)
+        self._send(*response)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Simulated time for evaluating a query, per timeperiod, in seconds
+    query_delay = 0.0
+    # Simulated time for inserting a batch of events, in seconds
+    insert_delay = 0.0
+    # Gzip responses to clients that accept it, like a compressing reverse proxy
+    compress_responses = False
+
+    def __init__(self, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        # Open keep-alive connections, closed by stop() like a real server exiting would
+        self.connections: Set[socket.socket] = set()
+        self.inserts_in_flight = 0
+        # Sizes of request and response bodies, as sent over the wire
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.max_inserts_in_flight = 0
+        self.buckets: Dict[str, dict] = {}
+        self.events: Dict[str, List[dict]] = {}
+        self.settings: Dict[str, Any] = {}
+        self._next_id = 1
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _insert(self, bucket_id: str, event: dict) -> dict:
+        event = dict(event, id=self._next_id)
+        self._next_id += 1
+        self.events[bucket_id].append(event)
+        return event
+
+    def _heartbeat(self, bucket_id: str, event: dict, pulsetime: float) -> dict:
+        events = self.events[bucket_id]
+        if events:
+            last = max(events, key=lambda e: e["timestamp"])
+            last_start = _parse_dt(last["timestamp"])
+            start = _parse_dt(event["timestamp"])
+            pulse_end = last_start + timedelta(seconds=last["duration"] + pulsetime)
+            if last["data"] == event["data"] and last_start <= start <= pulse_end:
+                new_duration = (start - last_start).total_seconds() + event["duration"]
+                last["duration"] = max(last["duration"], new_duration)
+                return last
+        return self._insert(bucket_id, event)
+
+    def _get_events(self, bucket_id: str, params: dict) -> List[dict]:
+        events = self.events[bucket_id]
+        if "start" in params:
+            start = _parse_dt(params["start"])
+            events = [e for e in events if _parse_dt(e["timestamp"]) >= start]
+        if "end" in params:
+            end = _parse_dt(params["end"])
+            events = [e for e in events if _parse_dt(e["timestamp"]) <= end]
+        events = sorted(events, key=lambda e: _parse_dt(e["timestamp"]), reverse=True)
+        limit = int(params.get("limit", -1))
+        return events[:limit] if limit >= 0 else events
+
+    def _export(self, bucket_ids: List[str]) -> dict:
+        return {
+            "buckets": {
+                bid: dict(self.buckets[bid], events=self._get_events(bid, {}))
+                for bid in bucket_ids
+            }
+        }
+
+    def _query(self, body: dict) -> List[Any]:
+        """Doesn't evaluate the query, returns the events of all buckets within each timeperiod."""
+        result = []
+        for period in body["timeperiods"]:
+            start, end = period.split("/")
+            params = {"start": start, "end": end}
+            result.append(
+                [e for bid in self.buckets for e in self._get_events(bid, params)]
+            )
+        return result
+
+    def handle(self, method: str, parts: List[str], params: dict, body: Any):
+        if parts == ["info"]:
+            return 200, {"hostname": "stand-in", "version": "v0.0.0", "testing": True}
+        if parts == ["buckets"]:
+            return 200, self.buckets
+        if parts == ["export"]:
+            return 200, self._export(list(self.buckets))
+        if parts == ["import"] and method == "POST":
+            for bucket_id, bucket in body["buckets"].items():
+                self.buckets[bucket_id] = {
+                    k: v for k, v in bucket.items() if k != "events"
+                }
+                self.events[bucket_id] = []
+                for event in bucket.get("events", []):
+                    self._insert(bucket_id, event)
+            return 200, None
+        if parts == ["query"]:
+            return 200, self._query(body)
+        if parts[:1] == ["settings"]:
+            if method == "POST":
+                self.settings[parts[1]] = body
+                return 200, None
+            if len(parts) == 1:
+                return 200, self.settings
+            return 200, self.settings.get(parts[1])
+        if parts[:1] != ["buckets"] or len(parts) < 2:
+            return 404, {"message": "not found"}
+
+        bucket_id = parts[1]
+        rest = parts[2:]
+        if not rest:
+            if method == "POST":
+                if bucket_id in self.buckets:
+                    return 304, None
+                self.buckets[bucket_id] = dict(body, id=bucket_id)
+                self.events[bucket_id] = []
+                return 200, None
+            if method == "DELETE":
+                self.buckets.pop(bucket_id, None)
+                self.events.pop(bucket_id, None)
+                return 200, None
+            return 200, self.buckets.get(bucket_id)
+
+        if bucket_id not in self.buckets:
+            return 404, {"message": f"no such bucket: {bucket_id}"}
+        if rest == ["export"]:
+            return 200, self._export([bucket_id])
+        if rest == ["heartbeat"]:
+            pulsetime = float(params.get("pulsetime", 0))
+            return 200, self._heartbeat(bucket_id, body, pulsetime)
+        if rest == ["events"]:
+            if method == "POST":
+                for event in body:
+                    self._insert(bucket_id, event)
+                return 200, None
+            return 200, self._get_events(bucket_id, params)
+        if rest == ["events", "count"]:
+            return 200, len(self._get_events(bucket_id, params))
+        if rest[0] == "events" and len(rest) == 2:
+            matches = [e for e in self.events[bucket_id] if str(e["id"]) == rest[1]]
+            if method == "DELETE":
+                self.events[bucket_id] = [
+                    e for e in self.events[bucket_id] if str(e["id"]) != rest[1]
+                ]
+                return 200, None
+            return (200, matches[0]) if matches else (404, {"message": "not found"})
+        return 404, {"message": "not found"}
+
+
+if __name__ == "__main__":
+    # Run standalone, for example to benchmark against a server in another process
+    import sys
+
+    server = StandInServer(int(sys.argv[1]) if len(sys.argv) > 1 else 5666)
+    print(f"Stand-in server listening on port {server.port}", flush=True)
+    server.serve_forever()
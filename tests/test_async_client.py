@@ -0,0 +1,176 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import pytest
+from aw_core.models import Event
+
+pytest.importorskip("aiohttp")
+
+from aw_client.async_client import AsyncActivityWatchClient
+
+
+def test_gather_get_events(server, make_client):
+    now = datetime.now(timezone.utc)
+    bucket_ids = [f"bucket-{i}" for i in range(50)]
+
+    async def main():
+        async with make_client(
+            server, AsyncActivityWatchClient, pool_size=10
+        ) as client:
+            await asyncio.gather(*(client.create_bucket(b, "test") for b in bucket_ids))
+            await asyncio.gather(
+                *(
+                    client.insert_events(
+                        b,
+                        [
+                            Event(timestamp=now, duration=i, data={"b": b})
+                            for i in range(3)
+                        ],
+                    )
+                    for b in bucket_ids
+                )
+            )
+            buckets = await client.get_buckets()
+            return await asyncio.gather(*(client.get_events(b) for b in buckets))
+
+    results = asyncio.run(main())
+    assert len(results) == 50
+    assert all(len(events) == 3 for events in results)
+    # The fan-out is served from the shared connection pool
+    assert server.connection_count <= 10
+
+
+def test_query_and_settings(server, make_client):
+    async def main():
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.set_setting("classes", "[]")
+            assert await client.get_setting("classes") == "[]"
+            assert await client.get_event("nonexistent", 1) is None
+            with pytest.raises(ValueError):
+                await client.query("RETURN = 1;", [(datetime.now(), datetime.now())])
+
+    asyncio.run(main())
+
+
+def test_queued_heartbeats(server, make_client):
+    start = datetime.now(timezone.utc)
+
+    async def main():
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.create_bucket("queued", "test", queued=True)
+            for i in range(20):
+                e = Event(
+                    timestamp=start + timedelta(seconds=i), data={"label": str(i // 5)}
+                )
+                await client.heartbeat("queued", e, pulsetime=2, queued=True)
+            await asyncio.sleep(0.5)
+            # The pre-merge cache holds on to the last label
+            assert client.last_heartbeat["queued"].data == {"label": "3"}
+            assert [e.data["label"] for e in await client.get_events("queued")] == [
+                "2",
+                "1",
+                "0",
+            ]
+
+        # Queued on disconnect, and sent once the queue runs again, when it's used
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.create_bucket("queued", "test", queued=True)
+            for _ in range(50):
+                events = await client.get_events("queued")
+                if len(events) == 4:
+                    break
+                await asyncio.sleep(0.1)
+            return events
+
+    events = asyncio.run(main())
+    assert [e.data["label"] for e in events] == ["3", "2", "1", "0"]
+    assert events[0].duration == timedelta(seconds=4)
+
+
+def test_queued_heartbeat_timer_flush(server, make_client):
+    async def main():
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.create_bucket("queued", "test", queued=True)
+            e = Event(timestamp=datetime.now(timezone.utc), data={"label": "a"})
+            await client.heartbeat(
+                "queued", e, pulsetime=2, queued=True, commit_interval=0.2
+            )
+            # Queued by the flush timer thread, which wakes up the dispatcher task
+            await asyncio.sleep(0.5)
+            return await client.get_events("queued")
+
+    events = asyncio.run(main())
+    assert [e.data["label"] for e in events] == ["a"]
+
+
+def test_queued_request_unknown_error(server, make_client):
+    start = datetime.now(timezone.utc)
+
+    async def main():
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.create_bucket("queued", "test", queued=True)
+            post = client._post
+            failed: List[dict] = []
+
+            async def failing_post(endpoint, data, params=None):
+                if "/heartbeat" in endpoint and not failed:
+                    failed.append(data)
+                    raise ValueError("invalid response")
+                return await post(endpoint, data, params)
+
+            client._post = failing_post  # type: ignore
+            for i in range(2):
+                e = Event(timestamp=start + timedelta(seconds=i), data={"n": i})
+                await client.request_queue.add_request(
+                    "buckets/queued/heartbeat?pulsetime=0", e.to_json_dict()
+                )
+            await asyncio.sleep(0.5)
+            # The dispatcher task keeps running after the error, and sends the rest
+            assert client.request_queue._task is not None
+            assert not client.request_queue._task.done()
+            return failed, await client.get_events("queued")
+
+    failed, events = asyncio.run(main())
+    assert [e["data"]["n"] for e in failed] == [0]
+    assert [e.data["n"] for e in events] == [1]
+
+
+def test_request_queue_lazy(server, user_dirs, make_client):
+    async def main():
+        async with make_client(server, AsyncActivityWatchClient) as client:
+            await client.get_buckets()
+            # Neither the instance lock nor the queue are taken before requests are queued
+            assert client._instance is None
+            assert client._request_queue is None
+            assert not (user_dirs / "cache").exists()
+
+            put_threads: List[threading.Thread] = []
+            await client.create_bucket("queued", "test", queued=True)
+            storage = client.request_queue._storage
+
+            def recording_storage():
+                put_threads.append(threading.current_thread())
+                return storage()
+
+            client.request_queue._storage = recording_storage  # type: ignore
+            e = Event(timestamp=datetime.now(timezone.utc), data={"label": "a"})
+            client.request_queue.add_request_threadsafe(
+                "buckets/queued/heartbeat?pulsetime=0", e.to_json_dict()
+            )
+            # Written in the I/O thread, not on the event loop
+            assert threading.current_thread() not in put_threads
+            assert client._instance is not None
+            for _ in range(50):
+                if client.request_queue.connected:
+                    events = await client.get_events("queued")
+                    if events:
+                        break
+                await asyncio.sleep(0.1)
+            assert put_threads
+            assert threading.current_thread() not in put_threads
+            return events
+
+    events = asyncio.run(main())
+    assert [e.data["label"] for e in events] == ["a"]
@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from click.testing import CliRunner
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.cli import main
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StandInServer().start()
+    client = ActivityWatchClient("test-cli", host="127.0.0.1", port=server.port)
+    client.create_bucket("window", "currentwindow")
+    client.insert_events(
+        "window",
+        [
+            Event(
+                timestamp=start + timedelta(minutes=i),
+                duration=30.5,
+                data={"app": f"app{i % 3}"},
+            )
+            for i in range(12)
+        ],
+    )
+    client.disconnect()
+    yield server
+    server.stop()
+
+
+def _query(server, tmp_path, *args):
+    path = tmp_path / "query.txt"
+    path.write_text('RETURN = query_bucket("window");')
+    return CliRunner().invoke(
+        main,
+        ["--port", str(server.port), "query", str(path)]
+        + ["--start", "2024-01-01", "--stop", "2024-01-02", "--timezone", "UTC", *args],
+    )
+
+
+def test_query(server, tmp_path):
+    result = _query(server, tmp_path)
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0] == "Showing 10 out of 12 events:"
+    assert (
+        len([line for line in lines if line.startswith(" - Duration: 0:00:30")]) == 10
+    )
+    assert "{'app': 'app2'}" in lines[1]
+    assert lines[-1] == "Total duration:\t 0:06:06"
+
+
+def test_query_json(server, tmp_path):
+    result = _query(server, tmp_path, "--json")
+    assert result.exit_code == 0, result.output
+    (period,) = json.loads(result.output)
+    assert len(period) == 12
+    assert period[0]["duration"] == 30.5
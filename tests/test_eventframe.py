@@ -0,0 +1,119 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+
+from aw_client import EventFrame
+from aw_client.eventframe import (
+    MISSING,
+    frames_from_query_items,
+    frames_from_query_result,
+)
+from aw_client.jsonstream import ANY, iterparse
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(n):
+    return [
+        Event(
+            timestamp=start + timedelta(seconds=i, microseconds=i),
+            duration=1.5,
+            data={"app": f"app{i % 3}", "title": f"title {i}"}
+            if i % 4
+            else {"app": None},
+        )
+        for i in range(n)
+    ]
+
+
+def test_roundtrip():
+    events = _events(20)
+    frame = EventFrame.from_events(events)
+    assert len(frame) == 20
+    assert frame.to_events() == events
+    assert frame[-1] == events[-1]
+    assert list(frame[5:10]) == events[5:10]
+    with pytest.raises(IndexError):
+        frame[20]
+
+
+def test_columns():
+    frame = EventFrame.from_json(
+        [
+            {
+                "id": 1,
+                "timestamp": "2024-01-01T00:00:00Z",
+                "duration": 1,
+                "data": {"a": "x"},
+            },
+            {
+                "timestamp": "2024-01-01T00:00:01.5+00:00",
+                "duration": 2,
+                "data": {"b": None},
+            },
+        ]
+    )
+    assert list(frame.ids) == [1, -1]
+    assert frame[1].id is None
+    assert frame.timestamps[1] - frame.timestamps[0] == 1_500_000_000
+    assert frame.data == {"a": ["x", MISSING], "b": [MISSING, None]}
+    assert frame.column("a") == ["x", None]
+    assert frame[1].data == {"b": None}
+    assert frame.total_duration == timedelta(seconds=3)
+
+
+def test_strings_interned():
+    frame = EventFrame.from_json(e.to_json_dict() for e in _events(10))
+    apps = [app for app in frame.data["app"] if app == "app1"]
+    assert len(apps) > 1
+    assert all(app is apps[0] for app in apps)
+
+
+@pytest.fixture
+def client(server, make_client):
+    client = make_client(server)
+    client.create_bucket("test", "test")
+    client.insert_events("test", _events(50))
+    yield client
+    client.disconnect()
+
+
+def test_get_events_as_frame(client):
+    frame = client.get_events("test", as_frame=True)
+    assert isinstance(frame, EventFrame)
+    assert frame.to_events() == client.get_events("test")
+
+
+def test_query_as_frame(client):
+    periods = [
+        (start, start + timedelta(seconds=25)),
+        (start, start + timedelta(hours=1)),
+    ]
+    result = client.query("RETURN = events;", periods)
+    frames = client.query("RETURN = events;", periods, as_frame=True)
+    assert [f.to_events() for f in frames] == [[Event(**e) for e in r] for r in result]
+
+
+def test_frames_from_query_items():
+    events = [e.to_json_dict() for e in _events(5)]
+    result = [
+        events,
+        [],
+        {},
+        {"events": events, "duration": 5.0, "empty": []},
+        ["a", "b"],
+        events[:2] + [1],
+        3,
+        None,
+    ]
+    items = iterparse([json.dumps(result).encode()], [ANY], [ANY, ANY], empty=True)
+    streamed = frames_from_query_items(items)
+    expected = frames_from_query_result(result)
+    assert [type(r) for r in streamed] == [type(r) for r in expected]
+    assert streamed[0].to_events() == expected[0].to_events()
+    assert len(streamed[1]) == 0 and streamed[2] == {}
+    assert streamed[3]["events"].to_events() == expected[3]["events"].to_events()
+    assert streamed[3]["duration"] == 5.0 and len(streamed[3]["empty"]) == 0
+    assert streamed[4:] == expected[4:]
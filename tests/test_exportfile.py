@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from click.testing import CliRunner
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient, EventFrame
+from aw_client.cli import main
+from aw_client.exportfile import format_of, load_export, write_export
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+formats = ["ndjson", "parquet", "arrow"]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StandInServer().start()
+    client = ActivityWatchClient("test-exportfile", host="127.0.0.1", port=server.port)
+    client.create_bucket("window", "currentwindow")
+    client.create_bucket("afk", "afkstatus")
+    client.create_bucket("empty", "test")
+    client.insert_events(
+        "window",
+        [
+            Event(
+                timestamp=start + timedelta(seconds=i),
+                duration=0.5,
+                data={"app": f"app{i % 3}", "title": "é" * (i % 4)},
+            )
+            for i in range(25)
+        ],
+    )
+    client.insert_events(
+        "afk",
+        [
+            Event(timestamp=start + timedelta(minutes=i), duration=60, data=data)
+            for i, data in enumerate([{"status": "afk"}, {"status": "not-afk"}, {}])
+        ],
+    )
+    client.disconnect()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server, make_client):
+    client = make_client(server)
+    yield client
+    client.disconnect()
+
+
+def _check_same(loaded: dict, export: dict) -> None:
+    assert list(loaded["buckets"]) == list(export["buckets"])
+    for bucket_id, bucket in export["buckets"].items():
+        events = bucket.pop("events")
+        frame = loaded["buckets"][bucket_id].pop("events")
+        assert isinstance(frame, EventFrame)
+        assert loaded["buckets"][bucket_id] == bucket
+        assert frame.to_events() == [Event(**e) for e in events]
+        assert list(frame.ids) == [e["id"] for e in events]
+
+
+@pytest.mark.parametrize("format", formats)
+@pytest.mark.parametrize("batch_size", [10_000, 7])
+def test_roundtrip(client, tmp_path, format, batch_size):
+    if format != "ndjson":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"export.{format}")
+    counts = client.export_to_file(path, batch_size=batch_size)
+    assert counts == {"window": 25, "afk": 3, "empty": 0}
+    _check_same(load_export(path), client.export_all())
+
+
+def test_bucket(client, tmp_path):
+    path = str(tmp_path / "export.jsonl")
+    assert client.export_to_file(path, bucket_id="afk") == {"afk": 3}
+    _check_same(load_export(path), client.export_bucket("afk"))
+
+
+def test_arrow_memory_mapped(client, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "export.arrow")
+    client.export_to_file(path)
+    frame = load_export(path)["buckets"]["window"]["events"]
+    # Views of the mapped file, not copies
+    assert isinstance(frame.timestamps, memoryview)
+    assert isinstance(frame.durations, memoryview)
+    assert frame.total_duration == timedelta(seconds=12.5)
+
+
+@pytest.mark.parametrize("format", formats)
+def test_failed_write(tmp_path, format):
+    if format != "ndjson":
+        pytest.importorskip("pyarrow")
+    path = tmp_path / f"export.{format}"
+    path.write_bytes(b"previous")
+
+    def items():
+        yield (
+            "a",
+            "events",
+            {"timestamp": start.isoformat(), "duration": 1, "data": {}},
+        )
+        raise ConnectionError("lost connection")
+
+    with pytest.raises(ConnectionError):
+        write_export(items(), str(path), batch_size=1)
+    # The partial file is deleted, and the previous one kept
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+    assert path.read_bytes() == b"previous"
+
+
+def test_multiple_buckets_per_batch(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    path = str(tmp_path / "export.arrow")
+    write_export(
+        [
+            (
+                "a",
+                "events",
+                {"timestamp": start.isoformat(), "duration": 1, "data": {}},
+            ),
+            (
+                "b",
+                "events",
+                {"timestamp": start.isoformat(), "duration": 2, "data": {}},
+            ),
+        ],
+        path,
+    )
+    # Rewrite as a single batch, as other tools might
+    table = pa.ipc.open_file(path).read_all().combine_chunks()
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+    loaded = load_export(path)
+    assert [len(b["events"]) for b in loaded["buckets"].values()] == [1, 1]
+    assert loaded["buckets"]["b"]["events"][0].duration == timedelta(seconds=2)
+
+
+def test_format_of():
+    assert format_of("a/b.PARQUET") == "parquet"
+    assert format_of("x.feather") == "arrow"
+    with pytest.raises(ValueError):
+        format_of("export.json")
+
+
+def test_cli(server, tmp_path):
+    path = str(tmp_path / "export.ndjson")
+    result = CliRunner().invoke(
+        main, ["--port", str(server.port), "export", path, "--bucket", "window"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Exported 25 events" in result.output
+    assert len(load_export(path)["buckets"]["window"]["events"]) == 25
@@ -0,0 +1,68 @@
+"""
+Checks what importing the CLI and the client costs, using `python -X importtime`.
+
+The CLI is run from shell scripts, so `aw-client --help` should only need click, and
+constructing a client shouldn't need the dependencies of queued requests or reports.
+The time budgets are generous, and are only meant to catch a heavy import being added.
+"""
+
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+
+def importtime(module: str) -> Dict[str, int]:
+    """Imports `module` in a new interpreter, returns the cumulative import time of each imported module in µs."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # import time: <self> | <cumulative> | <indented module name>
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module, budget_ms, deferred",
+    [
+        (
+            "aw_client.cli",
+            150,
+            [
+                "requests",
+                "persistqueue",
+                "aw_core",
+                "aw_transform",
+                "tabulate",
+                "zoneinfo",
+                "aw_client.client",
+                "aw_client.queries",
+            ],
+        ),
+        (
+            "aw_client.client",
+            400,
+            [
+                "persistqueue",
+                "aw_transform",
+                "tabulate",
+                "aw_client.queries",
+            ],
+        ),
+    ],
+)
+def test_importtime(module, budget_ms, deferred):
+    # Warm up the bytecode cache, so that compiling isn't measured
+    importtime(module)
+    times = importtime(module)
+    assert not [m for m in deferred if m in times]
+    assert times[module] / 1000 < budget_ms
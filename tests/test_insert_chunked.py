@@ -0,0 +1,171 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient, EventFrame
+from aw_client.client import ChunkResult, _retry_after
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class SlowInsertServer(StandInServer):
+    """Takes a while to insert every batch of events, so that concurrent uploads overlap."""
+
+    insert_delay = 0.05
+
+
+class FlakyServer(StandInServer):
+    """Fails the first attempt at inserting some of the chunks."""
+
+    def __init__(
+        self, fail_first: set, status: int = 500, headers: Optional[dict] = None
+    ) -> None:
+        super().__init__()
+        self.fail_first = fail_first
+        self.status = status
+        self.headers = headers or {}
+        self.failed: set = set()
+
+    def handle(self, method, parts, params, body):
+        if parts[-1:] == ["events"] and method == "POST":
+            first = body[0]["data"]["i"]
+            if first in self.fail_first and first not in self.failed:
+                self.failed.add(first)
+                return self.status, {"message": "failed"}, self.headers
+        return super().handle(method, parts, params, body)
+
+
+def _events(n: int) -> Iterator[Event]:
+    for i in range(n):
+        yield Event(timestamp=start + timedelta(seconds=i), duration=1, data={"i": i})
+
+
+@pytest.fixture
+def server_class():
+    return SlowInsertServer
+
+
+def _with_bucket(client: ActivityWatchClient) -> ActivityWatchClient:
+    client.create_bucket("test", "test")
+    return client
+
+
+def test_insert_chunked(server, make_client):
+    client = _with_bucket(make_client(server))
+    progress: List[ChunkResult] = []
+    results = client.insert_events_chunked(
+        "test", _events(1050), chunk_size=100, max_workers=3, progress=progress.append
+    )
+    client.disconnect()
+
+    assert [r.index for r in results] == list(range(11))
+    assert [r.first for r in results] == list(range(0, 1050, 100))
+    assert [r.count for r in results] == [100] * 10 + [50]
+    assert all(r.ok and r.attempts == 1 for r in results)
+    assert sorted(r.index for r in progress) == list(range(11))
+
+    inserted = sorted(e["data"]["i"] for e in server.events["test"])
+    assert inserted == list(range(1050))
+    # Uploads ran concurrently, but never more than max_workers at a time
+    assert server.max_inserts_in_flight == 3
+
+
+def test_insert_chunked_frame(server, make_client):
+    client = _with_bucket(make_client(server))
+    frame = EventFrame.from_events(_events(10))
+    results = client.insert_events_chunked("test", frame, chunk_size=4)
+    client.disconnect()
+    assert [r.count for r in results] == [4, 4, 2]
+    assert len(server.events["test"]) == 10
+
+
+def test_insert_chunked_retry(make_client):
+    server = FlakyServer({0, 20}).start()
+    client = _with_bucket(make_client(server))
+    results = client.insert_events_chunked(
+        "test", _events(30), chunk_size=10, retry_delay=0.01
+    )
+    client.disconnect()
+    server.stop()
+    assert [r.attempts for r in results] == [2, 1, 2]
+    assert all(r.ok for r in results)
+    assert len(server.events["test"]) == 30
+
+
+def test_insert_chunked_failed(make_client):
+    # Rejected chunks aren't retried, and don't stop the other chunks
+    server = FlakyServer({10}, status=400).start()
+    client = _with_bucket(make_client(server))
+    results = client.insert_events_chunked("test", _events(30), chunk_size=10)
+    client.disconnect()
+    server.stop()
+    assert [r.ok for r in results] == [True, False, True]
+    failed = results[1]
+    assert isinstance(failed, ChunkResult)
+    assert failed.attempts == 1
+    assert failed.error is not None
+    assert len(server.events["test"]) == 20
+
+
+@pytest.mark.parametrize("status", [408, 429])
+def test_insert_chunked_retry_after(status, make_client):
+    # Retried although a 4xx, after as long as the server asked for
+    server = FlakyServer({10}, status=status, headers={"Retry-After": "0.5"}).start()
+    client = _with_bucket(make_client(server))
+    t0 = time.perf_counter()
+    results = client.insert_events_chunked(
+        "test", _events(30), chunk_size=10, retry_delay=0.01
+    )
+    elapsed = time.perf_counter() - t0
+    client.disconnect()
+    server.stop()
+    assert [r.attempts for r in results] == [1, 2, 1]
+    assert all(r.ok for r in results)
+    assert len(server.events["test"]) == 30
+    assert elapsed >= 0.5
+
+
+def test_retry_after():
+    class Response:
+        def __init__(self, value):
+            self.headers = {"Retry-After": value} if value is not None else {}
+
+    assert _retry_after(None) is None
+    assert _retry_after(Response(None)) is None  # type: ignore
+    assert _retry_after(Response("3")) == 3  # type: ignore
+    assert _retry_after(Response("soon")) is None  # type: ignore
+    assert _retry_after(Response("Wed, 21 Oct 2015 07:28:00 GMT")) == 0  # type: ignore
+    later = datetime.now(timezone.utc) + timedelta(seconds=60)
+    http_date = later.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    assert 55 < _retry_after(Response(http_date)) <= 60  # type: ignore
+
+
+def _insert_threads() -> set:
+    return {t for t in threading.enumerate() if t.name.startswith("aw-client-insert")}
+
+
+def test_insert_chunked_reuses_pool(server, make_client):
+    client = _with_bucket(make_client(server))
+    client.insert_events_chunked("test", _events(100), chunk_size=10)
+    threads = _insert_threads()
+    connections = server.connection_count
+    for _ in range(10):
+        client.insert_events_chunked("test", _events(100), chunk_size=10)
+    # A pool per call opened new connections from new threads every time
+    assert len(threads) == 4 and _insert_threads() == threads
+    assert server.connection_count == connections
+    client.disconnect()
+    assert not _insert_threads()
+    assert len(server.events["test"]) == 1100
+
+
+def test_insert_chunked_invalid_chunk_size(server, make_client):
+    client = _with_bucket(make_client(server))
+    with pytest.raises(ValueError):
+        client.insert_events_chunked("test", _events(1), chunk_size=0)
+    client.disconnect()
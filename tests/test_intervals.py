@@ -0,0 +1,131 @@
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import aw_transform  # noqa: E402
+from aw_core.models import Event  # noqa: E402
+from aw_transform.filter_period_intersect import period_union  # noqa: E402
+
+from aw_client import EventFrame, intervals  # noqa: E402
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+us = timedelta(microseconds=1)
+
+
+def _events(n: int, seed: int, overlap: bool = False) -> List[Event]:
+    rng = random.Random(seed)
+    events = []
+    ts = start
+    for _ in range(n):
+        gap: float = rng.choice([0, 0, 1, 3, 7, 20])
+        if overlap and rng.random() < 0.1:
+            gap = -0.05
+        ts += timedelta(seconds=gap)
+        duration = timedelta(seconds=rng.choice([1, 2, 5, 30]))
+        app = rng.choice(["a", "b", "c"])
+        events.append(Event(timestamp=ts, duration=duration, data={"app": app}))
+        ts += duration
+    return events
+
+
+def _canonical(events: Iterable[Event]) -> List[tuple]:
+    """Merges touching events with equal data, like intervals.flood does."""
+    result: List[list] = []
+    for e in sorted(events, key=lambda e: e.timestamp):
+        end = e.timestamp + e.duration
+        if result and result[-1][2] == e.data and result[-1][1] >= e.timestamp - us:
+            result[-1][1] = max(result[-1][1], end)
+        else:
+            result.append([e.timestamp, end, e.data])
+    return [tuple(r) for r in result]
+
+
+def _assert_periods_equal(frame: EventFrame, events: List[Event]) -> None:
+    assert len(frame) == len(events)
+    for a, b in zip(sorted(frame, key=lambda e: e.timestamp), events):
+        assert abs(a.timestamp - b.timestamp) <= us
+        assert abs(a.duration - b.duration) <= us
+        assert a.data == b.data
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("pulsetime", [0, 2, 5, 60])
+@pytest.mark.parametrize("overlap", [False, True])
+def test_flood(seed, pulsetime, overlap):
+    events = _events(200, seed, overlap)
+    random.Random(seed).shuffle(events)
+    expected = _canonical(aw_transform.flood(events, pulsetime))
+    result = _canonical(intervals.flood(EventFrame.from_events(events), pulsetime))
+    assert len(result) == len(expected)
+    for (s1, e1, d1), (s2, e2, d2) in zip(result, expected):
+        assert abs(s1 - s2) <= us and abs(e1 - e2) <= us and d1 == d2
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_period_union(seed):
+    events1, events2 = _events(100, seed), _events(100, seed + 100)
+    frame = intervals.period_union(
+        EventFrame.from_events(events1), EventFrame.from_events(events2)
+    )
+    _assert_periods_equal(frame, period_union(events1, events2))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_filter_period_intersect(seed):
+    events, filter_events = _events(100, seed), _events(100, seed + 100)
+    frame = intervals.filter_period_intersect(
+        EventFrame.from_events(events), EventFrame.from_events(filter_events)
+    )
+    expected = aw_transform.filter_period_intersect(events, filter_events)
+    _assert_periods_equal(frame, [e for e in expected if e.duration])
+
+
+def test_period_intersect():
+    frame1 = EventFrame.from_events(
+        [
+            Event(timestamp=start, duration=10),
+            Event(timestamp=start + timedelta(seconds=5), duration=10),
+        ]
+    )
+    frame2 = EventFrame.from_events(
+        [
+            Event(timestamp=start + timedelta(seconds=12), duration=10),
+            Event(timestamp=start - timedelta(seconds=5), duration=7),
+        ]
+    )
+    result = intervals.period_intersect(frame1, frame2)
+    assert [(e.timestamp - start, e.duration) for e in result] == [
+        (timedelta(0), timedelta(seconds=2)),
+        (timedelta(seconds=12), timedelta(seconds=3)),
+    ]
+
+
+def test_merge_events_by_keys():
+    events = _events(100, 0)
+    for i, e in enumerate(events):
+        e.data["$category"] = ["Work", "Programming"] if i % 2 else ["Comms"]
+    keys = ["app", "$category"]
+    result = intervals.merge_events_by_keys(EventFrame.from_events(events), keys)
+    expected = aw_transform.merge_events_by_keys(events, keys)
+    _assert_periods_equal(result, expected)
+    assert [e.data for e in result] == [e.data for e in expected]
+
+
+def test_sum_durations():
+    events = _events(100, 0)
+    assert intervals.sum_durations(
+        EventFrame.from_events(events)
+    ) == aw_transform.sum_durations(events)
+
+
+def test_empty():
+    empty = EventFrame()
+    assert len(intervals.flood(empty)) == 0
+    assert len(intervals.period_union(empty, empty)) == 0
+    assert len(intervals.filter_period_intersect(empty, empty)) == 0
+    assert len(intervals.merge_events_by_keys(empty, ["app"])) == 0
+    assert intervals.sum_durations(empty) == timedelta(0)
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer, _parse_dt
+
+from aw_client import ActivityWatchClient
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class CroppingServer(StandInServer):
+    """Crops events to the requested range, like aw-server-rust does."""
+
+    def _get_events(self, bucket_id, params):
+        events = [dict(e) for e in self.events[bucket_id]]
+        if "start" in params:
+            start = _parse_dt(params["start"])
+            events = [
+                e
+                for e in events
+                if _parse_dt(e["timestamp"]) + timedelta(seconds=e["duration"]) >= start
+            ]
+        if "end" in params:
+            end = _parse_dt(params["end"])
+            events = [e for e in events if _parse_dt(e["timestamp"]) <= end]
+            for e in events:
+                ts = _parse_dt(e["timestamp"])
+                if ts + timedelta(seconds=e["duration"]) > end:
+                    e["duration"] = (end - ts).total_seconds()
+        events = sorted(events, key=lambda e: _parse_dt(e["timestamp"]), reverse=True)
+        limit = int(params.get("limit", -1))
+        return events[:limit] if limit >= 0 else events
+
+
+@pytest.fixture(params=[StandInServer, CroppingServer])
+def client(request):
+    server = request.param().start()
+    client = ActivityWatchClient("test-iter-events", host="127.0.0.1", port=server.port)
+    client.create_bucket("test", "test")
+
+    events = []
+    for i in range(100):
+        # Contiguous events, with a couple of runs of events sharing a timestamp
+        ts = start + timedelta(seconds=10 * i if i < 40 or i > 60 else 400)
+        events.append(Event(timestamp=ts, duration=10, data={"i": i}))
+    client.insert_events("test", events)
+
+    yield client
+    client.disconnect()
+    server.stop()
+
+
+@pytest.mark.parametrize("page_size", [1, 7, 10, 1000])
+def test_iter_events_matches_get_events(client, page_size):
+    expected = client.get_events("test")
+    events = list(client.iter_events("test", page_size=page_size))
+    assert sorted(e.data["i"] for e in events) == list(range(100))
+    assert sorted(events, key=lambda e: e.data["i"]) == sorted(
+        expected, key=lambda e: e.data["i"]
+    )
+
+
+def test_iter_events_range(client):
+    range_start = start + timedelta(seconds=205)
+    range_end = start + timedelta(seconds=805)
+    expected = client.get_events("test", start=range_start, end=range_end)
+    events = list(client.iter_events("test", range_start, range_end, page_size=3))
+    key = lambda e: e.data["i"]  # noqa: E731
+    assert sorted(events, key=key) == sorted(expected, key=key)
@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+
+from aw_client import jsoncodec
+
+backends = ["json"] + (["orjson"] if jsoncodec.orjson is not None else [])
+
+
+@pytest.fixture(params=backends)
+def backend(request):
+    jsoncodec.set_backend(request.param)
+    yield request.param
+    jsoncodec.set_backend(None)
+
+
+def _events():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        Event(timestamp=start, duration=0, data={}),
+        Event(
+            id=3,
+            timestamp=start + timedelta(seconds=1.5),
+            duration=timedelta(seconds=2.25),
+            data={"app": "Firefox", "title": "héllo 😀", "audible": True, "n": 0.1},
+        ),
+        Event(
+            timestamp=datetime(2024, 6, 1, 12, tzinfo=timezone(timedelta(hours=2))),
+            duration=60,
+            data={"nested": {"list": [1, None, "x"]}},
+        ),
+    ]
+
+
+def test_same_as_to_json_dict(backend):
+    events = _events()
+    expected = [e.to_json_dict() for e in events]
+    assert json.loads(jsoncodec.dumps(events)) == expected
+    assert jsoncodec.loads(jsoncodec.dumps(events)) == expected
+    assert [Event(**e) for e in jsoncodec.loads(jsoncodec.dumps(events))] == events
+
+
+def test_plain_values(backend):
+    value = {"a": [1, 2.5, None, True], "b": "ö", "td": timedelta(minutes=1)}
+    assert jsoncodec.loads(jsoncodec.dumps(value)) == dict(value, td=60.0)
+    assert jsoncodec.loads(jsoncodec.dumps(value).decode("utf8")) == dict(
+        value, td=60.0
+    )
+    # Not supported by orjson, so encoded by the standard library
+    assert jsoncodec.loads(jsoncodec.dumps({1: 2**70})) == {"1": 2**70}
+    with pytest.raises(TypeError):
+        jsoncodec.dumps(object())
+
+
+def test_set_backend():
+    with pytest.raises(ValueError):
+        jsoncodec.set_backend("simplejson")
+    jsoncodec.set_backend("json")
+    assert jsoncodec.backend == "json"
+    jsoncodec.set_backend(None)
+    assert jsoncodec.backend == backends[-1]
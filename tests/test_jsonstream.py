@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.jsonstream import ANY, iterparse
+
+
+def _chunks(s: str, size: int):
+    b = s.encode("utf8")
+    return (b[i : i + size] for i in range(0, len(b), size))
+
+
+doc = {
+    "buckets": {
+        "a": {"id": "a", "type": "x", "events": [{"n": 1.5e3}, {"n": "åäö"}, {}]},
+        "b": {"events": [], "last": [1, 2, {"c": None}]},
+    },
+    "other": [True, False, -12],
+}
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_iterparse(size):
+    s = json.dumps(doc, indent=1)
+    events = list(iterparse(_chunks(s, size), ["buckets", ANY, "events", ANY]))
+    assert events == [
+        (("buckets", "a", "events", 0), {"n": 1500.0}),
+        (("buckets", "a", "events", 1), {"n": "åäö"}),
+        (("buckets", "a", "events", 2), {}),
+    ]
+
+    items = list(
+        iterparse(
+            _chunks(s, size),
+            ["buckets", ANY, ANY],
+            ["buckets", ANY, "events", ANY],
+            ["other", 2],
+        )
+    )
+    assert [path for path, _ in items] == [
+        ("buckets", "a", "id"),
+        ("buckets", "a", "type"),
+        ("buckets", "a", "events", 0),
+        ("buckets", "a", "events", 1),
+        ("buckets", "a", "events", 2),
+        ("buckets", "b", "last"),
+        ("other", 2),
+    ]
+    assert items[-1][1] == -12
+
+    # The root matches the empty path
+    assert list(iterparse(_chunks(s, size), [])) == [((), doc)]
+
+    # Empty containers on a path, that are skipped when descending, unless asked for
+    paths = [["buckets", ANY, ANY], ["buckets", ANY, "events", ANY]]
+    items = list(iterparse(_chunks(s, size), *paths, empty=True))
+    assert (("buckets", "b", "events"), []) in items
+    assert len(items) == len(list(iterparse(_chunks(s, size), *paths))) + 1
+
+
+def test_iterparse_invalid():
+    with pytest.raises(json.JSONDecodeError):
+        list(iterparse(_chunks('{"a": [1, 2', 3), ["a", ANY]))
+    with pytest.raises(json.JSONDecodeError):
+        list(iterparse(_chunks("[1] 2", 3), [ANY]))
+
+
+def test_stream_methods():
+    server = StandInServer().start()
+    client = ActivityWatchClient("test-jsonstream", host="127.0.0.1", port=server.port)
+    now = datetime.now(timezone.utc)
+    events = [
+        Event(timestamp=now - timedelta(minutes=i), duration=30, data={"i": i})
+        for i in range(500)
+    ]
+    for bucket_id in ["a", "b"]:
+        client.create_bucket(bucket_id, "test")
+        client.insert_events(bucket_id, events)
+
+    assert list(client.stream_events("a")) == client.get_events("a")
+
+    exported = client.export_all()
+    streamed: dict = {}
+    for bid, key, value in client.stream_export():
+        bucket = streamed.setdefault(bid, {"events": []})
+        if key == "events":
+            bucket["events"].append(value)
+        else:
+            bucket[key] = value
+    assert streamed == exported["buckets"]
+    assert {bid for bid, _, _ in client.stream_export("b")} == {"b"}
+
+    timeperiods = [
+        (now - timedelta(hours=i + 1), now - timedelta(hours=i)) for i in range(3)
+    ]
+    assert list(client.stream_query("", timeperiods)) == client.query("", timeperiods)
+
+    client.disconnect()
+    server.stop()
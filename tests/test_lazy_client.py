@@ -0,0 +1,72 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from aw_core import dirs
+from aw_core.models import Event
+
+from aw_client import ActivityWatchClient, config, singleinstance
+
+
+def _queue_path(client: ActivityWatchClient) -> str:
+    return os.path.join(
+        # Looked up on each call, as the data dir of each test is a temporary dir
+        dirs.get_data_dir("aw-client"),
+        "queued",
+        f"{client.client_name}{'-testing' if client.testing else ''}.v2.log",
+    )
+
+
+def _lock_path(client: ActivityWatchClient) -> str:
+    return os.path.join(
+        singleinstance.get_cache_dir("client_locks"), client._instance_name
+    )
+
+
+def test_queue_created_on_first_use(server, make_client):
+    client = make_client(server)
+    client.connect()
+    assert not os.path.exists(_queue_path(client))
+    assert not os.path.exists(_lock_path(client))
+
+    # Unqueued requests don't need the queue
+    client.create_bucket("test-lazy", "test")
+    client.heartbeat("test-lazy", Event(data={"n": 0}), pulsetime=0)
+    assert client._request_queue is None
+    assert not os.path.exists(_queue_path(client))
+
+    client.create_bucket("test-lazy-queued", "test", queued=True)
+    assert os.path.exists(_queue_path(client))
+    assert os.path.exists(_lock_path(client))
+    # Started since the client is connected
+    assert client.request_queue.is_alive()
+
+    # The first heartbeat is held back to be pre-merged, the second one sends it
+    now = datetime.now(timezone.utc)
+    for n in range(2):
+        client.heartbeat(
+            "test-lazy-queued",
+            Event(timestamp=now, data={"n": n}),
+            pulsetime=0,
+            queued=True,
+        )
+    for _ in range(50):
+        if len(server.events.get("test-lazy-queued", [])) == 1:
+            break
+        time.sleep(0.1)
+    assert len(server.events["test-lazy-queued"]) == 1
+
+    client.disconnect()
+    assert client._request_queue is None
+
+
+def test_config_cached_until_modified():
+    path = os.path.join(dirs.get_config_dir("aw-client"), "aw-client.toml")
+    first = config.load_config()
+    assert config.load_config() is first
+
+    # Touching the file, as an edit would, invalidates the cache
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert config.load_config() is not first
+    assert config.load_config() == first
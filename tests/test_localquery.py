@@ -0,0 +1,230 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import aw_query
+import pytest
+from aw_core.models import Event
+from aw_datastore import Datastore, storages
+
+from aw_client import queries
+from aw_client.classes import default_classes
+from aw_client.localquery import LocalQueryEngine
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+apps = ["Firefox", "vim", "Slack", "Google Chrome"]
+titles = ["GitHub - aw-client", "YouTube", "notes", "reddit"]
+
+
+def _generate(rng: random.Random, n: int, data) -> list:
+    events = []
+    ts = start
+    for _ in range(n):
+        ts += timedelta(seconds=rng.choice([0, 0, 1, 5, 30]))
+        duration = timedelta(seconds=rng.choice([1, 2, 10, 60]))
+        events.append(Event(timestamp=ts, duration=duration, data=data()))
+        ts += duration
+    return events
+
+
+@pytest.fixture(scope="module")
+def buckets() -> dict:
+    rng = random.Random(0)
+    return {
+        "aw-watcher-window_host": (
+            "currentwindow",
+            _generate(
+                rng,
+                300,
+                lambda: {"app": rng.choice(apps), "title": rng.choice(titles)},
+            ),
+        ),
+        "aw-watcher-afk_host": (
+            "afkstatus",
+            _generate(
+                rng, 40, lambda: {"status": rng.choice(["afk", "not-afk", "not-afk"])}
+            ),
+        ),
+        "aw-watcher-web-chrome_host": (
+            "web.tab.current",
+            _generate(
+                rng,
+                100,
+                lambda: {
+                    "url": rng.choice(["https://github.com/", "https://youtube.com/"]),
+                    "title": rng.choice(titles),
+                    "audible": rng.random() < 0.2,
+                },
+            ),
+        ),
+    }
+
+
+@pytest.fixture(scope="module")
+def datastore(buckets) -> Datastore:
+    ds = Datastore(storages.MemoryStorage, testing=True)
+    for bid, (type, events) in buckets.items():
+        ds.create_bucket(bid, type, "test", "host").insert(events)
+    return ds
+
+
+@pytest.fixture(scope="module")
+def export(datastore) -> dict:
+    return {
+        "buckets": {
+            bid: {
+                **datastore[bid].metadata(),
+                "events": [e.to_json_dict() for e in datastore[bid].get(limit=-1)],
+            }
+            for bid in datastore.buckets()
+        }
+    }
+
+
+def _desktop_query() -> str:
+    return queries.fullDesktopQuery(
+        queries.DesktopQueryParams(
+            bid_window="aw-watcher-window_host",
+            bid_afk="aw-watcher-afk_host",
+            bid_browsers=["aw-watcher-web-chrome_host"],
+            classes=default_classes,
+            always_active_pattern="YouTube",
+        )
+    )
+
+
+test_queries = [
+    'RETURN = query_bucket("aw-watcher-window_host");',
+    'RETURN = sort_by_duration(merge_events_by_keys(flood(query_bucket("aw-watcher-window_host")), ["app"]));',
+    """
+    events = flood(query_bucket("aw-watcher-window_host"));
+    afk = flood(query_bucket("aw-watcher-afk_host"));
+    afk = filter_keyvals(afk, "status", ["not-afk"]);
+    events = filter_period_intersect(events, afk);
+    events = filter_keyvals_regex(events, "title", "GitHub|notes");
+    RETURN = {"duration": sum_durations(events), "events": limit_events(sort_by_duration(events), 5)};
+    """,
+    _desktop_query(),
+]
+
+
+def _server_json(result):
+    # The server serializes events like this
+    if isinstance(result, list):
+        return [_server_json(v) for v in result]
+    if isinstance(result, dict) and "timestamp" in result and "data" in result:
+        return Event(**result).to_json_dict()
+    if isinstance(result, dict):
+        return {k: _server_json(v) for k, v in result.items()}
+    if isinstance(result, timedelta):
+        return result.total_seconds()
+    return result
+
+
+@pytest.mark.parametrize("query", test_queries)
+def test_same_as_aw_query(datastore, export, query):
+    # A timeperiod containing all events, since MemoryStorage doesn't trim events
+    timeperiod = (start, start + timedelta(days=1))
+    expected = _server_json(aw_query.query("test", query, *timeperiod, datastore))
+    engine = LocalQueryEngine.from_export(export)
+    assert engine.query(query, [timeperiod]) == [expected]
+
+
+def test_trimmed_to_timeperiod(export):
+    engine = LocalQueryEngine.from_export(export)
+    events = export["buckets"]["aw-watcher-window_host"]["events"]
+    # Events are exported newest first
+    first = Event(**events[-1])
+    timeperiod = (first.timestamp + first.duration / 2, start + timedelta(days=1))
+    result = engine.query(test_queries[0], [timeperiod])
+    last = Event(**result[0][-1])
+    assert last.timestamp == timeperiod[0]
+    assert last.duration == first.duration / 2
+    assert len(result[0]) == len(events)
+
+
+def test_parallel(export):
+    timeperiods = [
+        (start + timedelta(hours=h), start + timedelta(hours=h + 1)) for h in range(4)
+    ]
+    engine = LocalQueryEngine.from_export(export)
+    try:
+        query = _desktop_query()
+        assert engine.query(query, timeperiods, max_workers=2) == engine.query(
+            query, timeperiods
+        )
+    finally:
+        engine.close()
+
+
+def test_parallel_pools(export):
+    timeperiods = [
+        (start + timedelta(hours=h), start + timedelta(hours=h + 1)) for h in range(4)
+    ]
+    engine = LocalQueryEngine.from_export(export)
+    try:
+        query = 'RETURN = query_bucket("added");'
+        with pytest.raises(ValueError):
+            engine.query(query, timeperiods, max_workers=2)
+        pool = engine._pools[2]
+        engine.query(_desktop_query(), timeperiods, max_workers=3)
+        # Pools of different sizes are kept side by side
+        assert engine._pools[2] is pool
+
+        # Seen by the workers once added
+        engine.add_bucket(
+            {
+                "id": "added",
+                "type": "test",
+                "events": [{"timestamp": start.isoformat(), "duration": 1, "data": {}}],
+            }
+        )
+        assert engine.query(query, timeperiods, max_workers=2) == engine.query(
+            query, timeperiods
+        )
+        assert [len(r) for r in engine.query(query, timeperiods, max_workers=3)] == [
+            1,
+            0,
+            0,
+            0,
+        ]
+    finally:
+        engine.close()
+
+
+def test_vectorized(export):
+    pytest.importorskip("numpy")
+    timeperiod = (start, start + timedelta(days=1))
+    # Touching events aren't always merged the same way, so compare merged events
+    query = test_queries[2].replace(
+        "sort_by_duration(events)",
+        'sort_by_duration(merge_events_by_keys(events, ["app", "title"]))',
+    )
+    expected = LocalQueryEngine.from_export(export).query(query, [timeperiod])[0]
+    result = LocalQueryEngine.from_export(export, vectorized=True).query(
+        query, [timeperiod]
+    )[0]
+    assert result["duration"] == pytest.approx(expected["duration"], abs=1e-3)
+    assert [e["duration"] for e in result["events"]] == pytest.approx(
+        [e["duration"] for e in expected["events"]], abs=1e-3
+    )
+
+    engine = LocalQueryEngine.from_export(export, vectorized=True)
+    frames = engine.query(test_queries[0], [timeperiod], as_frame=True)
+    assert len(frames[0]) == len(export["buckets"]["aw-watcher-window_host"]["events"])
+
+
+@pytest.mark.parametrize(
+    "query, error",
+    [
+        ("RETURN = ", ValueError),
+        ('RETURN = "unterminated;', ValueError),
+        ("events = nop();", ValueError),
+        ("RETURN = no_such_function();", ValueError),
+        ('RETURN = query_bucket("missing");', ValueError),
+        ("RETURN = sort_by_duration();", TypeError),
+    ],
+)
+def test_errors(export, query, error):
+    engine = LocalQueryEngine.from_export(export)
+    with pytest.raises(error):
+        engine.query(query, [(start, start + timedelta(days=1))])
@@ -0,0 +1,198 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+import pytest
+from aw_core.models import Event
+from aw_transform.heartbeats import heartbeat_merge
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.premerge import HeartbeatPremerger
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _server_merge(heartbeats: List[Tuple[str, str, dict]]) -> Dict[str, List[Event]]:
+    """The events a server ends up with after receiving heartbeats, as (bucket, endpoint, event)."""
+    events: Dict[str, List[Event]] = {}
+    for bucket_id, endpoint, event in heartbeats:
+        pulsetime = float(parse_qs(endpoint.partition("?")[2])["pulsetime"][0])
+        bucket_events = events.setdefault(bucket_id, [])
+        heartbeat = Event(**event)
+        if not bucket_events or not heartbeat_merge(
+            bucket_events[-1], heartbeat, pulsetime
+        ):
+            bucket_events.append(heartbeat)
+    return events
+
+
+def _heartbeats(rng: random.Random, n: int) -> List[Tuple[str, str, dict]]:
+    heartbeats = []
+    ts = {"a": start, "b": start}
+    for _ in range(n):
+        bucket_id = rng.choice(["a", "b"])
+        ts[bucket_id] += timedelta(seconds=rng.choice([0, 1, 1, 1, 2, 10]))
+        event = Event(
+            timestamp=ts[bucket_id],
+            duration=rng.choice([0, 0, 1]),
+            data={"app": rng.choice(["x", "x", "x", "y"])},
+        )
+        pulsetime = rng.choice([2, 2, 5])
+        endpoint = f"buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}"
+        heartbeats.append((bucket_id, endpoint, event.to_json_dict()))
+    return heartbeats
+
+
+@pytest.mark.parametrize("commit_interval", [5, 10**6])
+def test_same_as_server(commit_interval):
+    heartbeats = _heartbeats(random.Random(commit_interval), 2000)
+    committed: List[Tuple[str, str, dict]] = []
+    premerger = HeartbeatPremerger(
+        lambda endpoint, data: committed.append(
+            (endpoint.split("/")[1], endpoint, data)
+        )
+    )
+    for bucket_id, endpoint, event in heartbeats:
+        e = Event(**event)
+        pulsetime = float(endpoint.rpartition("=")[2])
+        premerger.add(
+            bucket_id,
+            endpoint,
+            e.timestamp,
+            e.duration,
+            e.data,
+            pulsetime,
+            commit_interval,
+        )
+    premerger.close()
+    assert _server_merge(committed) == _server_merge(heartbeats)
+    assert premerger.heartbeats == len(heartbeats)
+    assert premerger.commits == len(committed) < len(heartbeats) / 2
+
+
+def test_timer_flush():
+    committed: List[dict] = []
+    premerger = HeartbeatPremerger(lambda endpoint, data: committed.append(data))
+    endpoint = "buckets/a/heartbeat?pulsetime=5"
+    for i in range(3):
+        premerger.add(
+            "a",
+            endpoint,
+            start + timedelta(seconds=i * 0.05),
+            timedelta(0),
+            {"app": "x"},
+            5,
+            0.2,
+        )
+    time.sleep(0.5)
+    assert committed == [
+        {"timestamp": start.isoformat(), "duration": 0.1, "data": {"app": "x"}}
+    ]
+    assert premerger.timed_commits == 1
+    assert 0.2 <= premerger.max_staleness < 0.4
+
+    # Nothing new to commit, the heartbeat changing the data starts a new event
+    premerger.add("a", endpoint, start + timedelta(seconds=3), timedelta(0), {}, 5, 0.2)
+    assert len(committed) == 1
+    # Merged heartbeats continue from the end of the committed event
+    premerger.add(
+        "a", endpoint, start + timedelta(seconds=3), timedelta(0), {"app": "x"}, 5, 0.2
+    )
+    premerger.close()
+    assert [c["data"] for c in committed] == [{"app": "x"}, {}, {"app": "x"}]
+    assert premerger.commits == 3
+
+
+def test_failed_commit_kept():
+    committed: List[dict] = []
+    failures = [1]
+
+    def commit(endpoint, data):
+        if failures:
+            failures.pop()
+            raise OSError("queue unavailable")
+        committed.append(data)
+
+    premerger = HeartbeatPremerger(commit)
+    endpoint = "buckets/a/heartbeat?pulsetime=5"
+    premerger.add("a", endpoint, start, timedelta(0), {"app": "x"}, 5, 0.1)
+    # The first timed commit fails, and is retried after another interval
+    time.sleep(0.35)
+    assert committed == [
+        {"timestamp": start.isoformat(), "duration": 0.0, "data": {"app": "x"}}
+    ]
+    assert premerger.commits == premerger.timed_commits == 1
+
+    premerger.add(
+        "a", endpoint, start + timedelta(seconds=1), timedelta(0), {"app": "x"}, 5, 10
+    )
+    failures.append(1)
+    with pytest.raises(OSError):
+        premerger.flush()
+    # Not lost, committed by the next flush
+    assert premerger.flush() == 1
+    premerger.close()
+    assert committed[-1]["duration"] == 1.0
+    assert premerger.commits == 2
+
+
+def _client(server: StandInServer, name: str) -> ActivityWatchClient:
+    client = ActivityWatchClient(name, host="127.0.0.1", port=server.port)
+    client.create_bucket("test-premerge", "test", queued=True)
+    client.connect()
+    return client
+
+
+def _wait_for_events(server: StandInServer, n: int) -> List[dict]:
+    for _ in range(50):
+        if len(server.events.get("test-premerge", [])) >= n:
+            break
+        time.sleep(0.1)
+    return server.events.get("test-premerge", [])
+
+
+def test_quiet_watcher():
+    server = StandInServer().start()
+    client = _client(server, "test-premerge")
+    now = datetime.now(timezone.utc)
+    for i in range(3):
+        client.heartbeat_raw(
+            "test-premerge",
+            {"app": "x"},
+            pulsetime=5,
+            timestamp=now + timedelta(seconds=i * 0.05),
+            commit_interval=0.3,
+        )
+    # Sent by the timer, without another heartbeat
+    events = _wait_for_events(server, 1)
+    assert [(e["duration"], e["data"]) for e in events] == [(0.1, {"app": "x"})]
+    assert client.premerge.stats["timed_commits"] == 1
+    client.disconnect()
+    server.stop()
+
+
+def test_flush_on_disconnect():
+    server = StandInServer().start()
+    name = "test-premerge"
+    client = _client(server, name)
+    now = datetime.now(timezone.utc)
+    for i in range(3):
+        client.heartbeat(
+            "test-premerge",
+            Event(timestamp=now + timedelta(seconds=i), data={"app": "x"}),
+            pulsetime=5,
+            queued=True,
+        )
+    assert client.last_heartbeat["test-premerge"].duration == timedelta(seconds=2)
+    client.disconnect()
+    assert server.events["test-premerge"] == []
+
+    # Queued on disconnect, and sent once the queue runs again
+    client = _client(server, name)
+    events = _wait_for_events(server, 1)
+    assert [(e["duration"], e["data"]) for e in events] == [(2.0, {"app": "x"})]
+    client.disconnect()
+    server.stop()
@@ -0,0 +1,105 @@
+import copy
+
+import pytest
+
+from aw_client.classes import default_classes
+from aw_client.queries import (
+    AndroidQueryParams,
+    DesktopQueryParams,
+    QueryBuilder,
+    _freeze_classes,
+    _frozen_classes,
+    canonicalEvents,
+    fullDesktopQuery,
+)
+
+
+def _params(**kwargs) -> DesktopQueryParams:
+    return DesktopQueryParams(
+        bid_window='aw-watcher-window_"host"',
+        bid_afk="aw-watcher-afk_host",
+        bid_browsers=["aw-watcher-web-firefox_host"],
+        classes=copy.deepcopy(default_classes),
+        **kwargs,
+    )
+
+
+def test_params_not_mutated():
+    params = _params(filter_classes=[["Work"]])
+    before = copy.deepcopy(params)
+    fullDesktopQuery(params)
+    canonicalEvents(params)
+    assert params == before
+
+
+def test_builder_hashable():
+    a = QueryBuilder.from_params(_params())
+    b = QueryBuilder.from_params(_params())
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a != QueryBuilder.from_params(_params(filter_afk=False))
+
+
+def test_query_built_once():
+    first = fullDesktopQuery(_params())
+    # Memoized, so the very same string is returned
+    assert fullDesktopQuery(_params()) is first
+    assert QueryBuilder.from_params(_params()).full_desktop_query() is first
+    assert canonicalEvents(_params()) in first
+
+
+def test_classes_changed_in_place():
+    params = _params()
+    before = canonicalEvents(params)
+    params.classes[0][1]["regex"] = "Changed"
+    after = canonicalEvents(params)
+    assert before != after
+    assert '"regex": "Changed"' in after
+
+
+def test_equal_classes_frozen_once():
+    # A new list on every call, as returned by get_classes
+    first = _freeze_classes(copy.deepcopy(default_classes))
+    size = len(_frozen_classes)
+    for _ in range(100):
+        assert _freeze_classes(copy.deepcopy(default_classes)) is first
+    assert len(_frozen_classes) == size
+
+
+def test_same_classes_not_dumped(monkeypatch):
+    classes = copy.deepcopy(default_classes)
+    first = _freeze_classes(classes)
+
+    def dumps(*args, **kwargs):
+        raise AssertionError("dumped again")
+
+    monkeypatch.setattr("aw_client.queries.json.dumps", dumps)
+    assert _freeze_classes(classes) is first
+    # Still noticed when changed in place
+    classes[0][1]["regex"] = "Changed"
+    with pytest.raises(AssertionError):
+        _freeze_classes(classes)
+
+
+def test_classes_rendering():
+    classes = [
+        (["A"], {"type": "regex", "regex": "a\\\\w+", "ignore_case": True}),
+        (["B"], {"type": "regex", "regex": "b", "ignore_case": 1}),
+    ]
+    query = canonicalEvents(AndroidQueryParams(bid_android="android", classes=classes))
+    # Escaped backslashes are unescaped, and equal values of different types are kept apart
+    assert (
+        'events = categorize(events, [[["A"], {"type": "regex", "regex": "a\\\\w+", "ignore_case": true}], '
+        '[["B"], {"type": "regex", "regex": "b", "ignore_case": 1}]]);'
+    ) in query
+    assert 'merge_events_by_keys(events, ["app"])' in query
+
+
+def test_equal_values_kept_apart():
+    def query(ignore_case) -> str:
+        classes = [(["A"], {"type": "regex", "regex": "a", "ignore_case": ignore_case})]
+        return canonicalEvents(DesktopQueryParams("window", "afk", classes=classes))
+
+    assert '"ignore_case": true' in query(True)
+    assert '"ignore_case": 1}' in query(1)
+    assert '"ignore_case": 1.0' in query(1.0)
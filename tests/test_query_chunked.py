@@ -0,0 +1,107 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client.client import merge_query_results, split_timeperiods
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+td1h = timedelta(hours=1)
+
+
+class SlowQueryServer(StandInServer):
+    """Takes a while to evaluate every timeperiod, like a real server on large buckets."""
+
+    query_delay = 0.2
+
+
+@pytest.fixture
+def server_class():
+    return SlowQueryServer
+
+
+@pytest.fixture
+def client(server, make_client):
+    client = make_client(server)
+    client.create_bucket("test", "test")
+    client.insert_events(
+        "test",
+        [
+            Event(timestamp=start + i * timedelta(minutes=11), duration=1)
+            for i in range(48)
+        ],
+    )
+    yield client
+    client.disconnect()
+
+
+def test_split_timeperiods():
+    assert split_timeperiods([(start, start + td1h)], None) == [[(start, start + td1h)]]
+    assert split_timeperiods([(start, start + 2.5 * td1h)], td1h) == [
+        [
+            (start, start + td1h),
+            (start + td1h, start + 2 * td1h),
+            (start + 2 * td1h, start + 2.5 * td1h),
+        ]
+    ]
+    with pytest.raises(ValueError):
+        split_timeperiods([(start, start + td1h)], timedelta(0))
+
+
+def test_merge_query_results():
+    assert merge_query_results([[1, 2], [3]]) == [1, 2, 3]
+    assert merge_query_results([{"a": [1], "b": 2}, {"a": [3], "b": 4}]) == {
+        "a": [1, 3],
+        "b": 6,
+    }
+
+
+def test_query_chunked_in_order_and_concurrent(client):
+    timeperiods = [(start + i * td1h, start + (i + 1) * td1h) for i in range(8)]
+    expected = [client.query("RETURN = events;", [tp])[0] for tp in timeperiods]
+
+    t0 = time.perf_counter()
+    result = client.query_chunked("RETURN = events;", timeperiods, max_workers=4)
+    elapsed = time.perf_counter() - t0
+
+    assert result == expected
+    # 8 periods of 0.2s each, 4 at a time
+    assert elapsed < 8 * SlowQueryServer.query_delay * 0.75
+
+
+def test_query_chunked_reducer(client):
+    timeperiods = [(start, start + 4 * td1h), (start + 4 * td1h, start + 8 * td1h)]
+    expected = client.query("RETURN = events;", timeperiods)
+    result = client.query_chunked(
+        "RETURN = events;",
+        timeperiods,
+        chunk=td1h,
+        reducer=merge_query_results,
+    )
+    key = lambda e: e["timestamp"]  # noqa: E731
+    assert [sorted(r, key=key) for r in result] == [
+        sorted(r, key=key) for r in expected
+    ]
+
+    frames = client.query_chunked(
+        "RETURN = events;",
+        timeperiods,
+        chunk=td1h,
+        as_frame=True,
+        reducer=merge_query_results,
+    )
+    assert [len(f) for f in frames] == [len(r) for r in expected]
+
+
+def test_query_chunked_pool_sizes(client):
+    timeperiods = [(start + i * td1h, start + (i + 1) * td1h) for i in range(4)]
+    expected = client.query("RETURN = events;", timeperiods)
+    # As held by a concurrent call with max_workers=2, it was shut down by the call below
+    pool = client._get_pool("query", 2)
+    assert (
+        client.query_chunked("RETURN = events;", timeperiods, max_workers=3) == expected
+    )
+    assert pool.submit(lambda: 1).result() == 1
+    assert client._get_pool("query", 2) is pool
@@ -0,0 +1,223 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient, QueryCache
+from aw_client.client import day_period
+from aw_client.querycache import MISS
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+td1d = timedelta(days=1)
+server_id = "server"
+
+
+class CountingServer(StandInServer):
+    def __init__(self):
+        super().__init__()
+        self.queried_periods = 0
+
+    def _query(self, body):
+        self.queried_periods += len(body["timeperiods"])
+        return super()._query(body)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = QueryCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def server_class():
+    return CountingServer
+
+
+def _with_events(client: ActivityWatchClient) -> ActivityWatchClient:
+    client.create_bucket("test", "test")
+    client.insert_events(
+        "test",
+        [Event(timestamp=start + i * td1d / 4, duration=60) for i in range(12)],
+    )
+    return client
+
+
+def test_query_uses_cache(server, cache, make_client):
+    client = _with_events(make_client(server, query_cache=cache))
+    days = [(start + i * td1d, start + (i + 1) * td1d) for i in range(3)]
+
+    result = client.query("RETURN = events;", days[:2])
+    assert server.queried_periods == 2
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # Only the period that isn't cached is sent to the server
+    assert client.query("RETURN = events;", days) == result + client.query(
+        "RETURN = events;", days[2:]
+    )
+    assert server.queried_periods == 3
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # Different queries don't share results
+    client.query("events = [];\nRETURN = events;", days[:1])
+    assert server.queried_periods == 4
+
+    expected = client.query("RETURN = events;", days)
+    frames = client.query("RETURN = events;", days, as_frame=True)
+    assert [len(f) for f in frames] == [len(r) for r in expected]
+    assert server.queried_periods == 4
+    client.disconnect()
+
+
+def test_cache_survives_restart(server, tmp_path, make_client):
+    days = [(start, start + td1d)]
+    cache = QueryCache(str(tmp_path / "cache.sqlite"))
+    client = _with_events(make_client(server, query_cache=cache))
+    result = client.query("RETURN = events;", days)
+    client.disconnect()
+    cache.close()
+
+    cache = QueryCache(str(tmp_path / "cache.sqlite"))
+    client.query_cache = cache
+    assert client.query("RETURN = events;", days) == result
+    assert server.queried_periods == 1
+    assert cache.hits == 1
+    cache.close()
+
+
+def test_cache_from_older_version(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE results (key TEXT PRIMARY KEY, query TEXT NOT NULL, value TEXT NOT NULL,"
+        " size INTEGER NOT NULL, expires REAL, accessed REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO results VALUES ('k', 'q', '1', 1, NULL, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = QueryCache(path)
+    assert cache.size == 0
+    cache.put(server_id, "q", (start, start + td1d), 1)
+    assert cache.get(server_id, "q", (start, start + td1d)) == 1
+    cache.close()
+
+
+def test_ttl_for_current_period(cache):
+    cache.ttl = timedelta(seconds=0.2)
+    now = datetime.now(timezone.utc)
+    past = (now - 2 * td1d, now - td1d)
+    current = (now - td1d, now + td1d)
+    cache.put(server_id, "q", past, [1])
+    cache.put(server_id, "q", current, [2])
+    assert cache.get(server_id, "q", current) == [2]
+
+    time.sleep(0.3)
+    assert cache.get(server_id, "q", current) is MISS
+    assert cache.get(server_id, "q", past) == [1]
+
+
+def test_lru_eviction(cache):
+    cache.max_size = 100
+    period = lambda i: (start + i * td1d, start + (i + 1) * td1d)  # noqa: E731
+    for i in range(4):
+        cache.put(server_id, "q", period(i), "x" * 20)
+    # Use the oldest one, so that the second one is least recently used
+    cache.get(server_id, "q", period(0))
+    cache.put(server_id, "q", period(4), "x" * 20)
+    assert cache.size <= 100
+    assert cache.get(server_id, "q", period(0)) == "x" * 20
+    assert cache.get(server_id, "q", period(1)) is MISS
+    assert cache.get(server_id, "q", period(4)) == "x" * 20
+
+
+def test_invalidate(cache):
+    period = (start, start + td1d)
+    cache.put(server_id, "q1", period, 1)
+    cache.put("other server", "q1", period, 1)
+    cache.put(server_id, "q2", period, 2)
+
+    cache.invalidate("q1")
+    assert cache.get(server_id, "q1", period) is MISS
+    assert cache.get("other server", "q1", period) is MISS
+    assert cache.get(server_id, "q2", period) == 2
+
+    cache.invalidate()
+    assert cache.get(server_id, "q2", period) is MISS
+    assert cache.size == 0
+
+
+def test_invalidate_timeperiod(cache):
+    day = lambda i: (start + i * td1d, start + (i + 1) * td1d)  # noqa: E731
+    for i in range(3):
+        cache.put(server_id, "q1", day(i), i)
+        cache.put(server_id, "q2", day(i), i)
+
+    # Only results of periods that overlap the invalidated one
+    cache.invalidate("q1", (start + td1d, start + td1d + timedelta(hours=1)))
+    assert [cache.get(server_id, "q1", day(i)) for i in range(3)] == [0, MISS, 2]
+    assert [cache.get(server_id, "q2", day(i)) for i in range(3)] == [0, 1, 2]
+
+    cache.invalidate(timeperiod=day(2))
+    assert cache.get(server_id, "q1", day(2)) is MISS
+    assert cache.get(server_id, "q2", day(2)) is MISS
+    assert cache.get(server_id, "q2", day(0)) == 0
+
+
+def test_query_by_day(server, cache, make_client):
+    client = _with_events(make_client(server, query_cache=cache))
+    days = client.query_by_day(
+        "RETURN = events;", start.date(), start.date() + 2 * td1d, tz=timezone.utc
+    )
+    assert list(days) == [start.date() + i * td1d for i in range(3)]
+    assert days == {
+        day: client.query("RETURN = events;", [day_period(day, tz=timezone.utc)])[0]
+        for day in days
+    }
+    assert server.queried_periods == 3
+
+    # Only the day that isn't cached yet is queried
+    more_days = client.query_by_day(
+        "RETURN = events;", start.date(), start.date() + 3 * td1d, tz=timezone.utc
+    )
+    assert server.queried_periods == 4
+    assert list(more_days.values())[:3] == list(days.values())
+
+    # Only the refreshed day, and the day invalidated in the cache, are queried again
+    second = start.date() + td1d
+    client.query_by_day(
+        "RETURN = events;",
+        start.date(),
+        start.date() + 3 * td1d,
+        tz=timezone.utc,
+        refresh=[second],
+    )
+    assert server.queried_periods == 5
+    cache.invalidate("RETURN = events;", day_period(second, tz=timezone.utc))
+    client.query_by_day(
+        "RETURN = events;", start.date(), start.date() + 3 * td1d, tz=timezone.utc
+    )
+    assert server.queried_periods == 6
+
+    # Days that haven't ended are only cached for the TTL
+    cache.ttl = timedelta(0)
+    today = datetime.now(timezone.utc).date()
+    client.query_by_day("RETURN = events;", today, today, tz=timezone.utc)
+    client.query_by_day("RETURN = events;", today, today, tz=timezone.utc)
+    assert server.queried_periods == 8
+    client.disconnect()
+
+
+def test_day_period():
+    day = start.date()
+    offset = timedelta(hours=4)
+    assert day_period(day, offset, timezone.utc) == (
+        start + offset,
+        start + td1d + offset,
+    )
+    period_start, period_end = day_period(day)
+    assert period_start.tzinfo is not None
+    assert period_start.hour == 0
@@ -0,0 +1,170 @@
+import os
+import time
+
+from aw_client.queuebackend import (
+    LogQueueBackend,
+    QueuedRequest,
+    SQLiteQueueBackend,
+    _queue_path,
+    open_queue_backend,
+)
+
+
+def _requests(n: int, offset: int = 0):
+    return [
+        QueuedRequest(
+            f"buckets/{'ab'[i % 2]}/heartbeat?pulsetime=2",
+            {"timestamp": f"2024-01-01T00:00:{i % 60:02}", "data": {"n": i}},
+        )
+        for i in range(offset, offset + n)
+    ]
+
+
+def _segments(path: str):
+    return sorted(name for name in os.listdir(path) if name.endswith(".seg"))
+
+
+def test_read_ack_reopen(tmp_path):
+    path = str(tmp_path / "queue")
+    backend = LogQueueBackend(path)
+    for r in _requests(10):
+        backend.put(r)
+    assert backend.qsize() == 10
+    assert backend.read(4) == _requests(4)
+    backend.ack()
+    # Read but not acknowledged
+    assert backend.read(3) == _requests(3, offset=4)
+    assert backend.qsize() == 3
+    backend.close()
+
+    backend = LogQueueBackend(path)
+    assert backend.qsize() == 6
+    assert backend.read(100) == _requests(6, offset=4)
+    backend.put(_requests(1, offset=10)[0])
+    assert backend.read(100) == _requests(1, offset=10)
+    assert backend.read(100) == []
+    backend.close()
+
+
+def test_acknowledged_segments_deleted(tmp_path):
+    path = str(tmp_path / "queue")
+    backend = LogQueueBackend(path, segment_size=1000)
+    for r in _requests(100):
+        backend.put(r)
+    n_segments = len(_segments(path))
+    assert n_segments > 5
+
+    assert backend.read(50) == _requests(50)
+    backend.ack()
+    assert 1 < len(_segments(path)) < n_segments
+    assert backend.read(100) == _requests(50, offset=50)
+    backend.ack()
+    # The active segment is kept
+    assert len(_segments(path)) == 1
+    backend.close()
+    assert LogQueueBackend(path).qsize() == 0
+
+
+def test_torn_tail(tmp_path):
+    path = str(tmp_path / "queue")
+    backend = LogQueueBackend(path)
+    for r in _requests(5):
+        backend.put(r)
+    backend.close()
+    last = os.path.join(path, _segments(path)[-1])
+    size = os.path.getsize(last)
+    with open(last, "ab") as f:
+        # Half a record, as left by a crash in the middle of a write
+        f.write(b"\x40\x00\x00\x00\x12\x34")
+
+    backend = LogQueueBackend(path)
+    assert os.path.getsize(last) == size
+    assert backend.qsize() == 5
+    backend.put(_requests(1, offset=5)[0])
+    assert backend.read(100) == _requests(6)
+    backend.close()
+
+
+def test_group_commit(tmp_path):
+    backend = LogQueueBackend(str(tmp_path / "a"), sync_interval=0.1)
+    for r in _requests(50):
+        backend.put(r)
+    assert backend.syncs == 0
+    time.sleep(0.3)
+    assert backend.syncs == 1
+    backend.close()
+
+    backend = LogQueueBackend(str(tmp_path / "b"), sync_interval=10, sync_bytes=1000)
+    for r in _requests(50):
+        backend.put(r)
+    assert 0 < backend.syncs < 50
+    assert backend.syncs <= backend.bytes_written // 1000
+    backend.close()
+
+    backend = LogQueueBackend(str(tmp_path / "c"), sync_interval=0)
+    for r in _requests(5):
+        backend.put(r)
+    assert backend.syncs == 5
+    backend.close()
+
+
+def _merge_pairs(requests):
+    """Keeps every other request, as a stand-in for merging heartbeats."""
+    return requests[::2]
+
+
+def test_compact(tmp_path):
+    path = str(tmp_path / "queue")
+    backend = LogQueueBackend(path, segment_size=1000)
+    for r in _requests(100):
+        backend.put(r)
+    # Read but not acknowledged, so left as is
+    assert backend.read(10) == _requests(10)
+    size = backend.size()
+
+    result = backend.compact(_merge_pairs, chunk_size=10)
+    assert result is not None
+    assert result["requests_before"] == 90
+    assert result["requests_after"] == backend.qsize() == 45
+    assert result["bytes_after"] == backend.size() < size * 0.6
+
+    # Only requests put since are compacted again
+    for r in _requests(10, offset=100):
+        backend.put(r)
+    result = backend.compact(_merge_pairs)
+    assert result is not None and result["requests_after"] == 50
+    expected = _merge_pairs(_requests(90, offset=10)) + _requests(10, offset=100)[::2]
+    backend.close()
+
+    backend = LogQueueBackend(path)
+    assert backend.read(1000) == _requests(10) + expected
+    backend.close()
+
+
+def test_compact_max_size(tmp_path):
+    backend = LogQueueBackend(str(tmp_path / "queue"), segment_size=1000)
+    for r in _requests(200):
+        backend.put(r)
+    result = backend.compact(lambda requests: requests, max_size=5000)
+    assert result is not None
+    assert result["dropped"] > 0
+    assert result["bytes_after"] <= 5000
+    # The oldest requests are dropped
+    assert backend.read(1000) == _requests(200)[result["dropped"] :]
+    backend.close()
+
+
+def test_moved_from_sqlite():
+    name = "test-queuebackend"
+    old_path = _queue_path(name, True, 1, "persistqueue")
+    old = SQLiteQueueBackend(old_path)
+    for r in _requests(30):
+        old.put(r)
+    assert old.read(10) == _requests(10)
+    old.ack()
+    old.close()
+
+    backend = open_queue_backend(name, True, 2)
+    assert not os.path.exists(old_path)
+    assert backend.read(100) == _requests(20, offset=10)
+    backend.close()
@@ -0,0 +1,138 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.reconnect import Backoff, CircuitBreaker
+
+
+def test_backoff():
+    backoff = Backoff(initial=0.5, maximum=10, rng=lambda: 0.0)
+    assert [backoff.next() for _ in range(7)] == [0.5, 1, 2, 4, 8, 10, 10]
+    backoff.reset()
+    assert backoff.next() == 0.5
+    # Jittered delays are between half the delay and the delay
+    backoff = Backoff(initial=0.5, maximum=10, rng=lambda: 1.0)
+    assert backoff.next() == 0.25
+    for _ in range(2000):
+        backoff.next()
+    assert backoff.next() == 5
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=3)
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.is_open
+    breaker.failure()
+    assert breaker.is_open
+    # A single failure while half-open opens it again
+    breaker.half_open()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.failure()
+    assert breaker.is_open and breaker.trips == 2
+    breaker.half_open()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def _client(port: int) -> ActivityWatchClient:
+    client = ActivityWatchClient("test-reconnect", host="127.0.0.1", port=port)
+    client.create_bucket("test-reconnect", "test", queued=True)
+    client.connect()
+    return client
+
+
+def _queue(client: ActivityWatchClient, n: int) -> None:
+    now = datetime.now(timezone.utc)
+    for i in range(n):
+        event = Event(timestamp=now + timedelta(seconds=i), data={"n": i})
+        client.request_queue.add_request(
+            "buckets/test-reconnect/heartbeat?pulsetime=0", event.to_json_dict()
+        )
+
+
+def _wait_for_events(server: StandInServer, n: int, timeout: float = 10) -> float:
+    """Returns how long it took for the server to have `n` events."""
+    start = time.perf_counter()
+    while len(server.events.get("test-reconnect", [])) < n:
+        assert time.perf_counter() - start < timeout
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def test_time_to_resume():
+    server = StandInServer().start()
+    port = server.port
+    client = _client(port)
+    _queue(client, 1)
+    _wait_for_events(server, 1)
+
+    # Restarted after a second, with heartbeats queued in the meantime
+    server.stop()
+    _queue(client, 5)
+    time.sleep(1)
+    server = StandInServer(port).start()
+    time_to_resume = _wait_for_events(server, 5)
+    # Was up to _attempt_reconnect_interval (10s)
+    assert time_to_resume < 3, f"Resumed {time_to_resume:.2f}s after restart"
+    assert client.request_queue.breaker.trips == 1
+    client.disconnect()
+    server.stop()
+
+
+def test_server_errors():
+    server = StandInServer().start()
+    failures: List[float] = []
+
+    class FailingServer(StandInServer):
+        def handle(self, method, parts, params, body):
+            if parts[-1:] == ["heartbeat"] and len(failures) < 5:
+                failures.append(time.perf_counter())
+                return 500, {"message": "internal server error"}
+            return super().handle(method, parts, params, body)
+
+    server.stop()
+    server = FailingServer(server.port).start()
+    client = _client(server.port)
+    client.request_queue.backoff = Backoff(initial=0.05, maximum=0.4)
+    _queue(client, 3)
+    # Retried until the server recovers, none are dropped
+    _wait_for_events(server, 3)
+    assert client.request_queue.breaker.trips >= 1
+    # Retries back off instead of hammering the server
+    gaps = [b - a for a, b in zip(failures, failures[1:])]
+    assert gaps[-1] > gaps[0]
+    client.disconnect()
+    server.stop()
+
+
+def test_reconnect_warnings(caplog):
+    server = StandInServer().start()
+    server.stop()
+    client = ActivityWatchClient("test-reconnect", host="127.0.0.1", port=server.port)
+    client.create_bucket("test-reconnect", "test", queued=True)
+    client.request_queue.backoff = Backoff(initial=0.01, maximum=0.02)
+    client.request_queue._attempt_reconnect_interval = 0.25
+    with caplog.at_level("DEBUG", logger="aw_client.client"):
+        client.connect()
+        time.sleep(0.6)
+        client.disconnect()
+    logged = [r for r in caplog.records if r.msg.startswith("Not connected")]
+    warnings = [r for r in logged if r.levelname == "WARNING"]
+    # Retried every 20ms, but only warned about on the first attempt and every 0.25s
+    assert len(logged) > 10
+    assert 2 <= len(warnings) <= 4
+
+
+def test_get_missing_event():
+    server = StandInServer().start()
+    client = ActivityWatchClient("test-reconnect", host="127.0.0.1", port=server.port)
+    client.create_bucket("test-reconnect", "test")
+    # A 404 response is falsy, it was raised instead of returning None
+    assert client.get_event("test-reconnect", 1) is None
+    client.disconnect()
+    server.stop()
@@ -0,0 +1,207 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+from stand_in_server import StandInServer
+
+from aw_client import ActivityWatchClient
+from aw_client.localquery import LocalQueryEngine
+from aw_client.replica import Replica
+from aw_client.transport import HTTPTransport
+
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(n: int, offset: int = 0):
+    return [
+        Event(
+            timestamp=start + timedelta(minutes=offset + i),
+            duration=30,
+            data={"app": f"app{i % 3}", "title": "é" * (i % 4)},
+        )
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def client(server, make_client):
+    client = make_client(server)
+    client.create_bucket("window", "currentwindow")
+    client.create_bucket("afk", "afkstatus")
+    client.insert_events("window", _events(50))
+    client.insert_events(
+        "afk",
+        [Event(timestamp=start, duration=3600, data={"status": "not-afk"})],
+    )
+    yield client
+    client.disconnect()
+
+
+def _replica(client, tmp_path, **kwargs) -> Replica:
+    kwargs.setdefault("trailing_window", timedelta(minutes=10))
+    kwargs.setdefault("sync_interval", timedelta(0))
+    return Replica(client, str(tmp_path / "replica"), **kwargs)
+
+
+def _same(replicated, events) -> None:
+    assert [(e.id, e.timestamp, e.duration, e.data) for e in replicated] == [
+        (e.id, e.timestamp, e.duration, e.data) for e in events
+    ]
+
+
+def test_sync(client, tmp_path):
+    replica = _replica(client, tmp_path)
+    assert replica.sync() == {"window": 50, "afk": 1}
+    _same(replica.get_events("window", sync=False), client.get_events("window"))
+    assert replica.buckets["afk"]["type"] == "afkstatus"
+
+    # Only the trailing window is fetched again
+    client.insert_events("window", _events(5, offset=50))
+    assert replica.sync(["window"]) == {"window": 16}
+    _same(replica.get_events("window", sync=False), client.get_events("window"))
+
+
+def test_heartbeat_and_delete_in_window(client, tmp_path):
+    replica = _replica(client, tmp_path)
+    replica.sync()
+    last = client.get_events("window", limit=1)[0]
+    client.heartbeat(
+        "window",
+        Event(timestamp=last.timestamp + timedelta(seconds=50), data=last.data),
+        pulsetime=60,
+    )
+    client.delete_event("window", client.get_events("window", limit=2)[1].id)
+    replica.sync()
+    events = replica.get_events("window", sync=False)
+    assert len(events) == 49
+    assert events[0].duration == timedelta(seconds=50)
+    _same(events, client.get_events("window"))
+
+
+def test_segments(client, tmp_path, monkeypatch):
+    replica = _replica(client, tmp_path, segment_size=7)
+    with monkeypatch.context() as m:
+        # The first sync pages through the bucket instead
+        m.setattr(client, "get_events", None)
+        replica.sync(["window"])
+    directory = tmp_path / "replica" / "window"
+    before = {
+        name: os.stat(directory / name).st_mtime_ns for name in os.listdir(directory)
+    }
+    assert len([name for name in before if name.endswith(".columns")]) == 8
+
+    client.insert_events("window", _events(1, offset=50))
+    replica.sync(["window"])
+    after = set(os.listdir(directory))
+    # Segments before the trailing window are untouched, the last ones are replaced. Paged
+    # from the newest event, the oldest segment only holds the 50 % 7 remaining events.
+    kept = [name for name in before if name in after and name != "manifest.json"]
+    assert len(kept) == 2 * 6
+    assert all(os.stat(directory / name).st_mtime_ns == before[name] for name in kept)
+    _same(replica.get_events("window", sync=False), client.get_events("window"))
+
+
+def test_cropped_by_server(server, client, tmp_path):
+    # Like aw-server-rust, which crops events to the requested range
+    def get_events(bucket_id, params):
+        events = StandInServer._get_events(server, bucket_id, {})
+        if "start" in params:
+            start = datetime.fromisoformat(params["start"])
+            cropped = []
+            for e in events:
+                ts = datetime.fromisoformat(e["timestamp"])
+                end = ts + timedelta(seconds=e["duration"])
+                if end >= start:
+                    ts = max(ts, start)
+                    e = dict(e, timestamp=ts.isoformat())
+                    cropped.append(dict(e, duration=(end - ts).total_seconds()))
+            events = cropped
+        return events
+
+    replica = _replica(client, tmp_path, trailing_window=timedelta(seconds=90))
+    replica.sync(["afk"])
+    server._get_events = get_events
+    client.insert_events(
+        "afk", [Event(timestamp=start + timedelta(hours=2), duration=1, data={})]
+    )
+    replica.sync(["afk"])
+    events = replica.get_events("afk", sync=False)
+    assert [(e.timestamp - start, e.duration) for e in events] == [
+        (timedelta(hours=2), timedelta(seconds=1)),
+        (timedelta(0), timedelta(hours=1)),
+    ]
+
+
+def test_range_reads(client, tmp_path):
+    replica = _replica(client, tmp_path)
+    events = replica.get_events(
+        "window",
+        start=start + timedelta(minutes=10, seconds=15),
+        end=start + timedelta(minutes=20, seconds=45),
+        limit=3,
+    )
+    assert [(e.timestamp - start, e.duration) for e in events] == [
+        (timedelta(minutes=20), timedelta(seconds=30)),
+        (timedelta(minutes=19), timedelta(seconds=30)),
+        (timedelta(minutes=18), timedelta(seconds=30)),
+    ]
+    frame = replica.get_events(
+        "window", start=start + timedelta(minutes=10, seconds=15), as_frame=True
+    )
+    assert frame[-1].timestamp == start + timedelta(minutes=10, seconds=15)
+    assert frame[-1].duration == timedelta(seconds=15)
+
+
+def test_offline(server, client, tmp_path):
+    replica = _replica(client, tmp_path)
+    replica.sync()
+    expected = client.get_events("window")
+    timeperiods = [(start, start + timedelta(hours=2))]
+    query = 'RETURN = query_bucket("window");'
+    server.stop()
+
+    # A new replica on the same directory, while the server is down
+    replica = _replica(client, tmp_path)
+    _same(replica.get_events("window"), expected)
+    engine = LocalQueryEngine.from_export(
+        {"buckets": {"window": {"id": "window", "events": expected}}}
+    )
+    assert replica.query(query, timeperiods) == engine.query(query, timeperiods)
+
+
+def test_slow_server(server, client, tmp_path):
+    replica = _replica(client, tmp_path)
+    replica.sync()
+
+    class SlowServer(StandInServer):
+        def handle(self, method, parts, params, body):
+            time.sleep(1)
+            return super().handle(method, parts, params, body)
+
+    slow = SlowServer().start()
+    slow.buckets, slow.events = server.buckets, server.events
+    slow_client = ActivityWatchClient(
+        "test-replica",
+        host="127.0.0.1",
+        port=slow.port,
+        transport=HTTPTransport(timeout=0.2),
+    )
+    replica = _replica(slow_client, tmp_path)
+    t = time.perf_counter()
+    assert len(replica.get_events("window")) == 50
+    assert time.perf_counter() - t < 0.8
+    slow_client.disconnect()
+    slow.stop()
+
+
+def test_sync_interval(server, client, tmp_path):
+    replica = _replica(client, tmp_path, sync_interval=timedelta(hours=1))
+    replica.get_events("window")
+    requests = server.request_count
+    client.insert_events("window", _events(1, offset=50))
+    assert len(replica.get_events("window")) == 50
+    assert server.request_count == requests + 1
+    replica.sync()
+    assert len(replica.get_events("window")) == 51
@@ -13,7 +13,7 @@ from logging import basicConfig, DEBUG
 basicConfig(level=DEBUG)
 
 import requests
-from aw_client.client import RequestQueue
+from aw_client.client import QueuedRequest, RequestQueue, coalesce_heartbeats
 
 
 class MockClient:
@@ -21,6 +21,7 @@ class MockClient:
 
     def __init__(self):
         self.testing = True
+        self.posted = []
 
     def get_buckets(self, *args, **kwargs):
         print("Called get_buckets")
@@ -31,6 +32,7 @@ class MockClient:
 
     def _post(self, *args, **kwargs):
         print(args, kwargs)
+        self.posted.append(args)
         return requests.Response()
 
 
@@ -60,3 +62,117 @@ def test_complex():
     sleep(1)
     rq.stop()
     rq.join()
+
+
+def _heartbeats(bucket_id: str, n: int, pulsetime: float = 5, start=None):
+    from datetime import datetime, timedelta, timezone
+
+    from aw_core.models import Event
+
+    start = start or datetime(2024, 1, 1, tzinfo=timezone.utc)
+    endpoint = f"buckets/{bucket_id}/heartbeat?pulsetime={pulsetime}"
+    for i in range(n):
+        # Switch data every 10 heartbeats, and leave a gap longer than pulsetime every 25
+        e = Event(
+            timestamp=start + timedelta(seconds=i + 10 * (i // 25)),
+            data={"label": str(i // 10)},
+        )
+        yield QueuedRequest(endpoint, e.to_json_dict())
+
+
+def test_coalesce_heartbeats():
+    from stand_in_server import StandInServer
+
+    requests_a = list(_heartbeats("a", 100))
+    requests_b = list(_heartbeats("b", 100, pulsetime=1))
+    interleaved = [r for pair in zip(requests_a, requests_b) for r in pair]
+    coalesced = coalesce_heartbeats(interleaved)
+    assert len(coalesced) < len(interleaved) / 5
+
+    # What ends up on the server must be the same
+    def apply(queued):
+        server = StandInServer()
+        for bucket_id in ["a", "b"]:
+            server.handle("POST", ["buckets", bucket_id], {}, {"type": "test"})
+        for r in queued:
+            path, pulsetime = r.endpoint.split("?pulsetime=")
+            server.handle("POST", path.split("/"), {"pulsetime": pulsetime}, r.data)
+        server.server_close()
+        return {
+            bid: [(e["timestamp"], e["duration"], e["data"]) for e in events]
+            for bid, events in server.events.items()
+        }
+
+    assert apply(coalesced) == apply(interleaved)
+
+
+def test_batched_dispatch():
+    client = MockClient()
+    rq = RequestQueue(client)  # type: ignore
+    queued = list(_heartbeats("test", 250))
+    for r in queued:
+        rq.add_request(r.endpoint, r.data)
+
+    rq._try_connect = lambda: True  # type: ignore
+    rq.connected = True
+    rq.start()
+    sleep(1)
+    rq.stop()
+    rq.join()
+
+    assert rq._backend.qsize() == 0
+    # Windows of 100 start on a label change, so batching doesn't split any merges here
+    assert len(client.posted) == len(coalesce_heartbeats(queued)) < 50
+
+
+def test_wakeup_on_add_request():
+    client = MockClient()
+    rq = RequestQueue(client)  # type: ignore
+    rq._try_connect = lambda: True  # type: ignore
+    rq.connected = True
+
+    polls = 0
+    get_next = rq._get_next
+
+    def counted_get_next():
+        nonlocal polls
+        polls += 1
+        return get_next()
+
+    rq._get_next = counted_get_next  # type: ignore
+    rq.start()
+    sleep(1)
+    # An idle queue thread should block instead of polling
+    assert polls <= 1
+
+    rq.add_request(
+        "buckets/test/heartbeat?pulsetime=0", {"timestamp": "2024-01-01T00:00:00+00:00"}
+    )
+    sleep(0.1)
+    assert len(client.posted) == 1
+
+    rq.stop()
+    rq.join(timeout=1)
+    assert not rq.is_alive()
+
+
+def test_compaction_on_start():
+    from datetime import datetime, timedelta, timezone
+
+    client = MockClient()
+    rq = RequestQueue(client, max_age=timedelta(days=7))  # type: ignore
+    recent = list(
+        _heartbeats("a", 100, start=datetime.now(timezone.utc) - timedelta(hours=1))
+    )
+    for r in list(_heartbeats("a", 100)) + recent:
+        rq.add_request(r.endpoint, r.data)
+
+    rq._try_connect = lambda: False  # type: ignore
+    rq.start()
+    sleep(0.5)
+    rq.stop()
+    rq.join()
+
+    # Heartbeats older than max_age are dropped, and the others merged
+    assert rq._backend.read(1000) == coalesce_heartbeats(recent)
+    rq.close()
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from aw_client.classes import default_classes, get_classes
+
+classes = [{"name": ["Work"], "rule": {"type": "regex", "regex": "vim"}}]
+
+
+@pytest.fixture
+def client(server, make_client):
+    client = make_client(server)
+    yield client
+    client.disconnect()
+
+
+def test_get_classes_fetched_once(server, client):
+    client.set_setting("classes", classes)  # type: ignore
+    requests_before = server.request_count
+    first = get_classes(client)
+    for _ in range(10):
+        assert get_classes(client) == [(["Work"], {"type": "regex", "regex": "vim"})]
+        # Mapped once from the cached setting
+        assert get_classes(client) is first
+    assert server.request_count == requests_before + 1
+
+
+def test_get_classes_fallback(client):
+    assert get_classes(client) == default_classes
+
+
+def test_set_setting_invalidates(client):
+    client.set_setting("test", "a")
+    assert client.settings.get("test") == "a"
+    client.set_setting("test", "b")
+    assert client.settings.get("test") == "b"
+
+
+def test_ttl_refresh(server, client):
+    client.set_setting("test", "a")
+    client.settings.ttl = timedelta(seconds=0.1)
+    client.settings.background_refresh = False
+    assert client.settings.get("test") == "a"
+    server.settings["test"] = "b"
+    assert client.settings.get("test") == "a"
+    time.sleep(0.2)
+    assert client.settings.get("test") == "b"
+
+
+def test_background_refresh(server, client):
+    client.set_setting("test", "a")
+    client.settings.ttl = timedelta(seconds=0.1)
+    assert client.settings.get("test") == "a"
+    server.settings["test"] = "b"
+    time.sleep(0.2)
+    # The stale value is returned while it is refreshed
+    assert client.settings.get("test") == "a"
+    for _ in range(50):
+        if client.settings.get("test") == "b":
+            break
+        time.sleep(0.02)
+    assert client.settings.get("test") == "b"
@@ -0,0 +1,116 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+
+from aw_client.transport import HTTPTransport, compress
+
+
+def test_connection_reuse(server, make_client):
+    client = make_client(server)
+    client.create_bucket("test", "test")
+    event = Event(timestamp=datetime.now(timezone.utc), data={"label": "a"})
+    for _ in range(20):
+        client.heartbeat("test", event, pulsetime=60)
+    assert server.request_count == 21
+    assert server.connection_count == 1
+    client.disconnect()
+
+
+def test_threads_get_separate_sessions(server, make_client):
+    client = make_client(server)
+    client.get_info()
+
+    def worker():
+        for _ in range(5):
+            client.get_info()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert server.request_count == 21
+    assert server.connection_count == 5
+    # Sessions of threads that ended are closed, with their connections
+    assert len(client.transport._sessions) == 1
+    for _ in range(50):
+        if len(server.connections) == 1:
+            break
+        time.sleep(0.01)
+    assert len(server.connections) == 1
+    client.disconnect()
+
+
+def test_disconnect_closes_and_reopens(server, make_client):
+    transport = HTTPTransport(pool_size=2, timeout=(1, 5))
+    client = make_client(server, transport=transport)
+    client.get_info()
+    client.disconnect()
+    assert len(transport._sessions) == 0
+
+    # The transport is still usable after being closed
+    client.get_info()
+    assert server.connection_count == 2
+    client.disconnect()
+
+
+def _events(n: int):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        Event(
+            timestamp=start + timedelta(seconds=i),
+            duration=1,
+            data={"app": "Firefox", "title": "ActivityWatch - Mozilla Firefox"},
+        )
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("compression", ["gzip", "deflate"])
+def test_request_compression(server, compression, make_client):
+    transport = HTTPTransport(compression=compression, compression_threshold=1024)
+    client = make_client(server, transport=transport)
+    client.create_bucket("test", "test")
+
+    # Below the threshold, sent as-is
+    received = server.bytes_received
+    client.insert_events("test", _events(1))
+    small = server.bytes_received - received
+    assert small < 1024
+
+    received = server.bytes_received
+    client.insert_events("test", _events(1000))
+    compressed = server.bytes_received - received
+    # Repetitive events compress well
+    assert compressed < 1000 * small / 10
+
+    assert len(server.events["test"]) == 1001
+    assert client.get_events("test", limit=1)[0].data["app"] == "Firefox"
+    client.disconnect()
+
+
+def test_response_compression(server, make_client):
+    server.compress_responses = True
+    client = make_client(server)
+    client.create_bucket("test", "test")
+    client.insert_events("test", _events(1000))
+
+    sent = server.bytes_sent
+    assert len(client.get_events("test")) == 1000
+    assert len(client.get_events("test", as_frame=True)) == 1000
+    assert len(list(client.stream_events("test"))) == 1000
+    assert len(client.export_bucket("test")["buckets"]["test"]["events"]) == 1000
+    # Four responses of 1000 events, each far smaller than uncompressed
+    assert server.bytes_sent - sent < 4 * 1000 * 20
+    client.disconnect()
+
+
+def test_compression_invalid():
+    with pytest.raises(ValueError):
+        HTTPTransport(compression="br")
+    with pytest.raises(ValueError):
+        compress(b"", "br")